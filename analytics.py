@@ -0,0 +1,441 @@
+"""Aggregate statistics over the quiz answer history.
+
+Answer records (as written by submit_quiz_answer to the event log, or to a
+JSONL export of it) are converted into NumPy columns, a chunk at a time:
+
+    user      int32   dictionary-encoded user id
+    reference int8    pitch class of the reference note (C=0 ... B=11)
+    target    int8    pitch class of the target note
+    answer    int8    pitch class of the given answer (-1 if unknown)
+    correct   bool
+    day       int32   days since 1970-01-01 (-1 if the timestamp is missing or malformed)
+    response  float32 response time in ms (NaN if not reported)
+
+Global aggregates are plain count arrays, built with np.bincount, so adding
+more records only touches the new rows. Per-user aggregates are kept up to
+date the same way, but sparse: one dict per user from a counter key (see
+USER_KEYS) to its count, since a user only ever touches a few cells. A
+user's summary is then a lookup, not a pass over every row. Only the
+aggregates are kept; the columns are dropped once they've been counted.
+
+Typical use::
+
+    stats = AnswerAnalytics()
+    stats.ingest_jsonl('answers.jsonl')   # or stats.ingest(records)
+    stats.summary()
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import click
+import numpy as np
+
+from event_log import EventLogReader
+from music_theory import NOTE_NAMES, pitch_class
+
+try:
+    import orjson  # Optional, about 3x faster to parse large dumps
+except ImportError:
+    orjson = None
+
+
+# Response time histogram: log-spaced bins from 100 ms to 2 minutes
+RESPONSE_BINS = np.geomspace(100, 120000, 49)
+TREND_WINDOW_DAYS = 7
+
+PARSE_CHUNK = 100000  # Records converted to columns at a time
+REFRESH_SECONDS = 10  # How stale the live /analytics numbers can get
+
+# Per-user counter keys: one range of keys per aggregate
+USER_ATTEMPTS = 0         # + reference * 12 + target
+USER_HITS = 144           # + reference * 12 + target
+USER_CONFUSION = 288      # + target * 12 + answer
+USER_RESPONSE = 432       # + response time bin
+USER_ANSWERS = 1000       # Every answer
+USER_DAYS = 1024          # + day * 2 (answers) or day * 2 + 1 (correct answers)
+USER_KEYS = 1 << 20       # Room for days until the year 3400
+
+# Count arrays saved and loaded by AnswerAnalytics.save/load
+AGGREGATES = ('attempts', 'hits', 'confusion', 'response_counts', 'day_attempts', 'day_hits')
+
+
+def _loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+class AnswerAnalytics:
+    def __init__(self):
+        self.users = {}  # user id -> code
+        self.count = 0
+
+        # Running global aggregates, updated per ingested chunk
+        self.attempts = np.zeros(144, dtype=np.int64)   # reference * 12 + target
+        self.hits = np.zeros(144, dtype=np.int64)
+        self.confusion = np.zeros(144, dtype=np.int64)  # target * 12 + answer
+        self.response_counts = np.zeros(len(RESPONSE_BINS) + 1, dtype=np.int64)
+        self.day_attempts = np.zeros(0, dtype=np.int64)
+        self.day_hits = np.zeros(0, dtype=np.int64)
+        self.user_counts = {}  # user code -> {counter key: count}
+
+        # Where the last ingest_jsonl / ingest_log stopped, for incremental runs
+        self.positions = {}
+
+    # Ingestion
+
+    def ingest(self, records):
+        """Add answer records (dicts); anything that isn't an answer is skipped"""
+        batch = []
+        for record in records:
+            if not isinstance(record, dict) or record.get('type', 'answer') != 'answer' or 'target_note' not in record:
+                continue
+            batch.append(record)
+            if len(batch) >= PARSE_CHUNK:
+                self._add_chunk(batch)
+                batch = []
+        if batch:
+            self._add_chunk(batch)
+
+    def ingest_jsonl(self, path):
+        """Read a JSONL dump, starting after the part read by earlier calls"""
+        key = os.path.abspath(path)
+        offset = self.positions.get(key, 0)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+
+            def records():
+                nonlocal offset
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # Partially written last line; pick it up next time
+                    offset += len(line)
+                    if line.strip():
+                        yield _loads(line)
+
+            self.ingest(records())
+        self.positions[key] = offset
+
+    def ingest_log(self, reader):
+        """Read new records from an event_log.EventLogReader"""
+        key = os.path.abspath(reader.directory)
+        if key in self.positions:
+            reader = EventLogReader(reader.directory, self.positions[key])
+        self.ingest(reader)
+        self.positions[key] = dict(reader.position)
+
+    def _add_chunk(self, records):
+        n = len(records)
+        users = self.users
+        user = np.fromiter((users.setdefault(r.get('user_id') or '', len(users)) for r in records),
+                           dtype=np.int32, count=n)
+        # Note names repeat constantly, so look each one up only once
+        codes = {}
+
+        def code(note):
+            value = codes.get(note)
+            if value is None:
+                value = codes[note] = pitch_class(note)
+            return value
+
+        reference = np.fromiter((code(r.get('reference_note', 'C4')) for r in records), dtype=np.int8, count=n)
+        target = np.fromiter((code(r.get('target_note')) for r in records), dtype=np.int8, count=n)
+        answer = np.fromiter((code(r.get('answer')) for r in records), dtype=np.int8, count=n)
+        correct = np.fromiter((bool(r.get('is_correct')) for r in records), dtype=np.bool_, count=n)
+        day = _days([r.get('timestamp') for r in records])
+        response = np.fromiter((r.get('response_ms') if isinstance(r.get('response_ms'), (int, float))
+                                else np.nan for r in records), dtype=np.float32, count=n)
+
+        chunk = {'user': user, 'reference': reference, 'target': target, 'answer': answer,
+                 'correct': correct, 'day': day, 'response': response}
+        self.count += n
+        self._accumulate(chunk)
+
+    def _accumulate(self, chunk):
+        known = (chunk['reference'] >= 0) & (chunk['target'] >= 0)
+        cell = chunk['reference'][known].astype(np.int64) * 12 + chunk['target'][known]
+        self.attempts += np.bincount(cell, minlength=144)
+        self.hits += np.bincount(cell, weights=chunk['correct'][known], minlength=144).astype(np.int64)
+
+        answered = (chunk['target'] >= 0) & (chunk['answer'] >= 0)
+        pairs = chunk['target'][answered].astype(np.int64) * 12 + chunk['answer'][answered]
+        self.confusion += np.bincount(pairs, minlength=144)
+
+        response = chunk['response'][~np.isnan(chunk['response'])]
+        self.response_counts += np.bincount(np.searchsorted(RESPONSE_BINS, response),
+                                            minlength=len(RESPONSE_BINS) + 1)
+
+        dated = chunk['day'] >= 0
+        days = chunk['day'][dated]
+        length = max(len(self.day_attempts), int(days.max()) + 1 if len(days) else 0)
+        self.day_attempts = _grow(self.day_attempts, length) + np.bincount(days, minlength=length)
+        self.day_hits = _grow(self.day_hits, length) + np.bincount(
+            days, weights=chunk['correct'][dated], minlength=length).astype(np.int64)
+
+        self._accumulate_users(chunk, known, cell, answered, pairs, dated)
+
+    def _accumulate_users(self, chunk, known, cell, answered, pairs, dated):
+        """Add the chunk to each user's sparse counters: one np.unique over (user, key) pairs"""
+        user = chunk['user'].astype(np.int64)
+        correct = chunk['correct']
+        response = chunk['response']
+        timed = ~np.isnan(response)
+        days = chunk['day'][dated].astype(np.int64)
+        keys = np.concatenate((
+            user * USER_KEYS + USER_ANSWERS,
+            user[known] * USER_KEYS + USER_ATTEMPTS + cell,
+            user[known][correct[known]] * USER_KEYS + USER_HITS + cell[correct[known]],
+            user[answered] * USER_KEYS + USER_CONFUSION + pairs,
+            user[timed] * USER_KEYS + USER_RESPONSE + np.searchsorted(RESPONSE_BINS, response[timed]),
+            user[dated] * USER_KEYS + USER_DAYS + days * 2,
+            user[dated][correct[dated]] * USER_KEYS + USER_DAYS + days[correct[dated]] * 2 + 1,
+        ))
+        unique, counts = np.unique(keys, return_counts=True)
+        user_counts = self.user_counts
+        for code, key, count in zip((unique // USER_KEYS).tolist(), (unique % USER_KEYS).tolist(), counts.tolist()):
+            counters = user_counts.get(code)
+            if counters is None:
+                counters = user_counts[code] = {}
+            counters[key] = counters.get(key, 0) + count
+
+    # Results
+
+    def summary(self, user_id=None):
+        """Everything as JSON-friendly data; limited to one user if user_id is given"""
+        if user_id is None:
+            attempts, hits, confusion = self.attempts, self.hits, self.confusion
+            response_counts = self.response_counts
+            day_attempts, day_hits = self.day_attempts, self.day_hits
+            total = self.count
+        else:
+            counters = self.user_counts.get(self.users.get(user_id), {})
+            attempts, hits, confusion, response_counts, day_attempts, day_hits = _user_arrays(counters)
+            total = counters.get(USER_ANSWERS, 0)
+
+        return {
+            'answers': total,
+            'accuracy': _ratio(hits.sum(), attempts.sum()),
+            'accuracy_by_reference_target': _pair_table(attempts, hits),
+            'confusion': _confusion_table(confusion),
+            'response_time_ms': _response_summary(response_counts),
+            'daily_trend': _daily_trend(day_attempts, day_hits)
+        }
+
+    # Persistence, so a CLI run only has to read what was appended since the last one
+
+    def save(self, path):
+        """Write the aggregates; per-user counters are stored as (user, key, count) columns"""
+        rows = [(code, key, count) for code, counters in self.user_counts.items() for key, count in counters.items()]
+        user_rows = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, **{name: getattr(self, name) for name in AGGREGATES}, user_counts=user_rows,
+                            meta=np.array(json.dumps({'users': self.users, 'positions': self.positions,
+                                                      'count': self.count})))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        stats = cls()
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            for name in AGGREGATES:
+                setattr(stats, name, data[name])
+            user_rows = data['user_counts']
+        stats.users = meta['users']
+        stats.positions = meta['positions']
+        stats.count = meta['count']
+        for code, key, count in user_rows.tolist():
+            stats.user_counts.setdefault(code, {})[key] = count
+        return stats
+
+
+def _user_arrays(counters):
+    """Dense count arrays (as summary() uses) from one user's sparse counters"""
+    dense = np.zeros(USER_ANSWERS, dtype=np.int64)
+    days = {}
+    for key, count in counters.items():
+        if key < USER_ANSWERS:
+            dense[key] = count
+        elif key >= USER_DAYS:
+            days[key - USER_DAYS] = count
+    length = max(days) // 2 + 1 if days else 0
+    day_counts = np.zeros(length * 2, dtype=np.int64)
+    if days:
+        day_counts[list(days)] = list(days.values())
+    return (dense[USER_ATTEMPTS:USER_HITS], dense[USER_HITS:USER_CONFUSION], dense[USER_CONFUSION:USER_RESPONSE],
+            dense[USER_RESPONSE:USER_RESPONSE + len(RESPONSE_BINS) + 1], day_counts[0::2], day_counts[1::2])
+
+
+def _days(timestamps):
+    """Days since 1970-01-01 for ISO timestamps; -1 where one is missing or malformed"""
+    dates = [timestamp[:10] if isinstance(timestamp, str) else 'NaT' for timestamp in timestamps]
+    try:
+        days = np.array(dates, dtype='datetime64[D]')
+    except ValueError:
+        # Only when a record is bad: convert one by one so the rest of the chunk still counts
+        days = np.array([_day(date) for date in dates], dtype='datetime64[D]')
+    return np.where(np.isnat(days), -1, days.astype(np.int64)).astype(np.int32)
+
+
+def _day(date):
+    try:
+        return np.datetime64(date, 'D')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+def _grow(array, length):
+    if len(array) >= length:
+        return array
+    return np.concatenate((array, np.zeros(length - len(array), dtype=array.dtype)))
+
+
+def _ratio(numerator, denominator):
+    return round(float(numerator) / float(denominator), 4) if denominator else None
+
+
+def _pair_table(attempts, hits):
+    table = []
+    for cell in np.flatnonzero(attempts):
+        reference, target = divmod(int(cell), 12)
+        table.append({'reference': NOTE_NAMES[reference], 'target': NOTE_NAMES[target],
+                      'attempts': int(attempts[cell]), 'accuracy': _ratio(hits[cell], attempts[cell])})
+    return table
+
+
+def _confusion_table(confusion):
+    """{target: {answer: count}}; the off-diagonal entries are the mistakes"""
+    matrix = confusion.reshape(12, 12)
+    return {NOTE_NAMES[t]: {NOTE_NAMES[a]: int(matrix[t, a]) for a in np.flatnonzero(matrix[t])}
+            for t in np.flatnonzero(matrix.sum(axis=1))}
+
+
+def _response_summary(counts):
+    total = int(counts.sum())
+    if not total:
+        return {'count': 0, 'p50': None, 'p90': None, 'p99': None, 'histogram': []}
+
+    # Percentiles from the histogram: geometric midpoint of the bin they fall in
+    edges = np.concatenate(([RESPONSE_BINS[0] / 2], RESPONSE_BINS, [RESPONSE_BINS[-1] * 2]))
+    cumulative = np.cumsum(counts)
+
+    def percentile(q):
+        index = int(np.searchsorted(cumulative, q * total))
+        return round(float(np.sqrt(edges[index] * edges[index + 1])))
+
+    return {
+        'count': total,
+        'p50': percentile(0.5),
+        'p90': percentile(0.9),
+        'p99': percentile(0.99),
+        'histogram': [{'le_ms': round(float(edges[i + 1])), 'count': int(counts[i])} for i in np.flatnonzero(counts)]
+    }
+
+
+def _daily_trend(day_attempts, day_hits):
+    """Accuracy per day plus a rolling TREND_WINDOW_DAYS accuracy"""
+    days = np.flatnonzero(day_attempts)
+    if not len(days):
+        return []
+    first, last = days[0], days[-1] + 1
+    attempts = day_attempts[first:last]
+    hits = day_hits[first:last]
+
+    # Rolling sums via cumulative sums
+    cumulative_attempts = np.concatenate(([0], np.cumsum(attempts)))
+    cumulative_hits = np.concatenate(([0], np.cumsum(hits)))
+    ends = np.arange(1, len(attempts) + 1)
+    starts = np.maximum(ends - TREND_WINDOW_DAYS, 0)
+    window_attempts = cumulative_attempts[ends] - cumulative_attempts[starts]
+    window_hits = cumulative_hits[ends] - cumulative_hits[starts]
+
+    dates = np.arange(first, last).astype('datetime64[D]').astype(str).tolist()
+    return [{'date': dates[i], 'answers': int(attempts[i]), 'accuracy': _ratio(hits[i], attempts[i]),
+             'rolling_accuracy': _ratio(window_hits[i], window_attempts[i])}
+            for i in np.flatnonzero(attempts)]
+
+
+class LiveAnswerAnalytics:
+    """AnswerAnalytics topped up from an event log at most every refresh_seconds.
+
+    The existing log is read by a background thread started on first use,
+    so no request waits for (or holds the lock during) that first pass;
+    later refreshes only read what was appended since.
+    """
+
+    def __init__(self, directory, refresh_seconds=REFRESH_SECONDS):
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self.stats = None
+        self._lock = threading.Lock()
+        self._loader = None
+        self._refreshed = 0
+
+    def start(self):
+        """Start reading the existing log in the background, if that hasn't started yet"""
+        with self._lock:
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._load, name='answer-analytics', daemon=True)
+                self._loader.start()
+
+    def _load(self):
+        try:
+            stats = AnswerAnalytics()
+            stats.ingest_log(EventLogReader(self.directory))
+        except Exception:
+            logging.getLogger('relapitch').exception('answer analytics failed to load')
+            with self._lock:
+                self._loader = None  # Try again on the next request
+            return
+        with self._lock:
+            self.stats = stats
+            self._refreshed = time.monotonic()
+
+    def summaries(self, user_id):
+        """(summary of every answer, summary of this user's answers), or None while still loading"""
+        self.start()
+        with self._lock:
+            if self.stats is None:
+                return None
+            if time.monotonic() - self._refreshed >= self.refresh_seconds:
+                # Only reads what was appended since the last refresh
+                self.stats.ingest_log(EventLogReader(self.directory))
+                self._refreshed = time.monotonic()
+            return self.stats.summary(), self.stats.summary(user_id)
+
+
+def init_app(app):
+    @app.cli.group()
+    def analytics():
+        """Answer history analytics."""
+
+    @analytics.command('report')
+    @click.option('--input', 'input_path', type=click.Path(exists=True, dir_okay=False),
+                  help='JSONL dump of answer records (default: the event log).')
+    @click.option('--state', type=click.Path(dir_okay=False),
+                  help='Saved state file; only records appended since the last run are read.')
+    @click.option('--user', 'user_id', help='Only report on this user id.')
+    def report_command(input_path, state, user_id):
+        """Print accuracy, confusion, response time and trend statistics as JSON."""
+        stats = AnswerAnalytics.load(state) if state and os.path.exists(state) else AnswerAnalytics()
+        before = stats.count
+        if input_path:
+            stats.ingest_jsonl(input_path)
+        else:
+            stats.ingest_log(EventLogReader(app.extensions['event_log'].directory))
+        if state:
+            stats.save(state)
+        click.echo(f"Read {stats.count - before} new answers ({stats.count} total)", err=True)
+        click.echo(json.dumps(stats.summary(user_id), indent=1))
+
+    @analytics.command('export')
+    @click.argument('output', type=click.File('w'))
+    def export_command(output):
+        """Write every answer record in the event log as JSONL."""
+        count = 0
+        for record in EventLogReader(app.extensions['event_log'].directory):
+            if record.get('type') == 'answer':
+                output.write(json.dumps(record, separators=(',', ':')) + '\n')
+                count += 1
+        click.echo(f"Exported {count} answers", err=True)
@@ -0,0 +1,283 @@
+"""Production entry point: RelaPitch served over ASGI by uvicorn.
+
+    python asgi.py                       # configured from the environment, see below
+    uvicorn asgi:application --workers 4
+
+`python server.py` still starts the threaded debug server for development.
+
+Under this entry point I/O waits happen on each worker's event loop and
+threads are only used while Flask is actually running a view:
+
+* The request body (an audio upload, a batch of progress events) is read
+  on the event loop, and only a fully received request is handed to the
+  WSGI app on a thread from a bounded pool. A slow client no longer holds
+  a thread for as long as its upload takes.
+* The /ws/pitch WebSocket is served natively on the event loop, so a
+  long-lived pitch stream costs a coroutine instead of a thread.
+* CPU-bound pitch analysis runs in the compute pool (see compute_pool.py)
+  when RELAPITCH_COMPUTE_WORKERS is set.
+
+Each worker process accepts at most RELAPITCH_MAX_CONNECTIONS requests and
+WebSockets at a time; beyond that requests get a 503 (WebSockets are
+closed with 1013, "try again later"). On SIGTERM/SIGINT uvicorn stops
+accepting connections and waits up to RELAPITCH_GRACEFUL_TIMEOUT seconds
+for in-flight requests. After that the compute pool is stopped, the event
+log is flushed and the leaderboards are snapshotted.
+
+Environment:
+
+* RELAPITCH_HOST, RELAPITCH_PORT: where to listen (0.0.0.0:5001)
+* RELAPITCH_WORKERS: worker processes (1). With more than one, sessions
+  default to the sqlite store and scores to the shared store, and the
+  in-process ones are refused (see config.py). When starting uvicorn
+  yourself with --workers, set RELAPITCH_WORKERS to the same number.
+* RELAPITCH_THREADS: threads per worker running Flask views (32)
+* RELAPITCH_MAX_CONNECTIONS: concurrent requests and WebSockets per worker (1000)
+* RELAPITCH_GRACEFUL_TIMEOUT: seconds to drain in-flight requests on shutdown (30)
+* RELAPITCH_COMPUTE_WORKERS: processes for pitch analysis, 0 to run it inline
+* RELAPITCH_ENV: config profile (production; see config.py), which needs
+  RELAPITCH_SECRET_KEY
+
+The Flask app is only built when a worker starts serving (lifespan
+startup, or the first request), not when this module is imported: the
+module is imported by the `python asgi.py` supervisor and, as the main
+script, by every compute pool worker, and none of those need an app.
+"""
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+from pitch_stream import StreamError
+
+THREADS = int(os.environ.get('RELAPITCH_THREADS', 32))
+MAX_CONNECTIONS = int(os.environ.get('RELAPITCH_MAX_CONNECTIONS', 1000))
+MAX_BODY_BYTES = 16 * 1024 * 1024  # Unless the app sets MAX_CONTENT_LENGTH
+SPOOL_BYTES = 256 * 1024  # Bodies larger than this are buffered in a temporary file
+PITCH_TICK = 0.02
+
+
+class WSGIBridge:
+    """Runs a WSGI app for ASGI HTTP requests, on a thread pool, once the body has arrived."""
+
+    def __init__(self, wsgi_app, threads=THREADS, max_body=MAX_BODY_BYTES):
+        self.wsgi_app = wsgi_app
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body = SpooledTemporaryFile(SPOOL_BYTES)
+        try:
+            size = 0
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                chunk = message.get('body', b'')
+                size += len(chunk)
+                if size > self.max_body:
+                    await send_error(send, 413, b'Request body too large')
+                    return
+                body.write(chunk)
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            environ = build_environ(scope, body, size)
+            loop = asyncio.get_running_loop()
+            status, headers, content = await loop.run_in_executor(self.executor, self._call_app, environ)
+        finally:
+            body.close()
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def _call_app(self, environ):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [int(status.split(' ', 1)[0]), headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response[0], response[1], content
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def build_environ(scope, body, size):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue  # The body has been read; its real length is set above
+        key = f"HTTP_{name}"
+        if key in environ:
+            value = f"{environ[key]}{'; ' if name == 'COOKIE' else ','}{value}"
+        environ[key] = value
+    return environ
+
+
+async def send_error(send, status, message):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain'), (b'retry-after', b'1')]})
+    await send({'type': 'http.response.body', 'body': message})
+
+
+async def pitch_socket(app, scope, receive, send):
+    """/ws/pitch on the event loop: PCM frames in, pitch updates out (same protocol as server.pitch_socket)"""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    try:
+        sample_rate = int(query.get('sample_rate', ['44100'])[0])
+        stream = app.extensions['pitch_hub'].open(sample_rate, query.get('encoding', ['float32'])[0])
+    except (ValueError, StreamError) as e:
+        await send({'type': 'websocket.close', 'code': 1013, 'reason': str(e)})
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def read_frames():
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message.get('bytes'):
+                stream.push(message['bytes'])
+
+    reader = asyncio.ensure_future(read_frames())
+    try:
+        while not reader.done():
+            update = stream.take_update()
+            if update is not None:
+                await send({'type': 'websocket.send', 'text': json.dumps(update)})
+            await asyncio.wait({reader}, timeout=PITCH_TICK)
+        if isinstance(reader.exception(), StreamError):
+            await send({'type': 'websocket.close', 'code': 1008, 'reason': str(reader.exception())})
+    finally:
+        reader.cancel()
+        app.extensions['pitch_hub'].close(stream)
+
+
+class Application:
+    """The ASGI app: connection limits, lifespan, and routing between the WSGI bridge and native handlers"""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.active = 0
+        self.app = None
+        self.bridge = None
+        self.websockets = {'/ws/pitch': pitch_socket}
+
+    def load(self):
+        """Build the Flask app (production profile unless RELAPITCH_ENV says otherwise)"""
+        if self.app is None:
+            import server
+
+            app = server.create_app(os.environ.get('RELAPITCH_ENV', 'production'))
+            self.bridge = WSGIBridge(app, max_body=app.config.get('MAX_CONTENT_LENGTH') or MAX_BODY_BYTES)
+            self.app = app
+        return self.app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if self.app is None:
+            self.load()
+
+        if self.active >= self.max_connections:
+            if scope['type'] == 'http':
+                await send_error(send, 503, b'Server busy')
+            else:
+                await receive()  # websocket.connect
+                await send({'type': 'websocket.close', 'code': 1013})
+            return
+
+        self.active += 1
+        try:
+            if scope['type'] == 'http':
+                await self.bridge(scope, receive, send)
+            elif scope['path'] in self.websockets:
+                await self.websockets[scope['path']](self.app, scope, receive, send)
+            else:
+                await receive()
+                await send({'type': 'websocket.close', 'code': 1000})
+        finally:
+            self.active -= 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self.load()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    raise
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # In-flight requests have drained by now; stop helpers and flush what they hold
+                await asyncio.get_running_loop().run_in_executor(None, self.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        if self.app is None:
+            return
+        self.bridge.shutdown()
+        self.app.extensions['compute_pool'].shutdown()
+        self.app.extensions['event_log'].close()
+        self.app.extensions['leaderboards'].snapshot()
+
+
+application = Application()
+
+
+def main():
+    import uvicorn
+
+    uvicorn.run('asgi:application',
+                host=os.environ.get('RELAPITCH_HOST', '0.0.0.0'),
+                port=int(os.environ.get('RELAPITCH_PORT', 5001)),
+                workers=int(os.environ.get('RELAPITCH_WORKERS', 1)),
+                timeout_graceful_shutdown=int(os.environ.get('RELAPITCH_GRACEFUL_TIMEOUT', 30)),
+                lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
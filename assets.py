@@ -0,0 +1,331 @@
+"""Static asset pipeline: bundling, minification, fingerprinting, precompression.
+
+At startup (or with ``flask --app server assets build``) every file under
+``static/`` is copied to ``static/dist/`` with a content hash in its name, CSS
+and JS are minified, the bundles in BUNDLES are concatenated, and gzip (and
+brotli, if the ``brotli`` package is installed) variants are written next to
+the text files. ``url_for('static', filename=...)`` then resolves to the
+hashed name, which is served with ``Cache-Control: immutable`` and the best
+precompressed variant the client accepts.
+
+``flask --app server assets vendor`` downloads the third-party CSS/JS the
+templates use (Bootstrap, jQuery, the Google font) into ``static/vendor/``,
+after which ``vendor_url()`` serves the local copies instead of the CDNs.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import time
+import urllib.request
+
+import click
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; we fall back to gzip only
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+BUNDLES = {
+    'css/app.css': ['css/style.css', 'css/drag-drop.css', 'css/scoring.css'],
+    'js/quiz.bundle.js': ['js/music-theory.js', 'js/note-bank.js', 'js/tuner.js', 'js/quiz.js'],
+    'js/lesson.bundle.js': ['js/music-theory.js', 'js/note-bank.js', 'js/lesson.js', 'js/tuner.js', 'js/drag-drop.js'],
+}
+
+# Third-party files the templates load, and where they come from
+VENDOR_LIBS = {
+    'vendor/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'vendor/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'vendor/jquery.min.js': 'https://code.jquery.com/jquery-3.3.1.min.js',
+    'vendor/fonts.css': 'https://fonts.googleapis.com/css2?family=Playfair+Display:wght@400;700&display=swap',
+}
+
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.html', '.txt'}
+IGNORED_FILES = {'.DS_Store'}
+CHECK_INTERVAL = 1.0  # Seconds between source checks when auto-rebuilding
+
+
+def minify_css(source):
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+    return source.replace(';}', '}').strip()
+
+
+def minify_js(source):
+    """Conservative, line-based JS minifier.
+
+    Drops comment-only lines, doc blocks and indentation but keeps line breaks,
+    so automatic semicolon insertion behaves exactly as in the source. Lines
+    inside multi-line template literals are left untouched.
+    """
+    lines = []
+    in_template = False
+    in_block_comment = False
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if in_block_comment:
+                in_block_comment = '*/' not in stripped
+                continue
+            if stripped.startswith('/*'):
+                in_block_comment = '*/' not in stripped
+                continue
+            if not stripped or stripped.startswith('//'):
+                continue
+            lines.append(stripped)
+        if line.count('`') % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+
+def fingerprint(name, data):
+    """"js/quiz.js" -> "js/quiz.<hash>.js" """
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+class AssetPipeline:
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.dist_folder = os.path.join(static_folder, DIST_DIR)
+        self.manifest = {}
+        self._source_key = None
+        self._last_check = 0
+
+    @property
+    def version(self):
+        """Changes whenever the build changes, for caches of pages that link to assets"""
+        return self._source_key
+
+    def source_files(self):
+        for root, dirs, files in os.walk(self.static_folder):
+            if os.path.abspath(root) == os.path.abspath(self.static_folder):
+                dirs[:] = [d for d in dirs if d != DIST_DIR]
+            for file_name in files:
+                if file_name in IGNORED_FILES:
+                    continue
+                path = os.path.join(root, file_name)
+                yield os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+
+    def source_key(self):
+        """Cheap fingerprint of the source tree (names, sizes, mtimes)"""
+        digest = hashlib.sha256()
+        for name in sorted(self.source_files()):
+            stat = os.stat(os.path.join(self.static_folder, name))
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def load_or_build(self):
+        """Reuse the existing build if the sources haven't changed since"""
+        key = self.source_key()
+        manifest_path = os.path.join(self.dist_folder, MANIFEST_NAME)
+        try:
+            with open(manifest_path) as f:
+                saved = json.load(f)
+            if saved.get('source_key') == key:
+                self.manifest = saved['files']
+                self._source_key = key
+                return self.manifest
+        except (FileNotFoundError, ValueError):
+            pass
+        return self.build(key)
+
+    def build(self, key=None):
+        key = key or self.source_key()
+        outputs = {}
+        for name in self.source_files():
+            with open(os.path.join(self.static_folder, name), 'rb') as f:
+                outputs[name] = self._minify(name, f.read())
+
+        manifest = {}
+        written = set()
+
+        def emit(name, data):
+            hashed = fingerprint(name, data)
+            self._write(hashed, data)
+            manifest[name] = f"{DIST_DIR}/{hashed}"
+            written.add(hashed)
+
+        # Stylesheets go last so their url() references can point at hashed names
+        for name, data in outputs.items():
+            if not name.endswith('.css'):
+                emit(name, data)
+        for name, data in outputs.items():
+            if name.endswith('.css'):
+                outputs[name] = self._rewrite_css_urls(name, data, manifest)
+                emit(name, outputs[name])
+        for bundle, parts in BUNDLES.items():
+            emit(bundle, b'\n'.join(outputs[part] for part in parts if part in outputs))
+
+        self._remove_stale(written)
+        tmp_path = os.path.join(self.dist_folder, MANIFEST_NAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'source_key': key, 'files': manifest}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, os.path.join(self.dist_folder, MANIFEST_NAME))
+        self.manifest = manifest
+        self._source_key = key
+        return manifest
+
+    def _minify(self, name, data):
+        if name.endswith('.min.js') or name.endswith('.min.css'):
+            return data
+        if name.endswith('.css'):
+            return minify_css(data.decode('utf-8')).encode('utf-8')
+        if name.endswith('.js'):
+            return minify_js(data.decode('utf-8')).encode('utf-8')
+        return data
+
+    def _rewrite_css_urls(self, name, data, manifest):
+        directory = os.path.dirname(name)
+
+        def replace(match):
+            url = match.group(2)
+            if re.match(r'^(?:[a-z]+:|/|#)', url):
+                return match.group(0)
+            target = os.path.normpath(os.path.join(directory, url)).replace(os.sep, '/')
+            if target not in manifest:
+                return match.group(0)
+            # Hashed files keep their directory, so the path is relative to the same place
+            return f"url({os.path.relpath(manifest[target], f'{DIST_DIR}/{directory}')})"
+
+        return re.sub(r"""url\((['"]?)([^'")]+)\1\)""", replace, data.decode('utf-8')).encode('utf-8')
+
+    def _write(self, hashed, data):
+        path = os.path.join(self.dist_folder, hashed)
+        if os.path.exists(path):
+            return  # Same name means same content
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if os.path.splitext(hashed)[1] in COMPRESSIBLE:
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, 9, mtime=0))
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data))
+
+    def _remove_stale(self, keep):
+        """Delete hashed files from earlier builds"""
+        for root, _, files in os.walk(self.dist_folder):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, self.dist_folder).replace(os.sep, '/')
+                base = re.sub(r'\.(gz|br)$', '', name)
+                if base not in keep and file_name != MANIFEST_NAME:
+                    os.remove(path)
+
+    def maybe_rebuild(self):
+        """Rebuild if sources changed; checked at most once per CHECK_INTERVAL"""
+        now = time.monotonic()
+        if now - self._last_check < CHECK_INTERVAL:
+            return
+        self._last_check = now
+        key = self.source_key()
+        if key != self._source_key:
+            self.build(key)
+
+    def vendor(self):
+        """Download the third-party libs into static/vendor"""
+        for name, url in VENDOR_LIBS.items():
+            data = _download(url)
+            if name.endswith('fonts.css'):
+                data = self._vendor_fonts(data.decode('utf-8')).encode('utf-8')
+            path = os.path.join(self.static_folder, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            click.echo(f"{url} -> static/{name}")
+
+    def _vendor_fonts(self, css):
+        """Download the font files a Google Fonts stylesheet points at and rewrite the URLs"""
+        def replace(match):
+            url = match.group(1)
+            file_name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16] + os.path.splitext(url)[1]
+            path = os.path.join(self.static_folder, 'vendor', 'fonts', file_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(_download(url))
+            return f"url(fonts/{file_name})"
+        return re.sub(r'url\((https://[^)]+)\)', replace, css)
+
+
+def _download(url):
+    # Google Fonts only serves woff2 to browsers it recognizes
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) Chrome/120.0'})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return response.read()
+
+
+def init_app(app):
+    pipeline = AssetPipeline(app.static_folder)
+    pipeline.load_or_build()
+    app.extensions['assets'] = pipeline
+    auto_rebuild = app.config.get('ASSETS_AUTO_REBUILD', app.debug)
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            if auto_rebuild:
+                pipeline.maybe_rebuild()
+            hashed = pipeline.manifest.get(values['filename'])
+            if hashed is not None:
+                values['filename'] = hashed
+
+    def static(filename):
+        if not filename.startswith(DIST_DIR + '/'):
+            return app.send_static_file(filename)
+
+        # Hashed files never change, so they can be cached forever
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accepted = request.accept_encodings
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted[encoding] and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
+
+    def vendor_url(name):
+        """Local copy of a third-party file if it has been vendored, else its CDN URL"""
+        if f"vendor/{name}" in pipeline.manifest:
+            return url_for('static', filename=f"vendor/{name}")
+        return VENDOR_LIBS[f"vendor/{name}"]
+
+    app.jinja_env.globals['vendor_url'] = vendor_url
+
+    @app.cli.group()
+    def assets():
+        """Static asset pipeline commands."""
+
+    @assets.command('build')
+    def build_command():
+        """Bundle, minify, fingerprint and precompress static files."""
+        shutil.rmtree(pipeline.dist_folder, ignore_errors=True)
+        manifest = pipeline.build()
+        click.echo(f"Built {len(manifest)} assets into {pipeline.dist_folder}")
+
+    @assets.command('vendor')
+    def vendor_command():
+        """Download third-party CSS/JS into static/vendor."""
+        pipeline.vendor()
+        pipeline.build()
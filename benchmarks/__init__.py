@@ -0,0 +1 @@
+"""Route, load and micro-benchmarks for RelaPitch (run with python -m benchmarks)."""
@@ -0,0 +1,71 @@
+"""Run the benchmarks: python -m benchmarks [--suite ...] [--save-baseline | --compare]
+
+Results are printed as a table and written to benchmarks/results/latest.json.
+--save-baseline also stores them as the baseline; --compare exits with
+status 1 if any benchmark got slower than the baseline by more than
+--tolerance.
+"""
+import argparse
+import os
+import sys
+
+from benchmarks.harness import compare, format_table, load_app, load_results, save_results
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SUITES = ('client', 'micro', 'wsgi', 'startup')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.splitlines()[0])
+    parser.add_argument('--suite', choices=SUITES, action='append',
+                        help='Suite to run (repeatable; default: all)')
+    parser.add_argument('--iterations', type=int, default=300, help='Requests per route in the client suite')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds of load in the wsgi suite')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients in the wsgi suite')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Cold processes started in the startup suite')
+    parser.add_argument('--output', default=os.path.join(HERE, 'results', 'latest.json'))
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='Fail if slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Allowed slowdown relative to the baseline (default: 0.3 = 30%%)')
+    args = parser.parse_args(argv)
+
+    from benchmarks.micro import bench_micro
+    from benchmarks.routes import bench_test_client, bench_wsgi_server
+    from benchmarks.startup import bench_startup
+
+    server = load_app()
+    results = {}
+    for suite in args.suite or SUITES:
+        if suite == 'client':
+            results.update(bench_test_client(server, args.iterations))
+        elif suite == 'micro':
+            results.update(bench_micro(server, args.iterations * 5))
+        elif suite == 'startup':
+            results.update(bench_startup(args.startup_runs))
+        else:
+            results.update(bench_wsgi_server(server, args.duration, args.concurrency))
+
+    print(format_table(results))
+    save_results(args.output, results)
+    if args.save_baseline:
+        save_results(args.baseline, results)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\nNo baseline at {args.baseline}; run with --save-baseline first", file=sys.stderr)
+            return 2
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:", file=sys.stderr)
+            for name, metric, old, new in regressions:
+                print(f"  {name} {metric}: {old:.3f} -> {new:.3f}", file=sys.stderr)
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Timing, memory and baseline helpers shared by the benchmark suites."""
+import gc
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+
+def load_app():
+    """The server module, with server.app built from the testing profile and its side effects
+    (event log, leaderboard snapshots) sent to a scratch dir"""
+    import server
+
+    scratch = tempfile.mkdtemp(prefix='relapitch-bench-')
+    server.app = server.create_app('testing', EVENT_LOG_PATH=os.path.join(scratch, 'events'),
+                                   LEADERBOARD_PATH=os.path.join(scratch, 'leaderboards'))
+    logging.getLogger('relapitch').setLevel(logging.WARNING)
+    return server
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(durations, **extra):
+    """Throughput and latency percentiles (in ms) for a list of per-call durations in seconds"""
+    values = sorted(durations)
+    total = sum(values)
+    result = {
+        'n': len(values),
+        'throughput': len(values) / total if total else 0.0,
+        'mean_ms': total / len(values) * 1000 if values else 0.0,
+        'p50_ms': percentile(values, 0.50) * 1000,
+        'p95_ms': percentile(values, 0.95) * 1000,
+        'p99_ms': percentile(values, 0.99) * 1000,
+    }
+    result.update(extra)
+    return result
+
+
+def time_calls(fn, iterations, warmup=10):
+    for _ in range(warmup):
+        fn()
+    durations = []
+    gc.collect()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def memory_per_call(fn, iterations=50):
+    """(peak bytes allocated during one call, bytes still held per call afterwards)"""
+    fn()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        peak = 0
+        for _ in range(iterations):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            _, call_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, call_peak - before)
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, max(0, retained - baseline) / iterations
+
+
+# Baselines
+
+# A benchmark regresses if any of these got worse by more than the tolerance
+COMPARED = {'p50_ms': 'lower', 'p95_ms': 'lower', 'throughput': 'higher'}
+MIN_DELTA_MS = 0.05  # Latency changes smaller than this are timer noise, whatever the ratio
+
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance):
+    """List of (benchmark, metric, baseline value, new value) that regressed beyond the tolerance"""
+    regressions = []
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for metric, better in COMPARED.items():
+            if metric not in stats or not old.get(metric):
+                continue
+            change = stats[metric] / old[metric] - 1
+            if metric.endswith('_ms') and stats[metric] - old[metric] < MIN_DELTA_MS:
+                continue
+            if (better == 'lower' and change > tolerance) or (better == 'higher' and change < -tolerance):
+                regressions.append((name, metric, old[metric], stats[metric]))
+    return regressions
+
+
+def format_table(results):
+    lines = [f"{'benchmark':44} {'n':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  extra"]
+    for name, stats in sorted(results.items()):
+        extra = ', '.join(f"{key}={value:g}" if isinstance(value, float) else f"{key}={value}"
+                          for key, value in sorted(stats.items())
+                          if key not in ('n', 'throughput', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'))
+        lines.append(f"{name:44} {stats['n']:6d} {stats['throughput']:9.0f} {stats['p50_ms']:8.3f} "
+                     f"{stats['p95_ms']:8.3f} {stats['p99_ms']:8.3f}  {extra}")
+    return '\n'.join(lines)
@@ -0,0 +1,61 @@
+"""Micro-benchmarks for the per-request helpers on the hot path."""
+import random
+from datetime import date
+
+import progress_codec
+import quests
+from benchmarks.harness import summarize, time_calls
+from benchmarks.routes import SEARCH_QUERIES, SESSION_SIZES
+from session_store import JSONSessionSerializer
+
+
+def _session_with_items(server, completed_items):
+    """Request context whose session is an initialized user with `completed_items` completed items"""
+    context = server.app.test_request_context('/')
+    context.push()
+    server.init_user_data()
+    server.session['completed_items'].update({f"lesson_{i}_item_{i % 7}": True for i in range(completed_items)})
+    return context
+
+
+def bench_micro(server, iterations=2000):
+    results = {}
+    for size in SESSION_SIZES:
+        context = _session_with_items(server, size)
+        try:
+            results[f"micro/init_user_data/items={size}"] = summarize(time_calls(server.init_user_data, iterations))
+            results[f"micro/advance_quests/items={size}"] = summarize(
+                time_calls(lambda: server.advance_quests(['listen_correct']), iterations))
+            counter = [0]
+
+            def progress_event():
+                counter[0] += 1
+                server.apply_progress_event(f"micro_item_{counter[0]}", 'lesson_interaction')
+
+            results[f"micro/apply_progress_event/items={size}"] = summarize(time_calls(progress_event, iterations))
+
+            # Session (de)serialization in both formats
+            state = dict(server.session)
+            for name, serializer in (('binary', progress_codec.ProgressSerializer()), ('json', JSONSessionSerializer())):
+                data = serializer.dumps(state)
+                results[f"micro/session_dumps/{name}/items={size}"] = summarize(
+                    time_calls(lambda: serializer.dumps(state), iterations), size_bytes=len(data))
+                results[f"micro/session_loads/{name}/items={size}"] = summarize(
+                    time_calls(lambda: serializer.loads(data), iterations))
+        finally:
+            context.pop()
+
+    # The quest engine on its own, without the session
+    board = {}
+    quests.refresh(board, date.today(), random.Random(0))
+    events = ['listen_correct', 'listen_incorrect', 'sing_correct', 'lesson_interaction', 'quiz_correct']
+    results['micro/quests.apply_event'] = summarize(
+        time_calls(lambda: quests.apply_event(board, random.choice(events)), iterations * 5))
+    results['micro/quests.refresh'] = summarize(
+        time_calls(lambda: quests.refresh(board, date.today()), iterations * 5))
+
+    with server.app.app_context():
+        for query in SEARCH_QUERIES:
+            results[f"micro/search/{query}"] = summarize(
+                time_calls(lambda: server.get_search_index().search(query), iterations))
+    return results
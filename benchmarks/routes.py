@@ -0,0 +1,150 @@
+"""Route benchmarks through the Flask test client, and a load test against a real WSGI server."""
+import http.client
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from werkzeug.serving import make_server
+
+from benchmarks.harness import memory_per_call, summarize, time_calls
+
+# Users with this many completed items (plus the matching score)
+SESSION_SIZES = (0, 1000, 5000)
+SEARCH_QUERIES = ['pitch', 'interval', 'relative pitch', 'octave', 'sing']
+
+
+def make_user(server, completed_items):
+    """Test client whose session already holds `completed_items` completed items and a started quiz"""
+    client = server.app.test_client()
+    client.get('/')
+    client.get('/quiz/start/listen')
+    if completed_items:
+        with client.session_transaction() as session:
+            session['completed_items'].update({f"lesson_{i}_item_{i % 7}": True for i in range(completed_items)})
+            session['score'] += completed_items * 10
+    return client
+
+
+def session_bytes(server, client):
+    """(cookie size, server-side session size) for a client"""
+    cookie = client.get_cookie(server.app.config['SESSION_COOKIE_NAME'])
+    if cookie is None:
+        return 0, 0
+    raw = server.app.session_interface.store.get(cookie.value)
+    return len(cookie.value), len(raw or b'')
+
+
+def route_calls(client, counter):
+    """name -> zero-argument callable issuing one request of that kind"""
+
+    def submit():
+        counter[0] += 1
+        client.post('/quiz/submit', json={'question_id': counter[0] % 5 + 1, 'answer': 'C'})
+
+    def progress():
+        counter[0] += 1
+        client.post('/log_progress', json={'itemId': f"bench_item_{counter[0]}", 'points': 5,
+                                           'itemType': 'lesson_interaction'})
+
+    return {
+        'home': lambda: client.get('/'),
+        'lesson': lambda: client.get('/lesson/1'),
+        'search': lambda: client.get('/search', query_string={'q': random.choice(SEARCH_QUERIES)}),
+        'quiz': lambda: client.get('/quiz/1'),
+        'quiz_submit': submit,
+        'log_progress': progress,
+    }
+
+
+def bench_test_client(server, iterations=300):
+    results = {}
+    for size in SESSION_SIZES:
+        client = make_user(server, size)
+        counter = [0]
+        for name, call in route_calls(client, counter).items():
+            cookie_before, stored_before = session_bytes(server, client)
+            durations = time_calls(call, iterations)
+            cookie, stored = session_bytes(server, client)
+            peak, retained = memory_per_call(call)
+            results[f"client/{name}/items={size}"] = summarize(
+                durations, cookie_bytes=cookie, session_bytes=stored,
+                cookie_growth_bytes=cookie - cookie_before, session_growth_bytes=stored - stored_before,
+                alloc_peak_bytes=peak, retained_bytes_per_request=round(retained))
+    return results
+
+
+# Load test over HTTP
+
+LOAD_MIX = [('home', 'GET', '/', 3), ('lesson', 'GET', '/lesson/1', 4), ('search', 'GET', '/search?q=pitch', 2),
+            ('quiz', 'GET', '/quiz/1', 3), ('quiz_submit', 'POST', '/quiz/submit', 2),
+            ('log_progress', 'POST', '/log_progress', 2)]
+
+
+def _load_worker(port, deadline, durations, lock, seed):
+    rng = random.Random(seed)
+    mix = [entry for entry in LOAD_MIX for _ in range(entry[3])]
+    cookie = None
+    local = defaultdict(list)
+    for method, path in (('GET', '/'), ('GET', '/quiz/start/listen')):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        connection.request(method, path, headers={'Cookie': cookie} if cookie else {})
+        response = connection.getresponse()
+        response.read()
+        cookie = cookie or (response.getheader('Set-Cookie') or '').split(';')[0]
+        connection.close()
+
+    count = 0
+    while time.perf_counter() < deadline:
+        name, method, path, _ = rng.choice(mix)
+        count += 1
+        body = None
+        headers = {'Cookie': cookie}
+        if name == 'quiz_submit':
+            body = f'{{"question_id": {count % 5 + 1}, "answer": "C"}}'
+        elif name == 'log_progress':
+            body = f'{{"itemId": "load_{seed}_{count}", "points": 5, "itemType": "lesson_interaction"}}'
+        if body:
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        connection.request(method, path, body=body, headers=headers)
+        connection.getresponse().read()
+        connection.close()
+        local[name].append(time.perf_counter() - start)
+    with lock:
+        for name, values in local.items():
+            durations[name].extend(values)
+
+
+def bench_wsgi_server(server, duration=5.0, concurrency=8):
+    """Throughput and latency of a route mix from `concurrency` clients against a threaded WSGI server"""
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # No access log line per request
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    durations = defaultdict(list)
+    lock = threading.Lock()
+    try:
+        deadline = time.perf_counter() + duration
+        workers = [threading.Thread(target=_load_worker, args=(httpd.server_port, deadline, durations, lock, seed))
+                   for seed in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        httpd.shutdown()
+
+    results = {}
+    everything = []
+    for name, values in durations.items():
+        everything.extend(values)
+        stats = summarize(values, concurrency=concurrency)
+        stats['throughput'] = len(values) / duration
+        results[f"wsgi/{name}"] = stats
+    total = summarize(everything, concurrency=concurrency)
+    total['throughput'] = len(everything) / duration
+    results['wsgi/all'] = total
+    return results
@@ -0,0 +1,50 @@
+"""Cold start: fresh processes importing the app, creating it and serving their first requests."""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.harness import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process; prints the phase timings as JSON
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+app = server.create_app('testing', EVENT_LOG_PATH=sys.argv[1], LEADERBOARD_PATH=sys.argv[2])
+created = time.perf_counter()
+client = app.test_client()
+client.get('/')
+first_request = time.perf_counter()
+client.get('/lesson/1')
+client.get('/quiz/start/listen')
+client.get('/quiz/1')
+first_pages = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': first_request - created, 'first_pages': first_pages - first_request,
+                  'steps': app.extensions['startup']}))
+'''
+
+
+def bench_startup(runs=5):
+    """Per phase latency over `runs` cold processes, plus the whole process from spawn to exit"""
+    phases = {}
+    scratch = tempfile.mkdtemp(prefix='relapitch-bench-')
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD, os.path.join(scratch, 'events'),
+                                 os.path.join(scratch, 'leaderboards')],
+                                cwd=ROOT, check=True, capture_output=True, text=True).stdout
+        total = time.perf_counter() - start
+        timings = json.loads(output)
+        for name, seconds in timings.pop('steps').items():
+            phases.setdefault(f"create_app/{name}", []).append(seconds)
+        for name, seconds in timings.items():
+            phases.setdefault(name, []).append(seconds)
+        phases.setdefault('process', []).append(total)
+    return {f"startup/{name}": summarize(values) for name, values in phases.items()}
@@ -0,0 +1,429 @@
+"""Recordings of sing-mode attempts, kept on disk for review and re-grading.
+
+The browser uploads a recording in chunks, each one written to a partial
+file at the offset the client says it starts at, once the index agrees the
+upload stands there; if the connection drops, GET on the upload says how
+much arrived and the client carries on from there::
+
+    POST  /clips/uploads                  {"length": 96044} -> {"upload_id": ..., "offset": 0}
+    PATCH /clips/uploads/<id>             Upload-Offset: 0, body = next chunk -> {"offset": 65536}
+    GET   /clips/uploads/<id>             -> {"offset": 65536, "length": 96044}
+    POST  /quiz/submit                    {"question_id": 3, "upload_id": ...}
+
+The answer submission finishes the upload: the file is hashed and moved to
+objects/<first 2 hex>/<sha256>.wav, so a clip uploaded twice is stored once.
+Recordings attached to the submission itself are stored the same way.
+
+A small SQLite index (index.db, next to the objects) has one row per
+attempt: user, question, quest date, target note and the grade it got, so
+"this user's clips for today's quests" is an index lookup.
+
+Maintenance runs from the CLI::
+
+    flask --app server clips compact [--days 30]
+    flask --app server clips regrade [--since 2025-05-01] [--user ID] [--workers 4]
+
+compact drops attempts older than CLIP_RETENTION_DAYS, then every clip no
+attempt refers to, abandoned uploads and files the index doesn't know.
+regrade runs stored clips through the pitch detector again, batches spread
+over a process pool, and updates the grades.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date
+
+import click
+
+import music_theory
+from compute_pool import ComputePool
+from pitch_detection import AudioDecodeError, analyze_clips, check_clip, decode_wav
+from quiz_set import SING_TOLERANCE_CENTS
+
+CHUNK_SIZE = 64 * 1024  # Bytes read from the request stream at a time
+MAX_CLIP_BYTES = 8 * 1024 * 1024  # Ten seconds of 48 kHz stereo 32-bit audio is ~3.7 MB
+RETENTION_DAYS = 30
+UPLOAD_EXPIRY_SECONDS = 24 * 3600  # Unfinished uploads are dropped by compact after this
+ORPHAN_GRACE_SECONDS = 3600  # Clips no attempt refers to (yet) are kept this long
+REGRADE_BATCH = 16  # Clips per job sent to a worker
+
+
+class ClipError(Exception):
+    pass
+
+
+class UploadNotFound(ClipError):
+    pass
+
+
+class OffsetMismatch(ClipError):
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class ClipStore:
+    def __init__(self, directory, max_bytes=MAX_CLIP_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(directory, 'objects')
+        self.uploads = os.path.join(directory, 'uploads')
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.uploads, exist_ok=True)
+        self.path = os.path.join(directory, 'index.db')
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                ' upload_id TEXT PRIMARY KEY,'
+                ' user_id TEXT NOT NULL,'
+                ' length INTEGER,'
+                ' received INTEGER NOT NULL,'
+                ' created REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS clips ('
+                ' clip_hash TEXT PRIMARY KEY,'
+                ' bytes INTEGER NOT NULL,'
+                ' created REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS attempts ('
+                ' id INTEGER PRIMARY KEY,'
+                ' clip_hash TEXT NOT NULL,'
+                ' user_id TEXT NOT NULL,'
+                ' question_id TEXT NOT NULL,'
+                ' quest_date TEXT NOT NULL,'
+                ' mode TEXT NOT NULL,'
+                ' target_note TEXT NOT NULL,'
+                ' reference_note TEXT,'
+                ' created REAL NOT NULL,'
+                ' f0 REAL,'
+                ' note TEXT,'
+                ' cents REAL,'
+                ' is_correct INTEGER,'
+                ' graded REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS attempts_user ON attempts (user_id, created)')
+            conn.execute('CREATE INDEX IF NOT EXISTS attempts_question ON attempts (question_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS attempts_quest_date ON attempts (quest_date)')
+            conn.execute('CREATE INDEX IF NOT EXISTS attempts_clip ON attempts (clip_hash)')
+
+    def _connection(self):
+        # One connection per thread, as in shared_state
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def object_path(self, clip_hash):
+        return os.path.join(self.objects, clip_hash[:2], clip_hash + '.wav')
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.uploads, upload_id + '.part')
+
+    # Uploads
+
+    def start_upload(self, user_id, length=None):
+        """Open an upload of `length` bytes (if known up front); returns its id"""
+        if length is not None and not 0 < length <= self.max_bytes:
+            raise ClipError(f"Clips can be at most {self.max_bytes} bytes")
+        upload_id = uuid.uuid4().hex
+        open(self._part_path(upload_id), 'wb').close()
+        with self._transaction() as conn:
+            conn.execute('INSERT INTO uploads (upload_id, user_id, length, received, created) VALUES (?, ?, ?, 0, ?)',
+                         (upload_id, user_id, length, time.time()))
+        return upload_id
+
+    def upload_status(self, upload_id, user_id):
+        row = self._connection().execute('SELECT * FROM uploads WHERE upload_id = ? AND user_id = ?',
+                                         (upload_id, user_id)).fetchone()
+        if row is None:
+            raise UploadNotFound('No such upload')
+        return row
+
+    def write_chunk(self, upload_id, user_id, offset, stream, length=None):
+        """Append the next chunk, read from `stream`, at `offset`; returns the new offset.
+
+        The chunk is copied to a temporary file CHUNK_SIZE bytes at a time,
+        so it never sits in memory whole. `length` is the chunk size if the
+        request said (Content-Length); otherwise the stream is read to EOF.
+        Only once the index confirms the offset, inside its write lock, is
+        the chunk copied into the partial file, so two requests racing for
+        the same offset can't overwrite each other's bytes.
+        """
+        upload = self.upload_status(upload_id, user_id)
+        if offset != upload['received']:
+            raise OffsetMismatch(upload['received'])
+        limit = upload['length'] or self.max_bytes
+        if length is not None and offset + length > limit:
+            raise ClipError(f"Chunk runs past the end of the upload ({limit} bytes)")
+
+        written = 0
+        chunk_path = os.path.join(self.uploads, f"{upload_id}.{uuid.uuid4().hex}.chunk")
+        try:
+            with open(chunk_path, 'w+b') as pending:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if offset + written > limit:
+                        raise ClipError(f"Chunk runs past the end of the upload ({limit} bytes)")
+                    pending.write(chunk)
+
+                with self._transaction() as conn:
+                    # Another request for the same upload may have got in first
+                    updated = conn.execute('UPDATE uploads SET received = ? WHERE upload_id = ? AND received = ?',
+                                           (offset + written, upload_id, offset)).rowcount
+                    if updated:
+                        pending.seek(0)
+                        with open(self._part_path(upload_id), 'r+b') as part:
+                            part.seek(offset)
+                            for chunk in iter(lambda: pending.read(CHUNK_SIZE), b''):
+                                part.write(chunk)
+                            part.truncate()
+        finally:
+            _remove(chunk_path)
+        if not updated:
+            raise OffsetMismatch(self.upload_status(upload_id, user_id)['received'])
+        return offset + written
+
+    def finish_upload(self, upload_id, user_id):
+        """Move a complete upload into the store; returns the clip's hash"""
+        upload = self.upload_status(upload_id, user_id)
+        if not upload['received'] or (upload['length'] is not None and upload['received'] != upload['length']):
+            raise ClipError(f"Upload incomplete: {upload['received']} of {upload['length']} bytes")
+        part_path = self._part_path(upload_id)
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as part:
+            for chunk in iter(lambda: part.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        clip_hash = self._add_object(part_path, digest.hexdigest(), upload['received'])
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM uploads WHERE upload_id = ?', (upload_id,))
+        return clip_hash
+
+    # Clips
+
+    def put(self, data):
+        """Store a recording given as bytes; returns its hash"""
+        if len(data) > self.max_bytes:
+            raise ClipError(f"Clips can be at most {self.max_bytes} bytes")
+        temp_path = self._part_path(uuid.uuid4().hex)
+        with open(temp_path, 'wb') as temp:
+            temp.write(data)
+        return self._add_object(temp_path, hashlib.sha256(data).hexdigest(), len(data))
+
+    def _add_object(self, temp_path, clip_hash, size):
+        path = self.object_path(clip_hash)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        with self._transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO clips (clip_hash, bytes, created) VALUES (?, ?, ?)',
+                         (clip_hash, size, time.time()))
+        return clip_hash
+
+    def read(self, clip_hash):
+        with open(self.object_path(clip_hash), 'rb') as clip:
+            return clip.read()
+
+    # Attempts
+
+    def add_attempt(self, clip_hash, user_id, question_id, mode, target_note, reference_note=None,
+                    quest_date=None, f0=None, note=None, cents=None, is_correct=None):
+        """Index a graded attempt; quest_date defaults to today (the daily quest period)"""
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                'INSERT INTO attempts (clip_hash, user_id, question_id, quest_date, mode, target_note,'
+                ' reference_note, created, f0, note, cents, is_correct, graded)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (clip_hash, user_id, str(question_id), quest_date or date.today().isoformat(), mode,
+                 target_note, reference_note, now, f0, note, cents,
+                 None if is_correct is None else int(is_correct), now)
+            ).lastrowid
+
+    def attempts(self, user_id=None, question_id=None, quest_date=None, since=None, limit=None):
+        """Attempts matching every filter given, newest first"""
+        clauses, params = [], []
+        for column, value in (('user_id', user_id), ('question_id', question_id), ('quest_date', quest_date)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(str(value))
+        if since is not None:
+            clauses.append('created >= ?')
+            params.append(since)
+        query = 'SELECT * FROM attempts'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY created DESC, id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [dict(row) for row in self._connection().execute(query, params)]
+
+    def has_clip(self, user_id, clip_hash):
+        """Whether the user made an attempt with this clip (and so may listen to it)"""
+        return self._connection().execute('SELECT 1 FROM attempts WHERE user_id = ? AND clip_hash = ? LIMIT 1',
+                                          (user_id, clip_hash)).fetchone() is not None
+
+    def update_grades(self, grades):
+        """Store new grades: (attempt id, f0, note, cents, is_correct) rows"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany('UPDATE attempts SET f0 = ?, note = ?, cents = ?, is_correct = ?, graded = ?'
+                             ' WHERE id = ?',
+                             [(f0, note, cents, None if is_correct is None else int(is_correct), now, attempt_id)
+                              for attempt_id, f0, note, cents, is_correct in grades])
+
+    # Maintenance
+
+    def compact(self, retention_days=RETENTION_DAYS, now=None):
+        """Drop old attempts, unreferenced clips and abandoned uploads; returns counts of each"""
+        now = now or time.time()
+        with self._transaction() as conn:
+            attempts = conn.execute('DELETE FROM attempts WHERE created < ?',
+                                    (now - retention_days * 86400,)).rowcount
+            orphans = [row[0] for row in conn.execute(
+                'SELECT clip_hash FROM clips WHERE created < ?'
+                ' AND NOT EXISTS (SELECT 1 FROM attempts WHERE attempts.clip_hash = clips.clip_hash)',
+                (now - ORPHAN_GRACE_SECONDS,))]
+            conn.executemany('DELETE FROM clips WHERE clip_hash = ?', [(clip_hash,) for clip_hash in orphans])
+            uploads = [row[0] for row in conn.execute('SELECT upload_id FROM uploads WHERE created < ?',
+                                                      (now - UPLOAD_EXPIRY_SECONDS,))]
+            conn.executemany('DELETE FROM uploads WHERE upload_id = ?', [(upload_id,) for upload_id in uploads])
+            known = {row[0] for row in conn.execute('SELECT clip_hash FROM clips')}
+            live_uploads = {row[0] for row in conn.execute('SELECT upload_id FROM uploads')}
+
+        removed = 0
+        for clip_hash in orphans:
+            removed += _remove(self.object_path(clip_hash))
+        # Files left behind by a crash between writing them and indexing them
+        for root, _, names in os.walk(self.objects):
+            for name in names:
+                path = os.path.join(root, name)
+                if name[:-len('.wav')] not in known and os.path.getmtime(path) < now - ORPHAN_GRACE_SECONDS:
+                    removed += _remove(path)
+        for name in os.listdir(self.uploads):
+            path = os.path.join(self.uploads, name)
+            if name[:-len('.part')] not in live_uploads and os.path.getmtime(path) < now - UPLOAD_EXPIRY_SECONDS:
+                _remove(path)
+        for upload_id in uploads:
+            _remove(self._part_path(upload_id))
+
+        self._connection().execute('VACUUM')
+        return {'attempts': attempts, 'clips': len(orphans), 'files': removed, 'uploads': len(uploads)}
+
+    def regrade(self, pool, attempts, batch_size=REGRADE_BATCH):
+        """Run the clips of these attempts through the pitch detector again and store the grades.
+
+        Batches of clip paths go to the pool's workers, which read and
+        analyze the files themselves, so no audio is sent between processes.
+        Returns (attempts regraded, grades that changed).
+        """
+        batches = [attempts[i:i + batch_size] for i in range(0, len(attempts), batch_size)]
+        paths = [[self.object_path(attempt['clip_hash']) for attempt in batch] for batch in batches]
+        regraded = changed = 0
+        for batch, results in zip(batches, pool.map(analyze_files, paths)):
+            grades = []
+            for attempt, result in zip(batch, results):
+                f0, note = result or (None, None)
+                cents = is_correct = None
+                if f0:
+                    cents = round(float(music_theory.cents_from(f0, attempt['target_note'],
+                                                                octave_equivalent=True)), 1)
+                    is_correct = abs(cents) <= SING_TOLERANCE_CENTS
+                changed += (None if is_correct is None else int(is_correct)) != attempt['is_correct']
+                grades.append((attempt['id'], f0, note, cents, is_correct))
+            self.update_grades(grades)
+            regraded += len(grades)
+        return regraded, changed
+
+
+def analyze_files(paths):
+    """(f0, note) for each WAV file, or None for files that are missing or can't be decoded.
+
+    Runs in the compute pool's worker processes.
+    """
+    clips, found = [], []
+    for index, path in enumerate(paths):
+        try:
+            with open(path, 'rb') as clip:
+                clips.append(check_clip(*decode_wav(clip.read())))
+            found.append(index)
+        except (OSError, AudioDecodeError):
+            continue
+    results = [None] * len(paths)
+    for index, result in zip(found, analyze_clips(clips) if clips else []):
+        results[index] = (result['f0'], result['note'])
+    return results
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def init_app(app):
+    directory = app.config.get('CLIP_STORE_PATH') or os.path.join(app.instance_path, 'clips')
+    store = ClipStore(directory, int(app.config.get('MAX_CLIP_BYTES') or MAX_CLIP_BYTES))
+    app.extensions['clip_store'] = store
+
+    @app.cli.group()
+    def clips():
+        """Stored sing-mode recordings."""
+
+    @clips.command('compact')
+    @click.option('--days', type=int, default=None,
+                  help='Keep attempts this many days (default: CLIP_RETENTION_DAYS).')
+    def compact_command(days):
+        """Delete old attempts, their clips and abandoned uploads."""
+        if days is None:
+            days = int(app.config.get('CLIP_RETENTION_DAYS') or RETENTION_DAYS)
+        counts = store.compact(days)
+        click.echo(f"Removed {counts['attempts']} attempts, {counts['clips']} clips ({counts['files']} files)"
+                   f" and {counts['uploads']} abandoned uploads")
+
+    @clips.command('regrade')
+    @click.option('--since', type=click.DateTime(['%Y-%m-%d']), help='Only attempts made on or after this date.')
+    @click.option('--user', 'user_id', help='Only this user id.')
+    @click.option('--workers', type=int, default=os.cpu_count(), show_default=True,
+                  help='Worker processes (0 analyzes in this process).')
+    def regrade_command(since, user_id, workers):
+        """Grade stored attempts again with the current pitch detector."""
+        attempts = store.attempts(user_id=user_id, since=since.timestamp() if since else None)
+        pool = ComputePool(workers)
+        started = time.perf_counter()
+        try:
+            regraded, changed = store.regrade(pool, attempts)
+        finally:
+            pool.shutdown()
+        click.echo(f"Regraded {regraded} attempts in {time.perf_counter() - started:.1f}s; {changed} changed grade")
+
+    return store
@@ -0,0 +1,60 @@
+"""Process pool for CPU-bound work such as batch pitch analysis.
+
+YIN over a few seconds of audio keeps a core busy for tens of
+milliseconds. Run in the request's own thread (or on an event loop) that
+time is stolen from every other request in the process, so with
+COMPUTE_WORKERS > 0 the work is shipped to a pool of separate processes::
+
+    results = compute.run(analyze_clips, clips)
+
+With COMPUTE_WORKERS = 0 (the default for the development server) calls run
+inline. Workers are started with "spawn", so they aren't forked from a
+process that already runs threads, and they only import the module the
+function lives in plus the main script; the entry points (server.py,
+asgi.py) don't build an app on import, so that stays cheap.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+TIMEOUT = 30  # Seconds a job may take before the caller gives up on it
+
+
+class ComputePool:
+    def __init__(self, workers=0, timeout=TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        return self._pool().submit(fn, *args).result(self.timeout)
+
+    def map(self, fn, items):
+        """fn(item) for each item, spread over the workers; yields the results in order"""
+        if not self.workers:
+            return map(fn, items)
+        return self._pool().map(fn, items)
+
+    def shutdown(self, wait=True):
+        """Let running jobs finish (if wait) and stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def init_app(app):
+    pool = ComputePool(int(app.config.get('COMPUTE_WORKERS') or 0), app.config.get('COMPUTE_TIMEOUT', TIMEOUT))
+    app.extensions['compute_pool'] = pool
+    return pool
@@ -0,0 +1,100 @@
+"""Configuration profiles for create_app().
+
+A profile is a class of Flask config keys. create_app(profile) takes the
+name (or RELAPITCH_ENV, default "development"), loads the class with
+app.config.from_object, and the init_app of each module reads its keys from
+there. Most keys come from RELAPITCH_* environment variables (see README).
+
+* development: debug server behaviour (templates and assets rebuilt when
+  they change), a fixed secret key.
+* production: no debug. RELAPITCH_SECRET_KEY must be set.
+* testing: in-memory sessions, no content reloading, no pitch worker
+  processes, no rate limits.
+"""
+import os
+
+
+def _env(name, default=None):
+    return os.environ.get(f"RELAPITCH_{name}", default)
+
+
+class Config:
+    DEBUG = False
+    TESTING = False
+    SECRET_KEY = _env('SECRET_KEY')
+
+    # Larger request bodies get a 413, from the development server as well as asgi.py
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+
+    # Worker processes serving the app (asgi.py). Anything kept per process
+    # (memory sessions, unshared scores) is wrong with more than one, so create_app refuses it
+    WORKERS = int(_env('WORKERS', 1))
+
+    # Keep session data on the server; the cookie only carries an opaque id.
+    # Sessions must be shared between workers, so several workers default to sqlite
+    SESSION_STORE = _env('SESSION_STORE') or ('sqlite' if WORKERS > 1 else 'memory')
+    SESSION_STORE_PATH = _env('SESSION_STORE_PATH')
+    SESSION_SERIALIZER = _env('SESSION_FORMAT', 'binary')
+
+    # Answers and progress events are also appended to a log on disk for analytics
+    EVENT_LOG_FORMAT = _env('EVENT_LOG_FORMAT', 'jsonl')
+
+    # Scores and quest progress shared by all worker processes ('sqlite'), or kept per process ('off',
+    # only with one worker)
+    SHARED_STATE = _env('SHARED_STATE') or ('sqlite' if WORKERS > 1 else 'off')
+    SHARED_STATE_PATH = _env('SHARED_STATE_PATH')
+
+    # CPU-bound pitch analysis runs in worker processes when this is > 0 (see asgi.py)
+    COMPUTE_WORKERS = _env('COMPUTE_WORKERS', 0)
+
+    # Sing-mode recordings are kept for review and re-grading, then dropped by `flask clips compact`
+    CLIP_STORE_PATH = _env('CLIP_STORE_PATH')
+    CLIP_RETENTION_DAYS = _env('CLIP_RETENTION_DAYS', 30)
+
+    # Per-user and per-address token buckets on the scoring endpoints (see rate_limit.py)
+    RATE_LIMIT = _env('RATE_LIMIT', '1') != '0'
+
+    # Optional profiler for slow requests
+    PROFILE_SLOW_REQUESTS_MS = _env('PROFILE_SLOW_MS')
+
+    # Lesson content is reloaded when the files change (unless RELAPITCH_CONTENT_RELOAD=0)
+    CONTENT_AUTO_RELOAD = _env('CONTENT_RELOAD', '1') != '0'
+
+    # Compile every template when the app is created instead of on its first render
+    PRECOMPILE_TEMPLATES = True
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    SECRET_KEY = _env('SECRET_KEY', 'dev-only-secret-key')
+
+
+class ProductionConfig(Config):
+    pass
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SECRET_KEY = 'testing-secret-key'
+    WORKERS = 1
+    SESSION_STORE = 'memory'
+    SHARED_STATE = 'off'
+    COMPUTE_WORKERS = 0
+    CONTENT_AUTO_RELOAD = False
+    PROFILE_SLOW_REQUESTS_MS = None
+    RATE_LIMIT = False
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+def get_profile(name=None):
+    name = name or _env('ENV', 'development')
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown config profile: {name} (expected one of {', '.join(PROFILES)})") from None
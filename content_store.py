@@ -0,0 +1,327 @@
+"""Lesson content, compiled from files into a memory-mapped pack.
+
+Lessons are written as HTML files under ``content/lessons/``, each starting
+with a small metadata header::
+
+    ---
+    id: 3
+    title: What is an Octave?
+    keyboard: true
+    ---
+    <h2>What is an Octave?</h2>
+    ...
+
+They are compiled into a single pack file (``instance/content/lessons.pack``):
+a header, a sorted index of (lesson id, offset, length, digest) entries, the
+lessons as JSON records and a catalog record (ids and titles, for menus).
+The pack is memory-mapped, and a lesson is only decoded when it is first
+asked for, then kept in an LRU cache. Starting up maps the file and reads
+the header, however many lessons there are.
+
+The pack is rebuilt at startup when the sources changed since it was
+compiled (or with ``flask --app server content build``). With
+CONTENT_AUTO_RELOAD (on by default) the sources are re-checked at most once
+per CHECK_INTERVAL. A change recompiles the pack, swaps it in and tells the
+on_reload listeners which lessons changed, so e.g. the search index only
+re-indexes those.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import click
+
+CHECK_INTERVAL = 1.0
+CACHE_SIZE = 128
+
+PACK_MAGIC = b'RPCP'
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct('<4sHI16sQI')  # magic, version, lesson count, source key, catalog offset, catalog length
+INDEX_ENTRY = struct.Struct('<IQI16s')  # lesson id, record offset, record length, content digest
+
+METADATA_FIELDS = {'id': int, 'title': str, 'menu_title': str, 'keyboard': lambda value: value == 'true'}
+
+
+class ContentError(Exception):
+    pass
+
+
+def parse_lesson(text, name='<lesson>'):
+    """Split a lesson file into its metadata and HTML content"""
+    if not text.startswith('---\n'):
+        raise ContentError(f"{name}: missing metadata header")
+    header, separator, content = text[4:].partition('\n---\n')
+    if not separator:
+        raise ContentError(f"{name}: unterminated metadata header")
+    lesson = {'keyboard': False}
+    for line in header.splitlines():
+        key, _, value = line.partition(':')
+        key, value = key.strip(), value.strip()
+        if key not in METADATA_FIELDS:
+            raise ContentError(f"{name}: unknown metadata field {key!r}")
+        try:
+            lesson[key] = METADATA_FIELDS[key](value)
+        except ValueError:
+            raise ContentError(f"{name}: invalid {key}: {value!r}")
+    if 'id' not in lesson or 'title' not in lesson:
+        raise ContentError(f"{name}: lessons need an id and a title")
+    lesson.setdefault('menu_title', lesson['title'])
+    lesson['content'] = content
+    return lesson
+
+
+def compile_pack(lessons, source_key, path):
+    """Write lessons ({id: lesson}) to a pack file, atomically replacing any existing one"""
+    records = []
+    catalog = []
+    for lesson_id in sorted(lessons):
+        lesson = lessons[lesson_id]
+        record = json.dumps(lesson, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        records.append((lesson_id, record, hashlib.blake2b(record, digest_size=16).digest()))
+        catalog.append({'id': lesson_id, 'title': lesson['title'], 'menu_title': lesson['menu_title']})
+    catalog_record = json.dumps(catalog, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    offset = PACK_HEADER.size + INDEX_ENTRY.size * len(records)
+    index = []
+    for lesson_id, record, digest in records:
+        index.append(INDEX_ENTRY.pack(lesson_id, offset, len(record), digest))
+        offset += len(record)
+    header = PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(records), source_key, offset, len(catalog_record))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(b''.join(index))
+        for _, record, _ in records:
+            f.write(record)
+        f.write(catalog_record)
+    os.replace(tmp_path, path)
+
+
+class ContentPack:
+    """Read-only view of a compiled pack"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < PACK_HEADER.size:
+                raise ContentError(f"{path}: truncated content pack")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.source_key, self._catalog_offset, self._catalog_length = \
+            PACK_HEADER.unpack_from(self._map)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ContentError(f"{path}: not a version {PACK_VERSION} content pack")
+        self._ids = _IndexIds(self)
+
+    def _entry(self, position):
+        return INDEX_ENTRY.unpack_from(self._map, PACK_HEADER.size + position * INDEX_ENTRY.size)
+
+    def find(self, lesson_id):
+        """Index entry (id, offset, length, digest) for a lesson, by binary search, or None"""
+        position = bisect.bisect_left(self._ids, lesson_id)
+        if position < self.count:
+            entry = self._entry(position)
+            if entry[0] == lesson_id:
+                return entry
+        return None
+
+    def read(self, entry):
+        _, offset, length, _ = entry
+        return json.loads(self._map[offset:offset + length])
+
+    def digests(self):
+        return {entry[0]: entry[3] for entry in map(self._entry, range(self.count))}
+
+    def catalog(self):
+        return json.loads(self._map[self._catalog_offset:self._catalog_offset + self._catalog_length])
+
+    def close(self):
+        self._map.close()
+
+
+class _IndexIds:
+    """Sequence view of the lesson ids in a pack's index, for bisect"""
+
+    def __init__(self, pack):
+        self._pack = pack
+
+    def __len__(self):
+        return self._pack.count
+
+    def __getitem__(self, position):
+        return self._pack._entry(position)[0]
+
+
+class ContentStore:
+    def __init__(self, source_folder, pack_path, cache_size=CACHE_SIZE):
+        self.source_folder = source_folder
+        self.pack_path = pack_path
+        self.cache_size = cache_size
+        self._pack = None
+        self._cache = OrderedDict()
+        self._catalog = None
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._last_check = 0
+
+    @property
+    def version(self):
+        """Changes whenever any lesson changes, for caches of pages built from the content"""
+        return self._pack.source_key.hex()
+
+    def source_files(self):
+        return sorted(entry.name for entry in os.scandir(self.source_folder)
+                      if entry.is_file() and entry.name.endswith('.html'))
+
+    def source_key(self):
+        """Cheap fingerprint of the source files (names, sizes, mtimes)"""
+        digest = hashlib.blake2b(digest_size=16)
+        entries = sorted((entry.name, entry.stat()) for entry in os.scandir(self.source_folder)
+                         if entry.name.endswith('.html') and entry.is_file())
+        for name, stat in entries:
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+        return digest.digest()
+
+    def build(self, key=None):
+        """Compile the source files into the pack"""
+        key = key or self.source_key()
+        lessons = {}
+        for name in self.source_files():
+            try:
+                with open(os.path.join(self.source_folder, name), encoding='utf-8') as f:
+                    text = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                raise ContentError(f"{name}: {e}")
+            lesson = parse_lesson(text, name)
+            if lesson['id'] in lessons:
+                raise ContentError(f"{name}: duplicate lesson id {lesson['id']}")
+            lessons[lesson['id']] = lesson
+        compile_pack(lessons, key, self.pack_path)
+        return len(lessons)
+
+    def load_or_build(self):
+        """Map the existing pack, compiling it first if it's missing or older than the sources"""
+        key = self.source_key()
+        try:
+            pack = ContentPack(self.pack_path)
+            if pack.source_key != key:
+                pack.close()
+                pack = None
+        except (FileNotFoundError, ContentError):
+            pack = None
+        if pack is None:
+            self.build(key)
+            pack = ContentPack(self.pack_path)
+        self._swap(pack)
+
+    def _swap(self, pack):
+        """Start serving from a new pack; returns (changed ids, removed ids)"""
+        with self._lock:
+            old = self._pack
+            old_digests = old.digests() if old else {}
+            new_digests = pack.digests()
+            self._pack = pack
+            self._cache.clear()
+            self._catalog = None
+            if old is not None:
+                old.close()
+        changed = [lesson_id for lesson_id, digest in new_digests.items() if old_digests.get(lesson_id) != digest]
+        removed = [lesson_id for lesson_id in old_digests if lesson_id not in new_digests]
+        return changed, removed
+
+    def maybe_reload(self):
+        """Recompile and swap in the pack if sources changed; checked at most once per CHECK_INTERVAL"""
+        now = time.monotonic()
+        if now - self._last_check < CHECK_INTERVAL:
+            return
+        self._last_check = now
+        if not self._reload_lock.acquire(blocking=False):
+            return  # Another thread is already reloading
+        try:
+            try:
+                key = self.source_key()
+                if key == self._pack.source_key:
+                    return
+                self.build(key)
+            except (ContentError, OSError) as e:
+                # Keep serving the last good pack until the sources compile again
+                # (a bad lesson file, or one removed while it was being scanned)
+                logging.getLogger('relapitch').warning('lesson content not reloaded: %s', e)
+                return
+            changed, removed = self._swap(ContentPack(self.pack_path))
+        finally:
+            self._reload_lock.release()
+        for listener in self._listeners:
+            listener(changed, removed)
+
+    def on_reload(self, listener):
+        """Call listener(changed_ids, removed_ids) after a reload"""
+        self._listeners.append(listener)
+
+    def get(self, lesson_id):
+        """Lesson dict (title, menu_title, keyboard, content), or None"""
+        with self._lock:
+            lesson = self._cache.get(lesson_id)
+            if lesson is not None:
+                self._cache.move_to_end(lesson_id)
+                return lesson
+            entry = self._pack.find(lesson_id)
+            if entry is None:
+                return None
+            lesson = self._pack.read(entry)
+            self._cache[lesson_id] = lesson
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return lesson
+
+    def __contains__(self, lesson_id):
+        with self._lock:
+            return lesson_id in self._cache or self._pack.find(lesson_id) is not None
+
+    def catalog(self):
+        """[{'id', 'title', 'menu_title'}] for every lesson, in id order"""
+        with self._lock:
+            if self._catalog is None:
+                self._catalog = self._pack.catalog()
+            return self._catalog
+
+    def items(self):
+        """(id, lesson) for every lesson; decodes them all, so only for whole-catalog jobs"""
+        for entry in self.catalog():
+            lesson = self.get(entry['id'])
+            if lesson is not None:
+                yield entry['id'], lesson
+
+
+def init_app(app):
+    store = ContentStore(app.config.get('CONTENT_PATH') or os.path.join(app.root_path, 'content', 'lessons'),
+                         app.config.get('CONTENT_PACK_PATH') or os.path.join(app.instance_path, 'content',
+                                                                             'lessons.pack'))
+    store.load_or_build()
+    app.extensions['content'] = store
+
+    if app.config.get('CONTENT_AUTO_RELOAD', True):
+        @app.before_request
+        def reload_content():
+            store.maybe_reload()
+
+    @app.cli.group()
+    def content():
+        """Lesson content commands."""
+
+    @content.command('build')
+    def build_command():
+        """Compile content/lessons into the lesson pack."""
+        count = store.build()
+        click.echo(f"Compiled {count} lessons into {store.pack_path}")
+
+    return store
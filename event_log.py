@@ -0,0 +1,251 @@
+"""Append-only log of quiz answers and progress events.
+
+Requests only put records on an in-memory queue. A background thread
+drains the queue in batches, appends each batch to the current segment
+file with a single write and fsyncs at most once per FSYNC_INTERVAL, so
+durability costs are shared by every record written in that window.
+
+Segments are rotated once they reach a size limit, and each process writes
+its own segments, named so that they sort by creation time::
+
+    events/events-1746090000000-4242.jsonl
+
+Two formats are available:
+
+* "jsonl": one JSON object per line; easy to grep and to export.
+* "binary": each batch is one frame holding zlib-compressed JSON lines,
+  with a small header (magic, record count, length, CRC32). Compresses the
+  repetitive records about 10x, and a torn frame at the end of a segment
+  (e.g. after a crash) is detected and skipped.
+
+EventLogReader streams records back out of the segments, oldest first, and
+remembers how far it got in each one, so aggregations can pick up where
+they left off. Every worker process keeps appending to its own segment
+while the others rotate, so each segment has its own offset and is read
+again whenever it has grown.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+FORMATS = {'jsonl': '.jsonl', 'binary': '.bin'}
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+FLUSH_INTERVAL = 0.2  # Seconds the writer waits for more records before writing
+FSYNC_INTERVAL = 1.0
+MAX_QUEUE = 100000  # Records beyond this are dropped rather than growing memory
+
+FRAME_MAGIC = b'RPEV'
+FRAME_HEADER = struct.Struct('<4sIII')  # magic, record count, payload length, crc32
+
+
+def encode_jsonl(records):
+    return b''.join(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n' for record in records)
+
+
+def encode_frame(records):
+    payload = zlib.compress(encode_jsonl(records), 6)
+    return FRAME_HEADER.pack(FRAME_MAGIC, len(records), len(payload), zlib.crc32(payload)) + payload
+
+
+class EventLog:
+    def __init__(self, directory, format='jsonl', segment_bytes=SEGMENT_BYTES,
+                 flush_interval=FLUSH_INTERVAL, fsync_interval=FSYNC_INTERVAL, max_queue=MAX_QUEUE):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown event log format: {format}")
+        self.directory = directory
+        self.format = format
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_queue = max_queue
+
+        self.written = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._file = None
+        self._segment_size = 0
+        self._last_fsync = 0
+        self._thread = None
+
+    def append(self, record):
+        """Queue a record for writing; never blocks on disk"""
+        with self._condition:
+            if self._closed:
+                return
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._queue.append(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            if len(self._queue) == 1:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                closed = self._closed
+            if not closed:
+                # Let a few more records arrive so they share one write
+                time.sleep(self.flush_interval)
+            with self._condition:
+                batch = list(self._queue)
+                self._queue.clear()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception:
+                    # Keep the writer alive; the next batch starts a fresh segment
+                    logging.getLogger('relapitch').exception('event log write failed, %d records lost', len(batch))
+                    self.dropped += len(batch)
+                    self._discard_segment()
+            if closed:
+                break
+        self._close_segment()
+
+    def _write(self, batch):
+        if self.format == 'jsonl':
+            data = encode_jsonl(batch)
+        else:
+            data = encode_frame(batch)
+
+        if self._file is None or self._segment_size + len(data) > self.segment_bytes:
+            self._open_segment()
+        self._file.write(data)
+        self._file.flush()
+        self._segment_size += len(data)
+        self.written += len(batch)
+
+        now = time.monotonic()
+        if now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def _open_segment(self):
+        self._close_segment()
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"events-{int(time.time() * 1000):013d}-{os.getpid()}{FORMATS[self.format]}"
+        self._file = open(os.path.join(self.directory, name), 'ab')
+        self._segment_size = 0
+
+    def _discard_segment(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """Write out everything queued so far and stop the writer"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+def segment_paths(directory):
+    paths = []
+    for extension in FORMATS.values():
+        paths.extend(glob.glob(os.path.join(directory, f"events-*{extension}")))
+    return sorted(paths, key=os.path.basename)
+
+
+class EventLogReader:
+    """Streams records from every segment in a directory, oldest first.
+
+    `position` maps each segment name to the byte offset just past the last
+    line or frame read from it in full. Pass it back in to only read what
+    was appended since; segments that haven't grown are skipped after a
+    stat, and segments that were removed (e.g. compacted) are forgotten.
+    """
+
+    def __init__(self, directory, position=None):
+        self.directory = directory
+        self.position = dict(position or {})
+
+    def __iter__(self):
+        paths = segment_paths(self.directory)
+        names = {os.path.basename(path) for path in paths}
+        for name in [name for name in self.position if name not in names]:
+            del self.position[name]
+        for path in paths:
+            name = os.path.basename(path)
+            offset = self.position.get(name, 0)
+            try:
+                if os.path.getsize(path) <= offset:
+                    continue
+                if name.endswith(FORMATS['binary']):
+                    records = self._read_frames(path, name, offset)
+                else:
+                    records = self._read_lines(path, name, offset)
+                yield from records
+            except FileNotFoundError:
+                continue  # Removed since the directory was listed
+
+    def _read_lines(self, path, name, offset):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Still being written
+                offset += len(line)
+                self.position[name] = offset
+                yield json.loads(line)
+
+    def _read_frames(self, path, name, offset):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                magic, count, length, crc = FRAME_HEADER.unpack(header)
+                payload = f.read(length)
+                if magic != FRAME_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                    break  # Torn or still being written
+                offset += FRAME_HEADER.size + length
+                lines = zlib.decompress(payload).splitlines()
+                for i, line in enumerate(lines):
+                    if i == len(lines) - 1:
+                        self.position[name] = offset
+                    yield json.loads(line)
+
+
+def create_event_log(app):
+    """Build the event log configured by the app config"""
+    directory = app.config.get('EVENT_LOG_PATH') or os.path.join(app.instance_path, 'events')
+    return EventLog(directory,
+                    format=app.config.get('EVENT_LOG_FORMAT', 'jsonl'),
+                    segment_bytes=app.config.get('EVENT_LOG_SEGMENT_BYTES', SEGMENT_BYTES))
+
+
+def init_app(app):
+    log = create_event_log(app)
+    app.extensions['event_log'] = log
+    return log
@@ -0,0 +1,313 @@
+"""Global, daily and weekly leaderboards.
+
+Each board keeps every user's score in a dict and, for ranking, a Fenwick
+(binary indexed) tree counting users per score. That gives O(log n):
+
+* updates when points are awarded,
+* a user's rank (1 + the number of users with a higher score), and
+* each step of a top-K walk, which finds the next lower occupied score with
+  a binary-lifting search instead of scanning.
+
+Daily and weekly boards are swapped for empty ones the first time they're
+touched in a new period, which is O(1), so a reset never stalls a request.
+A background thread writes changed boards to JSON snapshots every
+SNAPSHOT_INTERVAL seconds, and they are reloaded at startup. With the
+shared store the same thread deletes the stored rows of past periods.
+
+With a shared_state.SharedState store, scores are incremented atomically
+in the store (shared by every worker on the host) instead, and each
+process keeps its trees up to date by pulling the rows that changed since
+its last look, at most once per SYNC_INTERVAL. Snapshots aren't needed
+then. Without one, boards are per process and every process would write
+the same snapshot files, so create_app only allows that with a single
+worker.
+"""
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from datetime import date
+
+import quests
+
+MAX_SCORE = (1 << 18) - 1  # Higher scores still count, but rank in the top bucket
+SNAPSHOT_INTERVAL = 30
+SYNC_INTERVAL = 1.0
+PERIODS = ('global', 'daily', 'weekly')
+
+
+def period_key(period, today):
+    return 'all' if period == 'global' else quests.period_key(period, today)
+
+
+class ScoreBoard:
+    def __init__(self, period='all', max_score=MAX_SCORE):
+        self.period = period
+        self.max_score = max_score
+        self.scores = {}
+        self.members = {}  # score bucket -> set of users
+        self._tree = array('i', [0]) * (max_score + 2)  # 1-based Fenwick tree over buckets 0..max_score
+        self._top_bit = 1 << (max_score + 1).bit_length()
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _bucket(self, score):
+        return min(max(score, 0), self.max_score)
+
+    def _update(self, bucket, delta):
+        i = bucket + 1
+        size = len(self._tree)
+        while i < size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, bucket):
+        """Users with a score bucket <= bucket"""
+        i, total = bucket + 1, 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _kth_bucket(self, k):
+        """Bucket holding the k-th lowest user (1-based), by binary lifting"""
+        position, step = 0, self._top_bit
+        size = len(self._tree)
+        while step:
+            nxt = position + step
+            if nxt < size and self._tree[nxt] < k:
+                position = nxt
+                k -= self._tree[nxt]
+            step >>= 1
+        return position  # Tree index position + 1, i.e. bucket `position`
+
+    def add(self, user, points):
+        return self.set(user, self.scores.get(user, 0) + points)
+
+    def set(self, user, score):
+        old = self.scores.get(user)
+        if old is not None:
+            old_bucket = self._bucket(old)
+            self._update(old_bucket, -1)
+            members = self.members[old_bucket]
+            members.discard(user)
+            if not members:
+                del self.members[old_bucket]
+        bucket = self._bucket(score)
+        self._update(bucket, 1)
+        self.members.setdefault(bucket, set()).add(user)
+        self.scores[user] = score
+        self.dirty = True
+        return score
+
+    def rank(self, user):
+        """1-based rank (ties share a rank), or None if the user has no score"""
+        score = self.scores.get(user)
+        if score is None:
+            return None
+        return len(self.scores) - self._count_upto(self._bucket(score)) + 1
+
+    def top(self, k=10):
+        """The k highest (user, score) pairs, best first"""
+        result = []
+        remaining = len(self.scores)
+        while remaining > 0 and len(result) < k:
+            bucket = self._kth_bucket(remaining)
+            users = self.members[bucket]
+            # A bucket can hold most users (everyone starts at 0), so only pick the few still needed
+            ranked = heapq.nsmallest(k - len(result), users, key=lambda user: (-self.scores[user], user))
+            result.extend((user, self.scores[user]) for user in ranked)
+            remaining -= len(users)
+        return result
+
+    def to_dict(self):
+        return {'period': self.period, 'scores': dict(self.scores)}
+
+    @classmethod
+    def from_dict(cls, data, max_score=MAX_SCORE):
+        board = cls(data['period'], max_score)
+        scores = data['scores']
+        if len(scores) * max_score.bit_length() < max_score:
+            # Few users: n O(log buckets) updates beat a pass over every bucket at startup
+            for user, score in scores.items():
+                board.set(user, score)
+            board.dirty = False
+            return board
+        # Build the tree in O(n + buckets) instead of n separate updates
+        tree = board._tree
+        for user, score in scores.items():
+            bucket = board._bucket(score)
+            board.scores[user] = score
+            board.members.setdefault(bucket, set()).add(user)
+            tree[bucket + 1] += 1
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        return board
+
+
+class Leaderboards:
+    def __init__(self, directory=None, snapshot_interval=SNAPSHOT_INTERVAL, store=None, sync_interval=SYNC_INTERVAL):
+        self.store = store
+        self.directory = None if store else directory  # The shared store is already durable
+        self.snapshot_interval = snapshot_interval
+        self.sync_interval = sync_interval
+        self.boards = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._seq = 0
+        self._synced_at = None
+        self._prunes = {}  # period -> key of the stored rows to keep, for the background thread
+        if self.directory:
+            self._load()
+
+    @property
+    def shared(self):
+        return self.store is not None
+
+    def _path(self, period):
+        return os.path.join(self.directory, f"{period}.json")
+
+    def _load(self):
+        today = date.today()
+        for period in PERIODS:
+            try:
+                with open(self._path(period)) as f:
+                    board = ScoreBoard.from_dict(json.load(f))
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+            if board.period == period_key(period, today):
+                self.boards[period] = board
+
+    def _board(self, period, today):
+        """Current board for the period, starting an empty one when the period rolled over"""
+        key = period_key(period, today)
+        board = self.boards.get(period)
+        if board is None or board.period != key:
+            if board is not None and self.store is not None:
+                self._prunes[period] = key
+            board = self.boards[period] = ScoreBoard(key)
+        return board
+
+    def _sync(self, today):
+        """Apply score changes other processes made to the shared store (call with the lock held)"""
+        now = time.monotonic()
+        if self.store is None or (self._synced_at is not None and now - self._synced_at < self.sync_interval):
+            return
+        rows, self._seq = self.store.changes_since(self._seq)
+        for period, key, user, score in rows:
+            board = self._board(period, today)
+            if board.period == key:
+                board.set(user, score)
+        self._synced_at = now
+
+    def award(self, user, points, today=None, score=0):
+        """Add points to the user on every board; returns their new global score.
+
+        Users join the boards on their first award. `score` is their global
+        score before these points, which seeds the global board if it
+        doesn't know them (sessions can outlive the snapshots).
+        """
+        today = today or date.today()
+        if self.store is not None:
+            return self.apply_totals(user, self.store.add_points(user, points, self.score_rows(score, today)), today)
+        with self._lock:
+            board = self._board('global', today)
+            if user not in board.scores:
+                board.set(user, score)
+            for period in PERIODS:
+                self._board(period, today).add(user, points)
+            total = self.boards['global'].scores[user]
+        self._start_snapshots()
+        return total
+
+    def score_rows(self, score=0, today=None):
+        """(board, period, starting score) rows for the shared store's add_points; see award()"""
+        today = today or date.today()
+        return [(period, period_key(period, today), score if period == 'global' else 0) for period in PERIODS]
+
+    def apply_totals(self, user, totals, today=None):
+        """Take the user's new scores ({board: score}) from the shared store; returns the global one"""
+        today = today or date.today()
+        with self._lock:
+            for period in PERIODS:
+                self._board(period, today).set(user, totals[period])
+        self._start_snapshots()
+        return totals['global']
+
+    def standing(self, user, today=None):
+        """{period: {'rank', 'score', 'players'}} for the user"""
+        today = today or date.today()
+        with self._lock:
+            self._sync(today)
+            result = {}
+            for period in PERIODS:
+                board = self._board(period, today)
+                result[period] = {'rank': board.rank(user), 'score': board.scores.get(user, 0),
+                                  'players': len(board)}
+            return result
+
+    def top(self, period, k=10, today=None):
+        today = today or date.today()
+        with self._lock:
+            self._sync(today)
+            return self._board(period, today).top(k)
+
+    # Snapshots
+
+    def _start_snapshots(self):
+        if (self.directory or self.store) and self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='leaderboard-snapshots', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.snapshot)
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.prune()
+                self.snapshot()
+            except Exception:
+                logging.getLogger('relapitch').exception('leaderboard maintenance failed')
+
+    def prune(self):
+        """Delete the shared store's rows for periods that have rolled over"""
+        with self._lock:
+            pending, self._prunes = self._prunes, {}
+        for period, key in pending.items():
+            self.store.prune_scores(period, key)
+
+    def snapshot(self):
+        """Write every board that changed since the last snapshot"""
+        if not self.directory:
+            return
+        with self._lock:
+            pending = []
+            for period, board in self.boards.items():
+                if board.dirty:
+                    board.dirty = False
+                    pending.append((period, board.to_dict()))  # Copy under the lock, write outside it
+        if not pending:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for period, data in pending:
+            tmp_path = f"{self._path(period)}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, self._path(period))
+
+
+def init_app(app):
+    directory = app.config.get('LEADERBOARD_PATH') or os.path.join(app.instance_path, 'leaderboards')
+    boards = Leaderboards(directory, store=app.extensions.get('shared_state'))
+    app.extensions['leaderboards'] = boards
+    return boards
@@ -0,0 +1,324 @@
+"""Request instrumentation and the Prometheus /metrics exposition.
+
+What is measured:
+
+* request latency per route and method,
+* session (de)serialization time and serialized size,
+* template render time per template,
+* time spent in the quest engine,
+* time spent setting up the user's state (once per request that uses it),
+
+each as a LatencyHistogram. These are HDR-style: values land in log-linear
+buckets (SUB_BUCKETS linear steps per power of two), so recording is O(1),
+memory is fixed, and any percentile is exact to within about 3% whether a
+request took 200 microseconds or 20 seconds.
+
+/metrics renders everything in the Prometheus text format, as histograms
+with a fixed set of `le` bounds plus p50/p90/p99 gauges read from the full
+resolution buckets. How long each startup step took (see
+server.create_app) is exported as a gauge.
+
+Setting PROFILE_SLOW_REQUESTS_MS turns on a sampling profiler: a thread
+samples the stack of every in-flight request every PROFILE_INTERVAL seconds,
+and requests slower than the threshold have their samples written to
+instance/profiles/ as folded stacks ("a;b;c count" lines), which
+flamegraph.pl and speedscope both read.
+"""
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, template_rendered, before_render_template
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_MAGNITUDE = 40  # Powers of two covered above SUB_BUCKETS; values up to 2**46 units
+
+# Bucket upper bounds exported to Prometheus, in seconds (or bytes for sizes)
+LATENCY_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BOUNDS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+QUANTILES = (0.5, 0.9, 0.99)
+
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_FILES = 200
+
+
+class LatencyHistogram:
+    """Log-linear histogram of non-negative integer values (HDR-style)"""
+
+    def __init__(self):
+        # Values below SUB_BUCKETS get a bucket each; above that, each power of two gets SUB_BUCKETS
+        self.counts = array('Q', [0]) * ((MAX_MAGNITUDE + 2) * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+
+    @staticmethod
+    def _index(value):
+        if value < SUB_BUCKETS:
+            return value
+        shift = min(value.bit_length() - SUB_BUCKET_BITS - 1, MAX_MAGNITUDE)
+        sub = min((value >> shift) - SUB_BUCKETS, SUB_BUCKETS - 1)
+        return (shift + 1) * SUB_BUCKETS + sub
+
+    @staticmethod
+    def _upper_bound(index):
+        """Largest value that falls in the bucket"""
+        if index < SUB_BUCKETS:
+            return index
+        shift, sub = divmod(index - SUB_BUCKETS, SUB_BUCKETS)
+        return ((SUB_BUCKETS + sub + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(int(value), 0)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            if n:
+                seen += n
+                if seen >= rank:
+                    return self._upper_bound(index)
+        return self._upper_bound(len(self.counts) - 1)
+
+    def cumulative(self, bounds):
+        """Counts of values <= each bound (bounds ascending)"""
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            while index < len(self.counts) and self._upper_bound(index) <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class Metrics:
+    """Named, labelled histograms, counters and gauges, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}  # name -> (kind, help, unit scale, bounds, {labels: metric})
+
+    def describe(self, name, kind, help_text, scale=1, bounds=LATENCY_BOUNDS):
+        """Declare a metric family. Histogram values are recorded in units of 1/scale."""
+        self._families.setdefault(name, (kind, help_text, scale, bounds, {}))
+
+    def _series(self, name, labels, factory):
+        series = self._families[name][4]
+        key = tuple(sorted(labels.items()))
+        metric = series.get(key)
+        if metric is None:
+            metric = series[key] = factory()
+        return metric
+
+    def observe(self, name, value, **labels):
+        scale = self._families[name][2]
+        with self._lock:
+            self._series(name, labels, LatencyHistogram).record(value * scale)
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._series(name, labels, lambda: [0])[0] = value
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            counter = self._series(name, labels, lambda: [0])
+            counter[0] += amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, scale, bounds, series) in sorted(self._families.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, metric in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append(f"{name}{_labels(key)} {metric[0]}")
+                        continue
+                    if kind == 'gauge':
+                        lines.append(f"{name}{_labels(key)} {metric[0]:.6g}")
+                        continue
+                    cumulative = metric.cumulative([bound * scale for bound in bounds])
+                    for bound, count in zip(bounds, cumulative):
+                        lines.append(f"{name}_bucket{_labels(key, le=bound)} {count}")
+                    lines.append(f"{name}_bucket{_labels(key, le='+Inf')} {metric.count}")
+                    lines.append(f"{name}_sum{_labels(key)} {metric.total / scale:g}")
+                    lines.append(f"{name}_count{_labels(key)} {metric.count}")
+                if kind == 'histogram' and series:
+                    quantile_name = f"{name}_quantile"
+                    lines.append(f"# TYPE {quantile_name} gauge")
+                    for key, metric in sorted(series.items()):
+                        for q in QUANTILES:
+                            value = metric.percentile(q) / scale
+                            lines.append(f"{quantile_name}{_labels(key, quantile=q)} {value:g}")
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _labels(key, **extra):
+    pairs = list(key) + [(name, value) for name, value in extra.items()]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class TimedSerializer:
+    """Wraps a session serializer to record how long (de)serializing takes and how big sessions are"""
+
+    def __init__(self, serializer, metrics):
+        self.serializer = serializer
+        self.metrics = metrics
+
+    def dumps(self, value):
+        start = time.perf_counter()
+        data = self.serializer.dumps(value)
+        self.metrics.observe('relapitch_session_serialize_seconds', time.perf_counter() - start, operation='dumps')
+        self.metrics.observe('relapitch_session_size_bytes', len(data))
+        return data
+
+    def loads(self, data):
+        start = time.perf_counter()
+        value = self.serializer.loads(data)
+        self.metrics.observe('relapitch_session_serialize_seconds', time.perf_counter() - start, operation='loads')
+        return value
+
+
+class SamplingProfiler:
+    """Samples the stacks of in-flight requests and dumps the slow ones as folded stacks"""
+
+    def __init__(self, directory, threshold, interval=PROFILE_INTERVAL):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self._active = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_request(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def finish_request(self, route, duration):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples and duration >= self.threshold:
+            self._dump(route, duration, samples)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_fold(frame)] += 1
+
+    def _dump(self, route, duration, samples):
+        os.makedirs(self.directory, exist_ok=True)
+        existing = sorted(os.listdir(self.directory))
+        for name in existing[:max(0, len(existing) - MAX_PROFILE_FILES + 1)]:
+            os.remove(os.path.join(self.directory, name))
+        slug = route.strip('/').replace('/', '_').replace('<', '').replace('>', '').replace(':', '_') or 'root'
+        name = f"{int(time.time() * 1000):013d}-{slug}-{int(duration * 1000)}ms.folded"
+        with open(os.path.join(self.directory, name), 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+def init_app(app):
+    metrics = Metrics()
+    metrics.describe('relapitch_request_duration_seconds', 'histogram', 'Request latency by route', scale=1e6)
+    metrics.describe('relapitch_requests_total', 'counter', 'Requests by route and status')
+    metrics.describe('relapitch_session_serialize_seconds', 'histogram',
+                     'Time spent (de)serializing sessions', scale=1e6)
+    metrics.describe('relapitch_session_size_bytes', 'histogram', 'Serialized session size', bounds=SIZE_BOUNDS)
+    metrics.describe('relapitch_template_render_seconds', 'histogram', 'Template render time', scale=1e6)
+    metrics.describe('relapitch_quest_engine_seconds', 'histogram', 'Time spent in the quest engine', scale=1e6)
+    metrics.describe('relapitch_user_state_seconds', 'histogram',
+                     "Time spent setting up a user's state, in the requests that need it", scale=1e6)
+    metrics.describe('relapitch_startup_seconds', 'gauge', 'Time each app startup step took')
+    metrics.describe('relapitch_rate_limited_total', 'counter', 'Requests turned away by the rate limiter')
+    metrics.describe('relapitch_log_records_dropped_total', 'counter',
+                     'Log records dropped because the log queue was full')
+    app.extensions['metrics'] = metrics
+
+    profiler = None
+    threshold_ms = app.config.get('PROFILE_SLOW_REQUESTS_MS')
+    if threshold_ms:
+        directory = app.config.get('PROFILE_PATH') or os.path.join(app.instance_path, 'profiles')
+        profiler = SamplingProfiler(directory, float(threshold_ms) / 1000)
+    app.extensions['profiler'] = profiler
+
+    serializer = getattr(app.session_interface, 'serializer', None)
+    if serializer is not None:
+        app.session_interface.serializer = TimedSerializer(serializer, metrics)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        if profiler is not None:
+            profiler.start_request()
+
+    @app.teardown_request
+    def record_request(exc):
+        start = g.pop('request_start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('relapitch_request_duration_seconds', duration, route=route, method=request.method)
+        if profiler is not None:
+            profiler.finish_request(route, duration)
+
+    @app.after_request
+    def count_request(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.inc('relapitch_requests_total', route=route, status=response.status_code)
+        return response
+
+    def template_started(sender, template, context, **extra):
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        starts = g.get('template_starts')
+        if starts:
+            metrics.observe('relapitch_template_render_seconds', time.perf_counter() - starts.pop(),
+                            template=template.name or 'string')
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    return metrics
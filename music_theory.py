@@ -0,0 +1,198 @@
+"""Note, frequency and interval tables shared by the quiz, grading and pitch detection.
+
+Everything is looked up in tables built once at import time instead of
+being recomputed per call:
+
+* MIDI number <-> note name ("C#4") <-> frequency, for MIDI_RANGE,
+* pitch classes by name (sharps and flats),
+* intervals by size up to MAX_INTERVAL semitones (two octaves), by short
+  name ("m3", "P5", "M10") and by full name.
+
+Frequencies are mapped to notes for whole arrays of detections at once::
+
+    midi, cents = nearest_notes(f0)        # f0: array of Hz, NaN/0 where unvoiced
+    names = note_names(midi)               # ["A4", None, ...]
+
+The same tables go to the browser as one static JSON file
+(static/data/music-theory.json, written by init_app when it changes), so the
+tuner and quiz scripts don't carry their own copies of the note math.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+A4_FREQUENCY = 440.0
+A4_MIDI = 69
+MIDI_RANGE = range(12, 121)  # C0 to C9
+
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+FLAT_NAMES = {"Db": 1, "Eb": 3, "Gb": 6, "Ab": 8, "Bb": 10}
+PITCH_CLASSES = dict({name: index for index, name in enumerate(NOTE_NAMES)}, **FLAT_NAMES)
+
+# (semitones, short name, name) up to two octaves
+INTERVALS = [
+    (0, 'P1', 'Unison'), (1, 'm2', 'Minor second'), (2, 'M2', 'Major second'), (3, 'm3', 'Minor third'),
+    (4, 'M3', 'Major third'), (5, 'P4', 'Perfect fourth'), (6, 'TT', 'Tritone'), (7, 'P5', 'Perfect fifth'),
+    (8, 'm6', 'Minor sixth'), (9, 'M6', 'Major sixth'), (10, 'm7', 'Minor seventh'), (11, 'M7', 'Major seventh'),
+    (12, 'P8', 'Octave'), (13, 'm9', 'Minor ninth'), (14, 'M9', 'Major ninth'), (15, 'm10', 'Minor tenth'),
+    (16, 'M10', 'Major tenth'), (17, 'P11', 'Perfect eleventh'), (18, 'A11', 'Augmented eleventh'),
+    (19, 'P12', 'Perfect twelfth'), (20, 'm13', 'Minor thirteenth'), (21, 'M13', 'Major thirteenth'),
+    (22, 'm14', 'Minor fourteenth'), (23, 'M14', 'Major fourteenth'), (24, 'P15', 'Two octaves'),
+]
+MAX_INTERVAL = INTERVALS[-1][0]
+
+NOTE_PATTERN = re.compile(r'^([A-G])([#b]?)(-?\d)?$')
+
+# Lookup tables
+MIDI_NUMBERS = np.arange(MIDI_RANGE.start, MIDI_RANGE.stop)
+FREQUENCIES = A4_FREQUENCY * 2.0 ** ((MIDI_NUMBERS - A4_MIDI) / 12)
+_NAMES = np.array([f"{NOTE_NAMES[midi % 12]}{midi // 12 - 1}" for midi in MIDI_NUMBERS], dtype=object)
+MIDI_BY_NAME = {name: int(midi) for name, midi in zip(_NAMES, MIDI_NUMBERS)}
+MIDI_BY_NAME.update({f"{flat}{midi // 12 - 1}": int(midi) for midi in MIDI_NUMBERS
+                     for flat, pc in FLAT_NAMES.items() if midi % 12 == pc})
+INTERVALS_BY_SIZE = {semitones: (short, name) for semitones, short, name in INTERVALS}
+INTERVAL_SIZES = {short: semitones for semitones, short, _ in INTERVALS}
+INTERVAL_SIZES.update({name.lower(): semitones for semitones, _, name in INTERVALS})
+
+
+# Names and numbers
+
+def note_to_midi(note):
+    """MIDI number of a note name with octave: "A4" -> 69"""
+    midi = MIDI_BY_NAME.get(note)
+    if midi is None:
+        raise ValueError(f"Invalid note name: {note}")
+    return midi
+
+
+def midi_to_note(midi):
+    """Note name of a MIDI number: 61 -> "C#4" """
+    if midi not in MIDI_RANGE:
+        raise ValueError(f"MIDI number out of range: {midi}")
+    return _NAMES[midi - MIDI_RANGE.start]
+
+
+def note_frequency(note):
+    return float(FREQUENCIES[note_to_midi(note) - MIDI_RANGE.start])
+
+
+def pitch_class(note):
+    """Pitch class of a note name with or without octave: "C#4" -> 1, -1 if unknown"""
+    match = NOTE_PATTERN.match(str(note)) if note else None
+    if not match:
+        return -1
+    return PITCH_CLASSES.get(match.group(1) + match.group(2), -1)
+
+
+def note_letter(note):
+    """Strip the octave from a note name: "C#4" -> "C#" """
+    return note.rstrip('-0123456789') if note else None
+
+
+def transpose(note, semitones):
+    return midi_to_note(note_to_midi(note) + semitones)
+
+
+def interval_size(interval):
+    """Semitones in an interval given by short name, full name or number: "M3" -> 4"""
+    if isinstance(interval, int) or str(interval).isdigit():
+        size = int(interval)
+        return size if size in INTERVALS_BY_SIZE else None
+    return INTERVAL_SIZES.get(interval, INTERVAL_SIZES.get(str(interval).lower()))
+
+
+def interval_between(lower, upper):
+    """(semitones, short name) from one note to another; compound beyond an octave"""
+    semitones = note_to_midi(upper) - note_to_midi(lower)
+    short, _ = INTERVALS_BY_SIZE.get(abs(semitones), (None, None))
+    return semitones, short
+
+
+# Frequencies, vectorized
+
+def frequency_to_midi(frequencies):
+    """Fractional MIDI numbers for an array of frequencies (NaN where f <= 0 or NaN)"""
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(frequencies > 0, A4_MIDI + 12 * np.log2(frequencies / A4_FREQUENCY), np.nan)
+
+
+def nearest_notes(frequencies):
+    """(nearest MIDI numbers, cents off them) for an array of frequencies.
+
+    Unvoiced entries (0, negative or NaN) and notes outside MIDI_RANGE get
+    MIDI -1 and NaN cents.
+    """
+    exact = frequency_to_midi(frequencies)
+    midi = np.rint(exact)
+    valid = (midi >= MIDI_RANGE.start) & (midi < MIDI_RANGE.stop)
+    cents = np.where(valid, (exact - midi) * 100, np.nan)
+    return np.where(valid, midi, -1).astype(np.int16), cents
+
+
+def note_names(midi):
+    """Note names for an array of MIDI numbers, None for -1"""
+    midi = np.asarray(midi)
+    valid = midi >= 0
+    names = np.full(midi.shape, None, dtype=object)
+    names[valid] = _NAMES[midi[valid] - MIDI_RANGE.start]
+    return names
+
+
+def frequency_to_note(frequency):
+    """Convert a frequency in Hz to a note name with octave, e.g. 440 -> "A4" """
+    if not frequency or frequency <= 0:
+        return None
+    midi = int(nearest_notes(frequency)[0])
+    return _NAMES[midi - MIDI_RANGE.start] if midi >= 0 else None
+
+
+def cents_from(frequencies, note, octave_equivalent=False):
+    """Signed cents from a note for an array of frequencies.
+
+    With octave_equivalent the distance is to the nearest octave of the note
+    (in [-600, 600)), so singing in one's own octave counts as on pitch.
+    """
+    cents = (frequency_to_midi(frequencies) - note_to_midi(note)) * 100
+    if octave_equivalent:
+        cents = (cents + 600) % 1200 - 600
+    return cents
+
+
+# Client tables
+
+def client_tables():
+    """The tables the browser scripts use, as plain JSON-able data"""
+    return {
+        'a4': A4_FREQUENCY,
+        'noteNames': NOTE_NAMES,
+        'pitchClasses': PITCH_CLASSES,
+        'notes': [{'midi': int(midi), 'name': name, 'frequency': round(float(frequency), 3)}
+                  for midi, name, frequency in zip(MIDI_NUMBERS, _NAMES, FREQUENCIES)],
+        'intervals': [{'semitones': semitones, 'short': short, 'name': name}
+                      for semitones, short, name in INTERVALS]
+    }
+
+
+def write_client_tables(path):
+    """Write the tables to path unless it already has them; returns True if it was written"""
+    data = json.dumps(client_tables(), separators=(',', ':'), sort_keys=True).encode('utf-8') + b'\n'
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def init_app(app):
+    # Before the asset pipeline builds, so the file is fingerprinted with the rest
+    write_client_tables(os.path.join(app.static_folder, 'data', 'music-theory.json'))
@@ -0,0 +1,88 @@
+"""Offline mode: what the service worker precaches, and its version.
+
+The service worker (static/js/service-worker.js, served at
+/service-worker.js) precaches everything a practice session needs so that
+lessons and quizzes keep working on a flaky connection:
+
+* every lesson page, from the content catalog,
+* the CSS and JS the pages load (the bundles and the files outside any
+  bundle, under their fingerprinted names) and the third-party libraries,
+* the note sample pack the lesson and quiz pages play.
+
+The precache list is served as /offline/manifest.json together with a
+version hashed from the content, asset and sample versions. Pages register
+the worker as /service-worker.js?v=<version>, so any change to the list
+installs a fresh worker, which fills a new cache and drops the old one.
+
+While offline, the worker answers progress and quiz POSTs with 202 and
+keeps the requests in IndexedDB; they are replayed in order (progress
+events merged into /log_progress/batch requests) once the connection is
+back.
+"""
+import hashlib
+
+from flask import url_for
+
+import assets
+
+# Requests the service worker queues while offline and replays later
+QUEUED_ENDPOINTS = ('/log_progress', '/log_progress/batch', '/quiz/submit')
+
+
+def static_files(pipeline):
+    """Source names of the static files pages actually load: bundles, and files not in any bundle"""
+    bundled = {part for parts in assets.BUNDLES.values() for part in parts}
+    # Vendored libraries are listed through vendor_url(), and the worker doesn't cache itself
+    skipped = bundled | set(assets.VENDOR_LIBS) | {'js/service-worker.js'}
+    return sorted(name for name in pipeline.manifest if name not in skipped)
+
+
+class PrecacheManifest:
+    def __init__(self, content, pipeline, sample_bank):
+        self.content = content
+        self.pipeline = pipeline
+        self.sample_bank = sample_bank
+        self._cached = None
+
+    @property
+    def version(self):
+        digest = hashlib.blake2b(digest_size=8)
+        for part in (self.content.version, self.pipeline.version, self.sample_bank.manifest['pack']):
+            digest.update(f"{part}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def build(self, vendor_url, note_bank, max_progress_batch):
+        """The precache list for the current versions; needs a request or app context for url_for"""
+        version = self.version
+        if self._cached is not None and self._cached['version'] == version:
+            return self._cached
+
+        urls = [url_for('main.lesson', lesson_id=entry['id']) for entry in self.content.catalog()]
+        urls += [url_for('static', filename=name) for name in static_files(self.pipeline)]
+        urls.append(note_bank()['pack'])
+        urls.append(url_for('main.web_app_manifest'))
+        # CDN copies unless vendored; the worker caches these on a best-effort basis
+        urls += [vendor_url(name.split('/', 1)[1]) for name in assets.VENDOR_LIBS]
+
+        self._cached = {
+            'version': version,
+            'urls': urls,
+            'queued_endpoints': list(QUEUED_ENDPOINTS),
+            'max_progress_batch': max_progress_batch
+        }
+        return self._cached
+
+
+def web_app_manifest():
+    """The web app manifest, so the app can be installed to the home screen"""
+    return {
+        'name': 'RelaPitch',
+        'short_name': 'RelaPitch',
+        'description': 'Relative pitch ear training',
+        'start_url': url_for('main.home'),
+        'scope': '/',
+        'display': 'standalone',
+        'background_color': '#89c8f0',
+        'theme_color': '#3498db',
+        'icons': [{'src': url_for('static', filename='icons/icon.svg'), 'sizes': 'any', 'type': 'image/svg+xml'}]
+    }
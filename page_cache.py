@@ -0,0 +1,68 @@
+"""In-memory cache of fully rendered pages that are the same for everyone.
+
+Entries are keyed by the caller (e.g. lesson id plus the content and asset
+versions), so changing the content simply produces a new key. Each entry
+keeps the encoded body and a strong ETag derived from it, which lets
+repeat visitors revalidate with a 304 instead of downloading the page again.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+MAX_ENTRIES = 256
+
+
+class CachedPage:
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.etag = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+
+
+class PageCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get_or_render(self, key, render):
+        """Return the cached page for key, calling render() to build it on a miss"""
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+
+        # Render outside the lock; two threads racing on a cold key both render once
+        page = CachedPage(render())
+        with self._lock:
+            self.misses += 1
+            self._pages[key] = page
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+def page_response(page, max_age=0):
+    """Response for a cached page, answering If-None-Match with a 304"""
+    response = Response(page.body, mimetype='text/html')
+    response.set_etag(page.etag)
+    response.cache_control.public = True
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True  # Always revalidate, it's cheap
+    return response.make_conditional(request)
@@ -0,0 +1,243 @@
+"""Server-side pitch detection for sing mode.
+
+This is the YIN estimator (de Cheveigné & Kawahara, 2002) written with NumPy
+so that the work is done on whole matrices of frames at once: the
+correlation term of the difference function comes from an FFT instead of
+the O(N²) loop the browser tuner uses, and frames from many clips are
+stacked into one batch.
+
+Typical use::
+
+    samples, sample_rate = decode_wav(wav_bytes)
+    result = analyze_clips([(samples, sample_rate)])[0]
+    result['note']  # e.g. "G4", or None if no pitch was found
+"""
+import base64
+import io
+import wave
+
+import numpy as np
+
+from music_theory import frequency_to_note, nearest_notes, note_names
+
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+MIN_FREQUENCY = 60.0  # Hz, a bit below a low male voice
+MAX_FREQUENCY = 1500.0  # Hz, well above a soprano's high C
+YIN_THRESHOLD = 0.15
+SILENCE_RMS = 0.01  # Same cut-off as the browser tuner
+
+# Frames are processed in chunks so a large batch doesn't build one huge FFT matrix
+MAX_FRAMES_PER_CHUNK = 512
+
+MAX_CLIPS = 32
+MAX_CLIP_SECONDS = 10
+
+
+class AudioDecodeError(ValueError):
+    pass
+
+
+def frame_signal(samples, frame_size=FRAME_SIZE, hop_size=HOP_SIZE):
+    """Return a (n_frames, frame_size) view of samples, zero-padding short clips"""
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < frame_size:
+        samples = np.pad(samples, (0, frame_size - len(samples)))
+    return np.lib.stride_tricks.sliding_window_view(samples, frame_size)[::hop_size]
+
+
+def yin(frames, sample_rate, min_frequency=MIN_FREQUENCY, max_frequency=MAX_FREQUENCY,
+        threshold=YIN_THRESHOLD):
+    """Estimate f0 for every row of frames.
+
+    Returns (f0, confidence, voiced) arrays with one entry per frame. f0 is 0
+    where the frame is silent or has no clear period.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    n_frames, frame_size = frames.shape
+    window = frame_size // 2
+    tau_min = max(2, int(sample_rate / max_frequency))
+    tau_max = min(window - 1, int(np.ceil(sample_rate / min_frequency)))
+    taus = np.arange(tau_max + 1)
+
+    # Difference function d(tau) = sum_j (x_j - x_{j+tau})^2 for j < window,
+    # expanded as energy(head) + energy(shifted) - 2 * correlation(tau).
+    # The correlation of the head with the whole frame comes from one FFT.
+    fft_size = 1 << int(np.ceil(np.log2(frame_size + window)))
+    spectrum = np.fft.rfft(frames, fft_size, axis=1)
+    head_spectrum = np.fft.rfft(frames[:, :window], fft_size, axis=1)
+    correlation = np.fft.irfft(np.conj(head_spectrum) * spectrum, fft_size, axis=1)[:, :tau_max + 1]
+
+    energy = np.zeros((n_frames, frame_size + 1))
+    np.cumsum(frames * frames, axis=1, out=energy[:, 1:])
+    difference = energy[:, window:window + 1] + energy[:, taus + window] - energy[:, taus] - 2 * correlation
+    np.maximum(difference, 0, out=difference)
+    difference[:, 0] = 0
+
+    # Cumulative mean normalized difference
+    cumulative = np.cumsum(difference[:, 1:], axis=1)
+    cmnd = np.ones_like(difference)
+    np.divide(difference[:, 1:] * taus[1:], cumulative, out=cmnd[:, 1:], where=cumulative > 0)
+
+    # First dip below the threshold, i.e. the first local minimum under it.
+    # Frames without one fall back to the global minimum (and low confidence).
+    search = cmnd[:, tau_min:tau_max]
+    candidates = (search < threshold) & (search <= cmnd[:, tau_min + 1:tau_max + 1])
+    has_dip = candidates.any(axis=1)
+    best = np.where(has_dip, candidates.argmax(axis=1), search.argmin(axis=1)) + tau_min
+
+    # Parabolic interpolation around the chosen lag for sub-sample precision
+    rows = np.arange(n_frames)
+    left, centre, right = cmnd[rows, best - 1], cmnd[rows, best], cmnd[rows, best + 1]
+    curvature = left - 2 * centre + right
+    shift = np.zeros(n_frames)
+    np.divide(0.5 * (left - right), curvature, out=shift, where=np.abs(curvature) > 1e-12)
+    period = best + np.clip(shift, -1, 1)
+
+    rms = np.sqrt(energy[:, -1] / frame_size)
+    voiced = has_dip & (rms >= SILENCE_RMS)
+    f0 = np.where(voiced, sample_rate / period, 0.0)
+    confidence = np.where(rms >= SILENCE_RMS, np.clip(1 - centre, 0, 1), 0.0)
+    return f0, confidence, voiced
+
+
+def analyze_clips(clips, frame_size=FRAME_SIZE, hop_size=HOP_SIZE):
+    """Run pitch detection over many (samples, sample_rate) clips.
+
+    Frames from clips that share a sample rate are stacked and analyzed
+    together. Returns one result dict per clip, in order.
+    """
+    framed = [frame_signal(samples, frame_size, hop_size) for samples, _ in clips]
+
+    by_rate = {}
+    for index, (_, sample_rate) in enumerate(clips):
+        by_rate.setdefault(sample_rate, []).append(index)
+
+    outputs = [None] * len(clips)
+    for sample_rate, indexes in by_rate.items():
+        stacked = np.concatenate([framed[i] for i in indexes])
+        f0 = np.empty(len(stacked))
+        confidence = np.empty(len(stacked))
+        voiced = np.empty(len(stacked), dtype=bool)
+        for start in range(0, len(stacked), MAX_FRAMES_PER_CHUNK):
+            end = start + MAX_FRAMES_PER_CHUNK
+            f0[start:end], confidence[start:end], voiced[start:end] = yin(stacked[start:end], sample_rate)
+
+        offset = 0
+        for i in indexes:
+            count = len(framed[i])
+            outputs[i] = (sample_rate, f0[offset:offset + count], confidence[offset:offset + count],
+                          voiced[offset:offset + count])
+            offset += count
+
+    return [_summarize(*output, hop_size=hop_size) for output in outputs]
+
+
+def _summarize(sample_rate, f0, confidence, voiced, hop_size=HOP_SIZE):
+    # Notes and cents for every frame at once, from the music theory tables
+    midi, cents = nearest_notes(np.where(voiced, f0, np.nan))
+    notes = note_names(midi)
+    frames = [{
+        'time': round(i * hop_size / sample_rate, 4),
+        'f0': round(float(f0[i]), 2) if voiced[i] else None,
+        'confidence': round(float(confidence[i]), 3),
+        'note': notes[i],
+        'cents': round(float(cents[i]), 1) if notes[i] else None
+    } for i in range(len(f0))]
+
+    # The clip's note is the median of the voiced frames, which ignores
+    # the odd octave slip at the start or end of a sung note
+    if voiced.any():
+        median_f0 = float(np.median(f0[voiced]))
+        note = frequency_to_note(median_f0)
+        clip_confidence = float(np.mean(confidence[voiced]))
+    else:
+        median_f0, note, clip_confidence = None, None, 0.0
+
+    return {
+        'sample_rate': sample_rate,
+        'f0': round(median_f0, 2) if median_f0 else None,
+        'note': note,
+        'confidence': round(clip_confidence, 3),
+        'voiced_ratio': round(float(np.mean(voiced)), 3) if len(voiced) else 0.0,
+        'frames': frames
+    }
+
+
+def decode_wav(data):
+    """Decode PCM WAV bytes into mono float32 samples in [-1, 1] and the sample rate"""
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as wav:
+            channels = wav.getnchannels()
+            sample_width = wav.getsampwidth()
+            sample_rate = wav.getframerate()
+            raw = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise AudioDecodeError(f"Invalid WAV data: {e}")
+    if len(raw) % (channels * sample_width):
+        raise AudioDecodeError(f"Invalid WAV data: {len(raw)} bytes is not a whole number of "
+                               f"{channels}-channel {sample_width * 8}-bit frames")
+
+    if sample_width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768
+    elif sample_width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise AudioDecodeError(f"Unsupported WAV sample width: {sample_width * 8} bits")
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, sample_rate
+
+
+def encode_wav(samples, sample_rate):
+    """16-bit mono PCM WAV bytes for float samples in [-1, 1]"""
+    pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def decode_pcm(data, encoding, sample_rate):
+    """Decode raw little-endian mono PCM ("float32" or "int16")"""
+    if encoding == 'float32':
+        samples = np.frombuffer(data[:len(data) - len(data) % 4], dtype='<f4')
+    elif encoding == 'int16':
+        samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2').astype(np.float32) / 32768
+    else:
+        raise AudioDecodeError(f"Unsupported PCM encoding: {encoding}")
+    return samples, sample_rate
+
+
+def decode_clip(clip):
+    """Decode a JSON clip: {"data": base64, "encoding": "wav"|"float32"|"int16", "sample_rate": int}"""
+    try:
+        data = base64.b64decode(clip['data'], validate=True)
+    except (KeyError, TypeError, ValueError):
+        raise AudioDecodeError("Clip 'data' must be base64-encoded audio")
+
+    encoding = clip.get('encoding', 'wav')
+    if encoding == 'wav':
+        samples, sample_rate = decode_wav(data)
+    else:
+        try:
+            sample_rate = int(clip['sample_rate'])
+        except (KeyError, TypeError, ValueError):
+            raise AudioDecodeError("Raw PCM clips need a 'sample_rate'")
+        samples, sample_rate = decode_pcm(data, encoding, sample_rate)
+    return check_clip(samples, sample_rate)
+
+
+def check_clip(samples, sample_rate):
+    """Reject clips the analyzer shouldn't spend time on"""
+    if not 8000 <= sample_rate <= 192000:
+        raise AudioDecodeError(f"Unsupported sample rate: {sample_rate}")
+    if len(samples) > MAX_CLIP_SECONDS * sample_rate:
+        raise AudioDecodeError(f"Clips can be at most {MAX_CLIP_SECONDS} seconds long")
+    return samples, sample_rate
@@ -0,0 +1,218 @@
+"""Real-time pitch tracking for audio streamed over a WebSocket.
+
+Each connection gets a PitchStream: a preallocated ring buffer that incoming
+PCM frames are copied into. A single PitchStreamHub thread periodically
+gathers the newest window of every stream that has enough new audio, copies
+them into one preallocated batch matrix and runs the YIN detector over all
+of them at once, so the per-singer cost is a slice copy plus a share of one
+vectorized call. The thread sleeps until a push() brings some stream a hop
+of new audio, so an idle hub costs nothing.
+
+Backpressure works on both sides:
+
+* If the hub falls behind, a stream is only analyzed at its newest window;
+  the hops in between are skipped and counted as dropped frames.
+* If a client doesn't read its updates, newer results replace the unsent
+  one instead of queueing up.
+"""
+import logging
+import threading
+
+import numpy as np
+
+from music_theory import nearest_notes, note_names
+from pitch_detection import yin
+
+FRAME_SIZE = 1024
+TARGET_SAMPLE_RATE = 22050  # Input is decimated to about this rate; plenty for the singing range
+UPDATES_PER_SECOND = 20
+BUFFER_SECONDS = 0.5
+MAX_STREAMS = 500
+MAX_BATCH = 256
+MAX_MESSAGE_BYTES = 64 * 1024
+
+ENCODINGS = {'float32': '<f4', 'int16': '<i2'}
+
+
+class StreamError(Exception):
+    pass
+
+
+class PitchStream:
+    """Sliding window of one singer's audio plus their latest pitch update."""
+
+    def __init__(self, hub, sample_rate, encoding='float32'):
+        if encoding not in ENCODINGS:
+            raise StreamError(f"Unsupported encoding: {encoding}")
+        if not 8000 <= sample_rate <= 192000:
+            raise StreamError(f"Unsupported sample rate: {sample_rate}")
+
+        self.hub = hub
+        self.dtype = np.dtype(ENCODINGS[encoding])
+        self.decimation = max(1, int(sample_rate // TARGET_SAMPLE_RATE))
+        self.sample_rate = sample_rate / self.decimation
+        self.hop = int(self.sample_rate / UPDATES_PER_SECOND)
+
+        # Buffers are allocated once per connection and reused for every frame
+        self.ring = np.zeros(max(2 * FRAME_SIZE, int(self.sample_rate * BUFFER_SECONDS)), dtype=np.float32)
+        self.carry = np.zeros(self.decimation, dtype=np.float32)
+        self.carry_length = 0
+        self.write_position = 0
+        self.total_samples = 0
+        self.analyzed_at = 0
+
+        self.frames_dropped = 0
+        self.updates_skipped = 0
+        self.update = None
+        self.on_update = None  # Optional callback for async transports
+        self.lock = threading.Lock()
+
+    def push(self, payload):
+        """Append a chunk of little-endian mono PCM to the buffer"""
+        if len(payload) > MAX_MESSAGE_BYTES:
+            raise StreamError("Audio message too large")
+        usable = len(payload) - len(payload) % self.dtype.itemsize
+        samples = np.frombuffer(payload[:usable], dtype=self.dtype)
+        if self.dtype.kind == 'i':
+            samples = samples * np.float32(1 / 32768)
+
+        with self.lock:
+            samples = self._decimate(samples)
+            count = len(samples)
+            if count == 0:
+                return
+            capacity = len(self.ring)
+            if count > capacity:
+                samples = samples[-capacity:]
+            start = self.write_position
+            first = min(len(samples), capacity - start)
+            self.ring[start:start + first] = samples[:first]
+            self.ring[:len(samples) - first] = samples[first:]
+            self.write_position = (start + len(samples)) % capacity
+            self.total_samples += count
+            due = self.is_due()
+
+        if due:
+            self.hub.wake()
+
+    def _decimate(self, samples):
+        """Average groups of `decimation` samples, carrying leftovers to the next chunk"""
+        if self.decimation == 1:
+            return samples
+        if self.carry_length:
+            samples = np.concatenate((self.carry[:self.carry_length], samples))
+        usable = len(samples) - len(samples) % self.decimation
+        leftover = len(samples) - usable
+        self.carry[:leftover] = samples[usable:]
+        self.carry_length = leftover
+        return samples[:usable].reshape(-1, self.decimation).mean(axis=1)
+
+    def is_due(self):
+        return self.total_samples >= FRAME_SIZE and self.total_samples - self.analyzed_at >= self.hop
+
+    def copy_window(self, out):
+        """Copy the newest FRAME_SIZE samples into out, oldest first"""
+        with self.lock:
+            end = self.write_position
+            start = end - FRAME_SIZE
+            if start >= 0:
+                out[:] = self.ring[start:end]
+            else:
+                out[:-start] = self.ring[start:]
+                out[-start:] = self.ring[:end]
+            # Every whole hop we never got around to analyzing is a dropped frame
+            self.frames_dropped += max(0, (self.total_samples - self.analyzed_at) // self.hop - 1)
+            self.analyzed_at = self.total_samples
+            return self.total_samples
+
+    def publish(self, update):
+        with self.lock:
+            if self.update is not None:
+                self.updates_skipped += 1
+            update['dropped'] = self.frames_dropped
+            update['skipped'] = self.updates_skipped
+            self.update = update
+        if self.on_update is not None:
+            self.on_update()
+
+    def take_update(self):
+        """Return the newest unsent update, or None"""
+        with self.lock:
+            update, self.update = self.update, None
+            return update
+
+
+class PitchStreamHub:
+    """Runs batched pitch detection for every open stream on one thread."""
+
+    def __init__(self, max_streams=MAX_STREAMS, max_batch=MAX_BATCH):
+        self.max_streams = max_streams
+        self.max_batch = max_batch
+        self._streams = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._batch = np.zeros((max_batch, FRAME_SIZE), dtype=np.float32)
+        self._thread = None
+
+    def __len__(self):
+        return len(self._streams)
+
+    def open(self, sample_rate, encoding='float32'):
+        stream = PitchStream(self, sample_rate, encoding)
+        with self._lock:
+            if len(self._streams) >= self.max_streams:
+                raise StreamError("Too many concurrent pitch streams")
+            self._streams.add(stream)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pitch-stream-hub', daemon=True)
+                self._thread.start()
+        return stream
+
+    def close(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.process()
+            except Exception:
+                logging.getLogger('relapitch').exception('pitch stream hub failed')
+
+    def process(self):
+        """Analyze the newest window of every stream that has a hop of new audio"""
+        with self._lock:
+            due = [stream for stream in self._streams if stream.is_due()]
+
+        by_rate = {}
+        for stream in due:
+            by_rate.setdefault(stream.sample_rate, []).append(stream)
+
+        for sample_rate, streams in by_rate.items():
+            for start in range(0, len(streams), self.max_batch):
+                chunk = streams[start:start + self.max_batch]
+                try:
+                    self._analyze(chunk, sample_rate)
+                except Exception:
+                    # Those streams miss this update; the rest of the round still gets theirs
+                    logging.getLogger('relapitch').exception('pitch analysis failed for %d streams', len(chunk))
+        return len(due)
+
+    def _analyze(self, streams, sample_rate):
+        positions = [stream.copy_window(self._batch[i]) for i, stream in enumerate(streams)]
+        f0, confidence, voiced = yin(self._batch[:len(streams)], sample_rate)
+        midi, cents = nearest_notes(np.where(voiced, f0, np.nan))
+        notes = note_names(midi)
+        for i, stream in enumerate(streams):
+            stream.publish({
+                't': round(positions[i] / sample_rate, 3),
+                'f0': round(float(f0[i]), 2) if voiced[i] else None,
+                'confidence': round(float(confidence[i]), 3),
+                'note': notes[i],
+                'cents': round(float(cents[i]), 1) if notes[i] else None
+            })
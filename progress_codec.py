@@ -0,0 +1,460 @@
+"""Compact binary encoding of a user's progress state (the session dict).
+
+The session used to be stored as tagged JSON, so a heavy user paid for
+thousands of ``"quiz_listen_3_correct": true`` pairs on every save and
+load. This codec keeps exactly the same Python structure but writes it as:
+
+* Completed items grouped into families: the item id with its numbers taken
+  out ("lesson_#_item_#"). Each family stores the template once, and each
+  distinct tail of numbers stores the set of leading numbers as a bitset
+  (or as deltas when the set is sparse).
+* ISO timestamps ("2025-05-01T10:20:30.123456", as written by
+  datetime.isoformat()) as integer microseconds since the epoch.
+* The quest board with fixed-width counters: a u16 state and a flag byte
+  per quest.
+* Every other string through an intern table, so each string is written
+  once per record. The table starts with STATIC_STRINGS (keys and ids every
+  session has), which cost a single byte.
+* Anything else with small type tags and varints.
+
+Records start with MAGIC and a format version. Older records are decoded
+with the reader for their version and then passed through MIGRATIONS one
+version at a time. Version 0 is the tagged JSON the sessions used before,
+so existing sessions keep loading. A state the schema can't express (a
+type it doesn't know) is written as version 0 JSON instead.
+
+    data = encode_state(state)     # bytes, for a session store or any other record
+    state = decode_state(data)
+
+ProgressSerializer wraps the two for the session interface.
+"""
+import re
+import struct
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from flask.json.tag import TaggedJSONSerializer
+
+MAGIC = b'\xb7P'
+FORMAT_VERSION = 1
+
+# Strings every session has. The table is part of the format: never change a
+# version's list, add a new version (and a migration) instead.
+STATIC_STRINGS = {
+    1: (
+        'user_id', 'user_data', 'start_time', 'lesson_visits', 'quiz_answers', 'quiz_score', 'score',
+        'completed_items', 'quests', 'schedules', 'quiz_set', 'quiz_mode', 'reference_note',
+        'answer', 'timestamp', 'is_correct', 'target_note', 'response_ms', 'detected_f0', 'cents_off',
+        'daily', 'weekly', 'period', 'id', 'state', 'done',
+        'listen', 'sing', 'chromatic', 'interval',
+        'C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4', 'C', 'D', 'E', 'F', 'G', 'A', 'B',
+        'sharp_ear', 'pitch_tuner', 'daily_discovery', 'perfect_listener', 'well_rounded_musician',
+        'weekly_quiz_regular', 'weekly_student', 'weekly_singer',
+    ),
+}
+
+# Value tags
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_STR_REF, T_BYTES, T_LIST, T_TUPLE, T_DICT, \
+    T_ITEM_SET, T_TIMESTAMP, T_QUEST_BOARD = range(14)
+
+# Number sets inside an item family
+SET_BITS, SET_DELTAS = 0, 1
+
+DOUBLE = struct.Struct('<d')
+QUEST_ENTRY = struct.Struct('<HB')  # state, done
+MAX_QUEST_STATE = 0xFFFF
+
+TIMESTAMP_PATTERN = re.compile(r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d{6})?$')
+# Numbers in item ids; zero-padded ones ("05") stay part of the template since int() would drop the 0
+NUMBER_PATTERN = re.compile(r'(?<![0-9])(?:0|[1-9][0-9]*)(?![0-9])')
+PLACEHOLDER = '\x00'  # Where a number was taken out of an item id
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+BIT_OFFSETS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+_json = TaggedJSONSerializer()
+
+
+class CodecError(ValueError):
+    pass
+
+
+class _Unencodable(Exception):
+    """The state has something the binary schema doesn't cover; use JSON instead"""
+
+
+# Varints
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_signed(out, value):
+    _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+
+
+class _Reader:
+    __slots__ = ('data', 'pos', 'strings')
+
+    def __init__(self, data, pos, strings):
+        self.data = data
+        self.pos = pos
+        self.strings = list(strings)
+
+    def byte(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def varint(self):
+        data = self.data
+        result = shift = 0
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def signed(self):
+        value = self.varint()
+        return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+    def raw(self, length):
+        end = self.pos + length
+        if end > len(self.data):
+            raise CodecError('truncated progress record')
+        value = self.data[self.pos:end]
+        self.pos = end
+        return value
+
+
+# Encoding
+
+class _Writer:
+    def __init__(self, version=FORMAT_VERSION):
+        self.out = bytearray(MAGIC)
+        self.out.append(version)
+        self.strings = {string: index for index, string in enumerate(STATIC_STRINGS[version])}
+
+    def string(self, value):
+        index = self.strings.get(value)
+        if index is not None:
+            self.out.append(T_STR_REF)
+            _write_varint(self.out, index)
+            return
+        self.strings[value] = len(self.strings)
+        data = value.encode('utf-8')
+        self.out.append(T_STR)
+        _write_varint(self.out, len(data))
+        self.out += data
+
+    def value(self, value):
+        out = self.out
+        if value is None:
+            out.append(T_NONE)
+        elif value is True:
+            out.append(T_TRUE)
+        elif value is False:
+            out.append(T_FALSE)
+        elif type(value) is int:
+            out.append(T_INT)
+            _write_signed(out, value)
+        elif type(value) is float:
+            out.append(T_FLOAT)
+            out += DOUBLE.pack(value)
+        elif type(value) is str:
+            micros = _timestamp_micros(value)
+            if micros is None:
+                self.string(value)
+            else:
+                out.append(T_TIMESTAMP)
+                _write_signed(out, micros)
+        elif type(value) is bytes:
+            out.append(T_BYTES)
+            _write_varint(out, len(value))
+            out += value
+        elif type(value) in (list, tuple):
+            out.append(T_LIST if type(value) is list else T_TUPLE)
+            _write_varint(out, len(value))
+            for item in value:
+                self.value(item)
+        elif type(value) is dict:
+            if not (value and self.item_set(value)):
+                self.dict(value)
+        else:
+            raise _Unencodable(type(value).__name__)
+
+    def dict(self, value, quest_board=False):
+        self.out.append(T_DICT)
+        _write_varint(self.out, len(value))
+        for key, item in value.items():
+            if type(key) is not str:
+                raise _Unencodable('non-string key')
+            self.string(key)
+            if key == 'quests' and quest_board and self.quest_board(item):
+                continue
+            self.value(item)
+
+    def item_set(self, items):
+        """{item id: True} as families of numbered ids; False if the dict isn't such a set"""
+        try:
+            if PLACEHOLDER in ''.join(items):
+                return False
+        except TypeError:
+            return False  # Not all strings
+        if any(flag is not True for flag in items.values()):
+            return False
+        # (template, every number after the first) -> first numbers
+        groups = {}
+        parsed = _parsed_items.get
+        for item in items:
+            template, first, rest = parsed(item) or _parse_item(item)
+            groups.setdefault((template, rest), []).append(first)
+
+        out = self.out
+        out.append(T_ITEM_SET)
+        families = groupby(sorted(groups), key=itemgetter(0))
+        _write_varint(out, len({template for template, _ in groups}))
+        for template, keys in families:
+            self.string(template)
+            if PLACEHOLDER not in template:
+                continue  # No numbers: the template is the item
+            keys = list(keys)
+            _write_varint(out, len(keys))
+            for key in keys:
+                for number in key[1]:
+                    _write_varint(out, number)
+                _write_number_set(out, sorted(groups[key]))
+        return True
+
+    def quest_board(self, board):
+        """The quest board with fixed-width counters; False if it doesn't have the usual shape"""
+        if type(board) is not dict:
+            return False
+        for period in board.values():
+            if type(period) is not dict or period.keys() != {'period', 'quests'} or type(period['quests']) is not list:
+                return False
+            for entry in period['quests']:
+                if (type(entry) is not dict or entry.keys() != {'id', 'state', 'done'} or type(entry['id']) is not str
+                        or type(entry['state']) is not int or not 0 <= entry['state'] <= MAX_QUEST_STATE
+                        or type(entry['done']) is not bool):
+                    return False
+
+        out = self.out
+        out.append(T_QUEST_BOARD)
+        _write_varint(out, len(board))
+        for name, period in board.items():
+            if type(name) is not str:
+                raise _Unencodable('non-string key')
+            self.string(name)
+            self.value(period['period'])
+            _write_varint(out, len(period['quests']))
+            for entry in period['quests']:
+                self.string(entry['id'])
+                out += QUEST_ENTRY.pack(entry['state'], entry['done'])
+        return True
+
+
+def _timestamp_micros(value):
+    """Microseconds since the epoch for a naive isoformat() timestamp, or None for any other string"""
+    if len(value) not in (19, 26) or not TIMESTAMP_PATTERN.match(value):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.isoformat() != value:
+        return None  # Wouldn't come back as the same string
+    return (moment - EPOCH) // MICROSECOND
+
+
+# item id -> (template, first number, other numbers)
+_parsed_items = {}
+MAX_PARSED_ITEMS = 100000
+
+
+def _parse_item(item):
+    """"lesson_12_item_3" -> ("lesson_\\0_item_\\0", 12, (3,)), remembered since ids repeat across saves and users"""
+    numbers = [int(number) for number in NUMBER_PATTERN.findall(item)]
+    parsed = (NUMBER_PATTERN.sub(PLACEHOLDER, item), numbers[0], tuple(numbers[1:])) if numbers else (item, None, ())
+    if len(_parsed_items) >= MAX_PARSED_ITEMS:
+        _parsed_items.clear()
+    _parsed_items[item] = parsed
+    return parsed
+
+
+def _write_number_set(out, numbers):
+    """Sorted non-negative ints as a bitset from the smallest, or as deltas if that's smaller"""
+    base = numbers[0]
+    bitset_size = (numbers[-1] - base) // 8 + 1
+    if bitset_size <= 2 * len(numbers):
+        bits = bytearray(bitset_size)
+        for number in numbers:
+            offset = number - base
+            bits[offset >> 3] |= 1 << (offset & 7)
+        out.append(SET_BITS)
+        _write_varint(out, base)
+        _write_varint(out, bitset_size)
+        out += bits
+    else:
+        out.append(SET_DELTAS)
+        _write_varint(out, len(numbers))
+        previous = 0
+        for number in numbers:
+            _write_varint(out, number - previous)
+            previous = number
+
+
+def encode_state(state):
+    """The state dict as a binary record (or as version 0 JSON if the schema can't express it)"""
+    writer = _Writer()
+    try:
+        writer.dict(state, quest_board=True)
+    except _Unencodable:
+        return _json.dumps(state).encode('utf-8')
+    return bytes(writer.out)
+
+
+# Decoding
+
+def _read_value(reader, tag=None):
+    if tag is None:
+        tag = reader.byte()
+    if tag == T_STR_REF:
+        return reader.strings[reader.varint()]
+    if tag == T_STR:
+        value = reader.raw(reader.varint()).decode('utf-8')
+        reader.strings.append(value)
+        return value
+    if tag == T_INT:
+        return reader.signed()
+    if tag == T_TRUE:
+        return True
+    if tag == T_FALSE:
+        return False
+    if tag == T_NONE:
+        return None
+    if tag == T_DICT:
+        result = {}
+        for _ in range(reader.varint()):
+            key = _read_value(reader)
+            result[key] = _read_value(reader)
+        return result
+    if tag == T_TIMESTAMP:
+        return (EPOCH + reader.signed() * MICROSECOND).isoformat()
+    if tag == T_FLOAT:
+        return DOUBLE.unpack(reader.raw(8))[0]
+    if tag == T_BYTES:
+        return bytes(reader.raw(reader.varint()))
+    if tag in (T_LIST, T_TUPLE):
+        items = [_read_value(reader) for _ in range(reader.varint())]
+        return items if tag == T_LIST else tuple(items)
+    if tag == T_ITEM_SET:
+        return _read_item_set(reader)
+    if tag == T_QUEST_BOARD:
+        return _read_quest_board(reader)
+    raise CodecError(f"unknown value tag {tag}")
+
+
+def _read_item_set(reader):
+    items = {}
+    for _ in range(reader.varint()):
+        template = _read_value(reader)
+        if PLACEHOLDER not in template:
+            items[template] = True
+            continue
+        prefix, *parts = template.split(PLACEHOLDER)
+        for _ in range(reader.varint()):
+            # Everything after the first number is the same for the whole group
+            suffix = parts[0] + ''.join(str(reader.varint()) + part for part in parts[1:])
+            items.update(dict.fromkeys([f"{prefix}{first}{suffix}" for first in _read_number_set(reader)], True))
+    return items
+
+
+def _read_number_set(reader):
+    kind = reader.byte()
+    if kind == SET_BITS:
+        base = reader.varint()
+        bits = reader.raw(reader.varint())
+        return [base + offset + bit for offset, byte in zip(range(0, 8 * len(bits), 8), bits) if byte
+                for bit in BIT_OFFSETS[byte]]
+    if kind == SET_DELTAS:
+        numbers = []
+        number = 0
+        for _ in range(reader.varint()):
+            number += reader.varint()
+            numbers.append(number)
+        return numbers
+    raise CodecError(f"unknown number set kind {kind}")
+
+
+def _read_quest_board(reader):
+    board = {}
+    for _ in range(reader.varint()):
+        name = _read_value(reader)
+        period = _read_value(reader)
+        quests = []
+        for _ in range(reader.varint()):
+            quest_id = _read_value(reader)
+            state, done = QUEST_ENTRY.unpack(reader.raw(QUEST_ENTRY.size))
+            quests.append({'id': quest_id, 'state': state, 'done': bool(done)})
+        board[name] = {'period': period, 'quests': quests}
+    return board
+
+
+def _decode_v1(data):
+    reader = _Reader(data, len(MAGIC) + 1, STATIC_STRINGS[1])
+    state = _read_value(reader)
+    if reader.pos != len(data):
+        raise CodecError('trailing data after progress record')
+    return state
+
+
+def _decode_v0(data):
+    return _json.loads(data)
+
+
+DECODERS = {0: _decode_v0, 1: _decode_v1}
+
+# version -> function turning a state decoded from that version into the next version's shape.
+# Version 0 (tagged JSON) holds the same structure as version 1.
+MIGRATIONS = {0: lambda state: state}
+
+
+def record_version(data):
+    if data[:len(MAGIC)] == MAGIC and len(data) > len(MAGIC):
+        return data[len(MAGIC)]
+    return 0
+
+
+def decode_state(data):
+    """The state dict from a record of any known version, migrated to the current one"""
+    version = record_version(data)
+    decoder = DECODERS.get(version)
+    if decoder is None:
+        raise CodecError(f"unsupported progress record version {version}")
+    try:
+        state = decoder(data)
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise CodecError(f"corrupt progress record: {e}") from e
+    for step in range(version, FORMAT_VERSION):
+        state = MIGRATIONS[step](state)
+    return state
+
+
+class ProgressSerializer:
+    """Session serializer (dumps/loads) that writes binary progress records"""
+
+    def dumps(self, value):
+        return encode_state(value)
+
+    def loads(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return decode_state(data)
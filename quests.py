@@ -0,0 +1,253 @@
+"""Daily and weekly quests.
+
+Quest *types* describe how progress works and are registered once:
+
+* reducers: a map from event type (e.g. "listen_correct") to a function
+  (state, quest) -> new state,
+* is_complete(state, quest) -> bool, and
+* progress(state, quest) -> (progress, goal) for display.
+
+Quests in the catalogs below pick a type and give it a goal and a reward.
+A user's quests live in a plain "board" dict (kept in their session)::
+
+    {"daily": {"period": "2025-05-01", "quests": [{"id": "sharp_ear", "state": 2, "done": false}]},
+     "weekly": {"period": "2025-W18", "quests": [...]}}
+
+Everything here is a function over that dict. Applying an event looks up
+the user's quests that care about it in a precomputed event -> quests map,
+so the cost doesn't depend on how many quests the catalogs hold.
+"""
+import hashlib
+import random
+from functools import lru_cache
+
+QUEST_TYPES = {}
+
+
+class QuestType:
+    __slots__ = ('name', 'reducers', 'initial', 'is_complete', 'progress')
+
+    def __init__(self, name, reducers, initial, is_complete, progress):
+        self.name = name
+        self.reducers = reducers
+        self.initial = initial
+        self.is_complete = is_complete
+        self.progress = progress
+
+
+def _count_progress(state, quest):
+    return min(state, quest['goal_value']), quest['goal_value']
+
+
+def _reached_goal(state, quest):
+    progress, goal = QUEST_TYPES[quest['type']].progress(state, quest)
+    return progress >= goal
+
+
+@lru_cache(maxsize=1024)
+def _dispatch_table(quest_ids):
+    """event type -> positions in quest_ids of the quests listening to it"""
+    table = {}
+    for position, quest_id in enumerate(quest_ids):
+        quest = QUESTS.get(quest_id)
+        if quest is None:
+            continue  # Retired from the catalog since it was assigned
+        for event in QUEST_TYPES[quest['type']].reducers:
+            table.setdefault(event, []).append(position)
+    return table
+
+
+def register_quest_type(name, reducers, initial=0, is_complete=_reached_goal, progress=_count_progress):
+    """Add a quest type; reducers maps each event type it listens to onto a state update"""
+    if name in QUEST_TYPES:
+        raise ValueError(f"Quest type already registered: {name}")
+    QUEST_TYPES[name] = QuestType(name, dict(reducers), initial, is_complete, progress)
+    _dispatch_table.cache_clear()
+
+
+def _increment(state, quest):
+    return state + 1
+
+
+def _reset(state, quest):
+    return 0
+
+
+def _set_flag(bit):
+    def reducer(state, quest):
+        return state | bit
+    return reducer
+
+
+def _flags_progress(state, quest):
+    return bin(state).count('1'), 2
+
+
+register_quest_type('listen_correct_count', {'listen_correct': _increment})
+register_quest_type('sing_correct_count', {'sing_correct': _increment})
+register_quest_type('lesson_interaction_count', {'lesson_interaction': _increment})
+register_quest_type('quiz_correct_count', {'listen_correct': _increment, 'sing_correct': _increment})
+register_quest_type('listen_streak', {'listen_correct': _increment, 'listen_incorrect': _reset})
+# Bit 1: a correct listen answer, bit 2: a successful sing match
+register_quest_type('combined_practice', {'listen_correct': _set_flag(1), 'sing_correct': _set_flag(2)},
+                    progress=_flags_progress)
+
+
+DAILY_QUESTS = [
+    {
+        "quest_id": "sharp_ear",
+        "description": "Get 3 correct answers in 'listen' mode.",
+        "type": "listen_correct_count",
+        "goal_value": 3,
+        "reward_points": 50
+    },
+    {
+        "quest_id": "pitch_tuner",
+        "description": "Get 2 successful matches in 'sing' mode.",
+        "type": "sing_correct_count",
+        "goal_value": 2,
+        "reward_points": 50
+    },
+    {
+        "quest_id": "daily_discovery",
+        "description": "Complete 3 lesson interactions.",
+        "type": "lesson_interaction_count",
+        "goal_value": 3,
+        "reward_points": 30
+    },
+    {
+        "quest_id": "perfect_listener",
+        "description": "Achieve a streak of 4 correct answers in 'listen' mode.",
+        "type": "listen_streak",
+        "goal_value": 4,
+        "reward_points": 75
+    },
+    {
+        "quest_id": "well_rounded_musician",
+        "description": "Get 1 correct 'listen' answer AND 1 successful 'sing' match.",
+        "type": "combined_practice",
+        "goal_value": 2,
+        "reward_points": 60
+    }
+]
+
+WEEKLY_QUESTS = [
+    {
+        "quest_id": "weekly_quiz_regular",
+        "description": "Answer 25 quiz questions correctly this week.",
+        "type": "quiz_correct_count",
+        "goal_value": 25,
+        "reward_points": 200
+    },
+    {
+        "quest_id": "weekly_student",
+        "description": "Complete 15 lesson interactions this week.",
+        "type": "lesson_interaction_count",
+        "goal_value": 15,
+        "reward_points": 120
+    },
+    {
+        "quest_id": "weekly_singer",
+        "description": "Get 10 successful matches in 'sing' mode this week.",
+        "type": "sing_correct_count",
+        "goal_value": 10,
+        "reward_points": 150
+    }
+]
+
+# How many quests of each period a user works on at once
+PERIODS = {
+    'daily': {'catalog': DAILY_QUESTS, 'count': 1},
+    'weekly': {'catalog': WEEKLY_QUESTS, 'count': 1}
+}
+
+QUESTS = {quest['quest_id']: quest for period in PERIODS.values() for quest in period['catalog']}
+
+
+def period_key(period, today):
+    """Identifier of the day or ISO week that today falls in"""
+    if period == 'daily':
+        return today.isoformat()
+    year, week, _ = today.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def selection_rng(user_id, key):
+    """Random generator seeded by the user and period, so every process picks the same quests"""
+    digest = hashlib.blake2b(f"{user_id}:{key}".encode('utf-8'), digest_size=8).digest()
+    return random.Random(int.from_bytes(digest, 'big'))
+
+
+def refresh(board, today, rng=None, user_id=None):
+    """Assign fresh quests for every period that has rolled over. Returns True if anything changed.
+
+    With a user_id (and no rng) the choice is a pure function of the user and period.
+    """
+    changed = False
+    for period, settings in PERIODS.items():
+        key = period_key(period, today)
+        current = board.get(period)
+        if current is not None and current.get('period') == key:
+            continue
+        period_rng = rng or (selection_rng(user_id, key) if user_id is not None else random)
+        chosen = period_rng.sample(settings['catalog'], min(settings['count'], len(settings['catalog'])))
+        board[period] = {
+            'period': key,
+            'quests': [{'id': quest['quest_id'], 'state': QUEST_TYPES[quest['type']].initial, 'done': False}
+                       for quest in chosen]
+        }
+        changed = True
+    return changed
+
+
+def _active_entries(board):
+    entries = []
+    for period in PERIODS:
+        if period in board:
+            entries.extend((period, entry) for entry in board[period]['quests'])
+    return entries
+
+
+def apply_event(board, event):
+    """Advance the user's quests with one event.
+
+    Returns the (period, quest) pairs the event completed, so the caller can
+    hand out their rewards.
+    """
+    entries = _active_entries(board)
+    positions = _dispatch_table(tuple(entry['id'] for _, entry in entries)).get(event)
+    if not positions:
+        return []
+
+    completed = []
+    for position in positions:
+        period, entry = entries[position]
+        if entry['done']:
+            continue
+        quest = QUESTS[entry['id']]
+        quest_type = QUEST_TYPES[quest['type']]
+        entry['state'] = quest_type.reducers[event](entry['state'], quest)
+        if quest_type.is_complete(entry['state'], quest):
+            entry['done'] = True
+            completed.append((board[period]['period'], quest))
+    return completed
+
+
+def quest_status(board):
+    """Display data for every active quest, daily ones first"""
+    status = []
+    for period, entry in _active_entries(board):
+        quest = QUESTS.get(entry['id'])
+        if quest is None:
+            continue
+        progress, goal = QUEST_TYPES[quest['type']].progress(entry['state'], quest)
+        status.append({
+            'quest_id': quest['quest_id'],
+            'period': period,
+            'quest_description': quest['description'],
+            'quest_progress': progress,
+            'quest_goal': goal,
+            'quest_completed': entry['done'],
+            'quest_reward_points': quest['reward_points']
+        })
+    return status
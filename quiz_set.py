@@ -0,0 +1,146 @@
+"""Quizzes generated up front from a seed.
+
+start_quiz builds the whole quiz at once: the mode, the reference note and
+every question's target note. Question pages are rendered from it without
+changing any state, so reloading a page keeps the same question and
+prefetching the next page is safe.
+
+Target notes come from the user's spaced-repetition schedule (the most due
+cards); the seed fixes their order, and the starting order of a brand new
+schedule, so the same seed and schedule always give the same quiz.
+
+Modes:
+
+* listen: name the natural note played after the reference,
+* sing: sing a natural note (graded in cents from the recording),
+* chromatic: name any of the twelve notes in the reference's octave,
+* interval: name the interval from the reference up to the target.
+
+A quiz set packs into a dozen bytes for the session.
+"""
+import random
+import struct
+
+import music_theory
+from scheduler import TARGET_NOTES, IntervalSchedule
+
+QUIZ_LENGTH = 5
+MODES = ['listen', 'sing', 'chromatic', 'interval']
+LISTEN_OPTIONS = ["C", "D", "E", "F", "G", "A", "B"]
+QUIZ_INTERVALS = range(1, 13)  # Minor second up to the octave
+SING_TOLERANCE_CENTS = 50  # Within a quarter tone either way of the target (in any octave)
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BIBBB')  # version, seed, mode, reference note, number of questions
+
+
+def new_seed():
+    return random.getrandbits(32)
+
+
+def initial_schedule(mode, reference_note, seed):
+    """A new user's schedule for a mode: its cards in an order that only depends on the seed"""
+    return IntervalSchedule(size=len(mode_targets(mode, reference_note)), rng=random.Random(seed))
+
+
+def mode_targets(mode, reference_note):
+    """Target notes a mode's questions draw from; schedules have one card per target"""
+    if mode == 'chromatic':
+        octave_start = music_theory.note_to_midi(reference_note) // 12 * 12
+        return [music_theory.midi_to_note(octave_start + pitch_class) for pitch_class in range(12)]
+    if mode == 'interval':
+        return [music_theory.transpose(reference_note, size) for size in QUIZ_INTERVALS]
+    return TARGET_NOTES
+
+
+def mode_options(mode):
+    """(answer options, their labels) for a mode's question page"""
+    if mode == 'chromatic':
+        return music_theory.NOTE_NAMES, music_theory.NOTE_NAMES
+    if mode == 'interval':
+        intervals = [music_theory.INTERVALS_BY_SIZE[size] for size in QUIZ_INTERVALS]
+        return [short for short, _ in intervals], [name for _, name in intervals]
+    if mode == 'listen':
+        return LISTEN_OPTIONS, LISTEN_OPTIONS
+    return [], []
+
+
+class QuizSet:
+    __slots__ = ('seed', 'mode', 'reference_note', 'targets')
+
+    def __init__(self, seed, mode, reference_note, targets):
+        self.seed = seed
+        self.mode = mode
+        self.reference_note = reference_note
+        self.targets = list(targets)  # Indexes into mode_targets(mode, reference_note)
+
+    def __len__(self):
+        return len(self.targets)
+
+    @classmethod
+    def generate(cls, mode, reference_note, schedule=None, seed=None, length=QUIZ_LENGTH):
+        if mode not in MODES:
+            raise ValueError(f"Unknown quiz mode: {mode}")
+        if reference_note not in TARGET_NOTES:
+            raise ValueError(f"Unsupported reference note: {reference_note}")
+        seed = new_seed() if seed is None else seed
+        if schedule is None:
+            schedule = initial_schedule(mode, reference_note, seed)
+        targets = schedule.next_cards(min(length, len(schedule)))
+        random.Random(seed).shuffle(targets)
+        return cls(seed, mode, reference_note, targets)
+
+    def question(self, question_id):
+        """Question data for the 1-based question_id, or None if out of range"""
+        if not 1 <= question_id <= len(self.targets):
+            return None
+        target_note = mode_targets(self.mode, self.reference_note)[self.targets[question_id - 1]]
+        if self.mode == 'interval':
+            semitones, answer = music_theory.interval_between(self.reference_note, target_note)
+        else:
+            answer = music_theory.note_letter(target_note)
+        options, labels = mode_options(self.mode)
+        return {
+            "type": self.mode,
+            "reference_note": self.reference_note,
+            "target_note": target_note,
+            "answer": answer,
+            "options": options,
+            "labels": labels
+        }
+
+    def card(self, question_id):
+        """Schedule card (index into mode_targets) behind the 1-based question_id"""
+        return self.targets[question_id - 1]
+
+    def grade(self, question, answer, f0=None, tolerance_cents=SING_TOLERANCE_CENTS):
+        """(is_correct, cents off the target or None) for an answer to a question.
+
+        A sung answer (f0, in Hz) is graded in cents against the target in
+        whichever octave it was sung. Interval answers are compared by size,
+        and note answers by pitch class, or exactly if they include an octave.
+        """
+        target_note = question['target_note']
+        if f0:
+            cents = float(music_theory.cents_from(f0, target_note, octave_equivalent=True))
+            return abs(cents) <= tolerance_cents, round(cents, 1)
+        if self.mode == 'interval':
+            size = music_theory.interval_size(answer)
+            return size is not None and size == music_theory.interval_size(question['answer']), None
+        if answer and answer[-1].isdigit():
+            return music_theory.MIDI_BY_NAME.get(answer) == music_theory.note_to_midi(target_note), None
+        pitch_class = music_theory.pitch_class(answer)
+        return pitch_class >= 0 and pitch_class == music_theory.pitch_class(target_note), None
+
+    def to_bytes(self):
+        header = HEADER.pack(FORMAT_VERSION, self.seed, MODES.index(self.mode),
+                             TARGET_NOTES.index(self.reference_note), len(self.targets))
+        return header + bytes(self.targets)
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, seed, mode, reference, count = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported quiz set format: {version}")
+        targets = data[HEADER.size:HEADER.size + count]
+        return cls(seed, MODES[mode], TARGET_NOTES[reference], targets)
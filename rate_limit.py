@@ -0,0 +1,93 @@
+"""Per-user and per-address rate limits for the scoring endpoints.
+
+Each limit is a token bucket: `burst` tokens, refilled at `rate` per
+second, one token (or `cost`) per request. A bucket is stored as a single
+float, the time at which it will be full again (the "theoretical arrival
+time" of GCRA), so refilling is lazy: nothing happens between requests,
+and a check is one dict lookup and a little arithmetic under a lock.
+
+A bucket whose full time has passed is the same as no bucket at all, so
+a sweep every SWEEP_SECONDS drops those; the dicts only hold clients
+that were active within the last burst / rate seconds.
+
+Everything is in process memory. With several workers each one has its
+own buckets, which makes the limits per worker; that's accepted so the
+check never waits on the shared store.
+"""
+import threading
+import time
+
+# kind -> scope -> (tokens per second, burst)
+LIMITS = {
+    # Progress events (a batch costs one token per event, so a full offline replay fits in the burst)
+    'progress': {'user': (1.0, 100), 'ip': (5.0, 300)},
+    # Quiz answers
+    'answer': {'user': (1.0, 20), 'ip': (5.0, 100)},
+}
+SWEEP_SECONDS = 60
+
+
+class TokenBuckets:
+    """Token buckets of one size for any number of keys"""
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate
+        self.capacity = burst * self.interval  # How far ahead of now a bucket's full time may be
+        self.full_at = {}
+
+    def charge(self, key, cost, now):
+        """(seconds to wait, new full time) for taking `cost` tokens from key's bucket now"""
+        full_at = max(self.full_at.get(key, now), now) + cost * self.interval
+        return max(0.0, full_at - now - self.capacity), full_at
+
+    def sweep(self, now):
+        full = [key for key, full_at in self.full_at.items() if full_at <= now]
+        for key in full:
+            del self.full_at[key]
+        return len(full)
+
+
+class RateLimiter:
+    def __init__(self, limits=LIMITS, sweep_seconds=SWEEP_SECONDS):
+        self.buckets = {(kind, scope): TokenBuckets(rate, burst)
+                        for kind, scopes in limits.items() for scope, (rate, burst) in scopes.items()}
+        self.sweep_seconds = sweep_seconds
+        self._next_sweep = time.monotonic() + sweep_seconds
+        self._lock = threading.Lock()
+
+    def check(self, kind, cost=1, now=None, **keys):
+        """Seconds to wait before retrying, or 0 if the request may go ahead.
+
+        keys maps each scope to this request's key, e.g. user=..., ip=...
+        (None skips a scope). Tokens are only taken when every bucket has
+        enough, so a rejected request doesn't use up the others.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            wait = 0.0
+            charges = []
+            for scope, key in keys.items():
+                if key is None:
+                    continue
+                buckets = self.buckets[kind, scope]
+                delay, full_at = buckets.charge(key, cost, now)
+                wait = max(wait, delay)
+                charges.append((buckets, key, full_at))
+            if not wait:
+                for buckets, key, full_at in charges:
+                    buckets.full_at[key] = full_at
+            if now >= self._next_sweep:
+                self._next_sweep = now + self.sweep_seconds
+                for buckets in self.buckets.values():
+                    buckets.sweep(now)
+        return wait
+
+    def __len__(self):
+        return sum(len(buckets.full_at) for buckets in self.buckets.values())
+
+
+def init_app(app):
+    """The limiter, or None when RATE_LIMIT is off"""
+    limiter = RateLimiter(app.config.get('RATE_LIMITS') or LIMITS) if app.config.get('RATE_LIMIT', True) else None
+    app.extensions['rate_limiter'] = limiter
+    return limiter
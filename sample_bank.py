@@ -0,0 +1,138 @@
+"""Locally rendered note samples for the quiz and lesson pages.
+
+The pages used to build a Tone.Sampler that fetched piano MP3s from a third
+party host on the first click. Instead, every note the app plays is rendered
+here once with NumPy (a simple additive piano-like tone) and written to disk
+as 16-bit mono WAV:
+
+* one file per note, and
+* one "pack" with every note back to back, so a page needs a single request
+  for all its audio. The manifest gives each note's offset in the pack.
+
+File names carry a hash of their content, so they can be served with
+long-lived immutable cache headers. Rendering only happens when the files
+for the current synth settings aren't on disk yet.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from music_theory import NOTE_NAMES, note_to_midi, note_frequency
+from pitch_detection import encode_wav
+from quiz_set import MODES, mode_targets
+from scheduler import TARGET_NOTES
+
+
+def bank_notes():
+    """The lesson keyboard's octave (C4-C5) plus every reference and target any quiz mode can ask for"""
+    notes = {f"{name}4" for name in NOTE_NAMES} | {"C5"} | set(TARGET_NOTES)
+    for mode in MODES:
+        for reference_note in TARGET_NOTES:
+            notes.update(mode_targets(mode, reference_note))
+    return sorted(notes, key=note_to_midi)
+
+
+# Everything the lesson keyboard, the lesson examples and the quiz can play,
+# so the browser never has to pitch-shift a neighbouring sample
+BANK_NOTES = bank_notes()
+
+SAMPLE_RATE = 16000  # Partials above Nyquist (the top harmonics of the highest notes) are left out
+NOTE_SECONDS = 1.5
+HARMONICS = 8
+
+# Bump when the synthesis changes so cached files are re-rendered
+SYNTH_VERSION = 1
+
+def note_slug(note):
+    """File-name friendly note name: "C#4" -> "Cs4" """
+    return note.replace('#', 's')
+
+
+def render_note(frequency, sample_rate=SAMPLE_RATE, seconds=NOTE_SECONDS):
+    """Render one plucked, piano-like note as float32 samples in [-1, 1]"""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    harmonics = np.arange(1, HARMONICS + 1)[:, None]
+    # Slightly stretched partials, quieter and faster-decaying as they go up
+    partials = frequency * harmonics * np.sqrt(1 + 0.0004 * harmonics ** 2)
+    partials = np.where(partials < sample_rate / 2, partials, 0)
+    amplitudes = 1 / harmonics ** 1.5
+    decay = np.exp(-t * (1.5 + 0.8 * harmonics))
+    tone = (amplitudes * decay * np.sin(2 * np.pi * partials * t)).sum(axis=0)
+
+    # 5 ms attack and a 50 ms fade at the end so slots don't click
+    envelope = np.minimum(1, t / 0.005)
+    envelope *= np.minimum(1, (seconds - t) / 0.05)
+    tone *= envelope
+    return (tone / np.max(np.abs(tone)) * 0.8).astype(np.float32)
+
+
+def content_name(prefix, data):
+    return f"{prefix}-{hashlib.sha256(data).hexdigest()[:16]}.wav"
+
+
+class SampleBank:
+    def __init__(self, directory, notes=BANK_NOTES):
+        self.directory = directory
+        self.notes = list(notes)
+        self.manifest = None
+
+    @property
+    def settings_key(self):
+        settings = json.dumps([SYNTH_VERSION, SAMPLE_RATE, NOTE_SECONDS, HARMONICS, self.notes])
+        return hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]
+
+    def load(self):
+        """Load the manifest for the current settings, rendering the audio if needed"""
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, f"bank-{self.settings_key}.json")
+        try:
+            with open(index_path) as f:
+                manifest = json.load(f)
+            files = [manifest['pack']] + list(manifest['files'].values())
+            if all(os.path.exists(os.path.join(self.directory, name)) for name in files):
+                self.manifest = manifest
+                return manifest
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        manifest = self.render()
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, index_path)
+        self.manifest = manifest
+        return manifest
+
+    def render(self):
+        """Render every note, write the files and return the manifest"""
+        rendered = [render_note(note_frequency(note)) for note in self.notes]
+
+        files = {}
+        for note, samples in zip(self.notes, rendered):
+            data = encode_wav(samples, SAMPLE_RATE)
+            files[note] = self._write(content_name(note_slug(note), data), data)
+
+        # Every note gets a slot of the same length in the pack
+        pack_data = encode_wav(np.concatenate(rendered), SAMPLE_RATE)
+        pack = self._write(content_name('notes', pack_data), pack_data)
+
+        return {
+            'pack': pack,
+            'sample_rate': SAMPLE_RATE,
+            'offsets': {note: [round(i * NOTE_SECONDS, 6), NOTE_SECONDS] for i, note in enumerate(self.notes)},
+            'files': files
+        }
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return name
+
+    def is_bank_file(self, name):
+        return self.manifest is not None and (name == self.manifest['pack'] or name in self.manifest['files'].values())
@@ -0,0 +1,184 @@
+"""Spaced-repetition scheduling of quiz questions.
+
+A quiz question is "hear (or sing) this target note after the reference".
+For each mode and reference note a user gets an IntervalSchedule with one
+card per target note. Each card has an SM-2 style state: ease factor,
+current interval, repetition and lapse counts, and the time it is next due.
+
+The cards sit in a binary min-heap ordered by (due time, ease), so the next
+question is the most overdue card, with harder cards first on ties.
+Reviewing a card moves it in place in O(log n).
+
+All state lives in a handful of typed arrays (the heap itself is an array
+of card indexes), and the whole schedule serializes to about 100 bytes::
+
+    schedule = IntervalSchedule.from_bytes(blob)  # or IntervalSchedule() for a new user
+    note = TARGET_NOTES[schedule.peek()]
+    schedule.review(index, quality_from_answer(is_correct, response_ms))
+    blob = schedule.to_bytes()
+"""
+import heapq
+import random
+import struct
+import sys
+import time
+from array import array
+
+TARGET_NOTES = ["C4", "D4", "E4", "F4", "G4", "A4", "B4"]
+
+# SM-2 parameters; intervals are in minutes so a card can come back within one practice session
+INITIAL_EASE = 2500  # Ease factor x 1000
+MIN_EASE = 1300
+MAX_EASE = 5000  # SM-2 has no upper bound; this keeps it in 16 bits
+RELEARN_MINUTES = 1
+FIRST_INTERVALS = [10, 24 * 60]  # After the 1st and 2nd successful reviews
+MAX_INTERVAL = 180 * 24 * 60
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BB')  # version, number of cards
+
+
+def now_minutes():
+    return int(time.time() // 60)
+
+
+def quality_from_answer(is_correct, response_ms=None):
+    """SM-2 quality (0-5) for an answer: wrong is a lapse, quick and right is best"""
+    if not is_correct:
+        return 1
+    if response_ms is None:
+        return 4
+    if response_ms < 3000:
+        return 5
+    if response_ms < 8000:
+        return 4
+    return 3
+
+
+class IntervalSchedule:
+    def __init__(self, size=len(TARGET_NOTES), rng=random):
+        self.due = array('I', [0] * size)  # Minutes since the epoch
+        self.interval = array('I', [0] * size)
+        self.ease = array('H', [INITIAL_EASE] * size)
+        self.reps = array('B', [0] * size)
+        self.lapses = array('B', [0] * size)
+
+        # New cards are all due "at the dawn of time", in a random order
+        order = list(range(size))
+        rng.shuffle(order)
+        for rank, card in enumerate(order):
+            self.due[card] = rank
+        self.heap = array('B', order)  # Already a valid heap: dues increase along it
+        self.position = array('B', [0] * size)
+        for slot, card in enumerate(self.heap):
+            self.position[card] = slot
+
+    def __len__(self):
+        return len(self.heap)
+
+    # Heap helpers
+
+    def _key(self, card):
+        return self.due[card], self.ease[card], card
+
+    def _swap(self, a, b):
+        heap = self.heap
+        heap[a], heap[b] = heap[b], heap[a]
+        self.position[heap[a]] = a
+        self.position[heap[b]] = b
+
+    def _sift_up(self, slot):
+        while slot > 0:
+            parent = (slot - 1) // 2
+            if self._key(self.heap[slot]) >= self._key(self.heap[parent]):
+                break
+            self._swap(slot, parent)
+            slot = parent
+
+    def _sift_down(self, slot):
+        size = len(self.heap)
+        while True:
+            smallest = slot
+            for child in (2 * slot + 1, 2 * slot + 2):
+                if child < size and self._key(self.heap[child]) < self._key(self.heap[smallest]):
+                    smallest = child
+            if smallest == slot:
+                return
+            self._swap(slot, smallest)
+            slot = smallest
+
+    # Scheduling
+
+    def peek(self):
+        """Index of the card that should be asked next"""
+        return self.heap[0]
+
+    def next_cards(self, count):
+        """The `count` most urgent cards, most urgent first, without changing the schedule"""
+        result = []
+        frontier = [(self._key(self.heap[0]), 0)]
+        while frontier and len(result) < count:
+            _, slot = heapq.heappop(frontier)
+            result.append(self.heap[slot])
+            for child in (2 * slot + 1, 2 * slot + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self._key(self.heap[child]), child))
+        return result
+
+    def review(self, card, quality, now=None):
+        """Record an answer of the given SM-2 quality (0-5) and reschedule the card"""
+        now = now_minutes() if now is None else now
+        if quality < 3:
+            self.reps[card] = 0
+            self.lapses[card] = min(self.lapses[card] + 1, 255)
+            interval = RELEARN_MINUTES
+        else:
+            reps = self.reps[card]
+            if reps < len(FIRST_INTERVALS):
+                interval = FIRST_INTERVALS[reps]
+            else:
+                interval = self.interval[card] * self.ease[card] // 1000
+            self.reps[card] = min(reps + 1, 255)
+
+        # EF' = EF + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02)), scaled by 1000
+        miss = 5 - quality
+        self.ease[card] = min(MAX_EASE, max(MIN_EASE, self.ease[card] + 100 - miss * (80 + miss * 20)))
+        self.interval[card] = min(interval, MAX_INTERVAL)
+        self.due[card] = now + self.interval[card]
+
+        # Only this card's key changed, so one sift restores the heap
+        slot = self.position[card]
+        self._sift_up(slot)
+        self._sift_down(self.position[card])
+
+    # Serialization
+
+    def to_bytes(self):
+        parts = [HEADER.pack(FORMAT_VERSION, len(self.heap))]
+        for values in (self.due, self.interval, self.ease, self.reps, self.lapses, self.heap):
+            if sys.byteorder == 'big' and values.itemsize > 1:
+                values = array(values.typecode, values)
+                values.byteswap()
+            parts.append(values.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, size = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported schedule format: {version}")
+        schedule = cls.__new__(cls)
+        offset = HEADER.size
+        for name, typecode in (('due', 'I'), ('interval', 'I'), ('ease', 'H'), ('reps', 'B'),
+                               ('lapses', 'B'), ('heap', 'B')):
+            values = array(typecode)
+            length = size * values.itemsize
+            values.frombytes(data[offset:offset + length])
+            if sys.byteorder == 'big' and values.itemsize > 1:
+                values.byteswap()
+            setattr(schedule, name, values)
+            offset += length
+        schedule.position = array('B', [0] * size)
+        for slot, card in enumerate(schedule.heap):
+            schedule.position[card] = slot
+        return schedule
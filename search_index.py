@@ -0,0 +1,260 @@
+"""Inverted index over lesson text for the /search route.
+
+The index is built from the content store's lessons on the first search
+(LessonSearch), not at startup. Lesson HTML is reduced to
+its visible text before tokenizing, so tag names and class attributes
+("span", "bold", ...) no longer match every lesson. Query terms match by
+prefix, results are ranked with BM25 (title hits count extra) and come back
+with a highlighted snippet.
+
+When the content is reloaded only the lessons that changed are re-indexed,
+so the cost of keeping the index fresh doesn't grow with the catalog.
+"""
+import bisect
+import hashlib
+import math
+import re
+import threading
+from html.parser import HTMLParser
+
+from markupsafe import Markup, escape
+
+TOKEN_PATTERN = re.compile(r"[\w#♭]+")
+
+# Tags that end a block of text, so words on either side don't run together
+BLOCK_TAGS = {'p', 'div', 'li', 'ul', 'ol', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'button', 'td', 'tr'}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 3.0
+PREFIX_WEIGHT = 0.6  # A prefix hit ("oct" -> "octave") counts less than an exact one
+
+SNIPPET_CHARS = 160
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Return the visible text of an HTML fragment with whitespace collapsed"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return ' '.join(''.join(parser.parts).split())
+
+
+def tokenize(text):
+    """Yield (term, start, end) for every token in text"""
+    for match in TOKEN_PATTERN.finditer(text):
+        yield match.group().lower(), match.start(), match.end()
+
+
+class _Document:
+    __slots__ = ('title', 'text', 'spans', 'length', 'title_terms', 'fingerprint')
+
+    def __init__(self, title, text, fingerprint):
+        self.title = title
+        self.text = text
+        self.spans = list(tokenize(text))
+        self.length = len(self.spans)
+        self.title_terms = {term for term, _, _ in tokenize(title)}
+        self.fingerprint = fingerprint
+
+
+class SearchIndex:
+    def __init__(self):
+        self._docs = {}
+        self._postings = {}  # term -> {doc_id: term frequency}
+        self._terms = []  # Sorted vocabulary for prefix lookups
+        self._terms_dirty = False
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def sync(self, lessons):
+        """Bring the index in line with a lessons dict, re-indexing only what changed"""
+        with self._lock:
+            for doc_id in set(self._docs) - set(lessons):
+                self.remove(doc_id)
+            for doc_id, lesson_data in lessons.items():
+                self.update(doc_id, lesson_data)
+
+    def update(self, doc_id, lesson_data):
+        """Index a lesson, or re-index it if its title or content changed"""
+        title = lesson_data['title']
+        content = lesson_data['content']
+        fingerprint = hashlib.blake2b(f"{title}\0{content}".encode('utf-8'), digest_size=16).digest()
+        with self._lock:
+            existing = self._docs.get(doc_id)
+            if existing is not None and existing.fingerprint == fingerprint:
+                return False
+            if existing is not None:
+                self.remove(doc_id)
+
+            doc = _Document(title, html_to_text(content), fingerprint)
+            self._docs[doc_id] = doc
+            self._total_length += doc.length
+            counts = {}
+            for term, _, _ in doc.spans:
+                counts[term] = counts.get(term, 0) + 1
+            for term in doc.title_terms:
+                counts.setdefault(term, 0)
+            for term, count in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._terms_dirty = True
+                postings[doc_id] = count
+            return True
+
+    def remove(self, doc_id):
+        with self._lock:
+            doc = self._docs.pop(doc_id, None)
+            if doc is None:
+                return
+            self._total_length -= doc.length
+            terms = {term for term, _, _ in doc.spans} | doc.title_terms
+            for term in terms:
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+                    self._terms_dirty = True
+
+    def _expand(self, query_term):
+        """Return [(term, weight)] for vocabulary terms starting with query_term"""
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect.bisect_left(self._terms, query_term)
+        matches = []
+        for term in self._terms[start:]:
+            if not term.startswith(query_term):
+                break
+            matches.append((term, 1.0 if term == query_term else PREFIX_WEIGHT))
+        return matches
+
+    def search(self, query, limit=20):
+        """Return ranked results for query: [{'id', 'title', 'snippet', 'score'}]"""
+        query_terms = list(dict.fromkeys(term for term, _, _ in tokenize(query)))
+        if not query_terms:
+            return []
+
+        with self._lock:
+            doc_count = len(self._docs)
+            avg_length = (self._total_length / doc_count) if doc_count else 0
+            scores = None
+            matched_terms = {}
+            for query_term in query_terms:
+                term_scores = {}
+                for term, weight in self._expand(query_term):
+                    postings = self._postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for doc_id, tf in postings.items():
+                        doc = self._docs[doc_id]
+                        norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * doc.length / (avg_length or 1)))
+                        if term in doc.title_terms:
+                            norm += TITLE_WEIGHT
+                        term_scores[doc_id] = term_scores.get(doc_id, 0.0) + weight * idf * norm
+                        matched_terms.setdefault(doc_id, set()).add(term)
+                # Every query term has to match (AND semantics)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {doc_id: score + term_scores[doc_id]
+                              for doc_id, score in scores.items() if doc_id in term_scores}
+                if not scores:
+                    return []
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [{
+                'id': doc_id,
+                'title': self._docs[doc_id].title,
+                'snippet': self._snippet(self._docs[doc_id], matched_terms[doc_id]),
+                'score': round(score, 4)
+            } for doc_id, score in ranked]
+
+    def _snippet(self, doc, terms):
+        """Escape a window of text around the first hit and wrap hits in <mark>"""
+        hits = [(start, end) for term, start, end in doc.spans if term in terms]
+        if not hits:
+            return Markup(escape(doc.text[:SNIPPET_CHARS]))
+
+        first_start = hits[0][0]
+        window_start = max(0, first_start - SNIPPET_CHARS // 4)
+        if window_start:
+            # Don't cut a word in half
+            space = doc.text.find(' ', window_start)
+            window_start = space + 1 if 0 <= space < first_start else window_start
+        window_end = min(len(doc.text), window_start + SNIPPET_CHARS)
+
+        parts = ['…' if window_start else '']
+        position = window_start
+        for start, end in hits:
+            if start < window_start:
+                continue
+            if end > window_end:
+                break
+            parts.append(escape(doc.text[position:start]))
+            parts.append(Markup('<mark>%s</mark>') % doc.text[start:end])
+            position = end
+        parts.append(escape(doc.text[position:window_end]))
+        if window_end < len(doc.text):
+            parts.append('…')
+        return Markup('').join(parts)
+
+
+class LessonSearch:
+    """SearchIndex over a content store's lessons.
+
+    Built on the first search, then kept up to date with the lessons that
+    change when the content is reloaded.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self._index = SearchIndex()
+        self._ready = False
+        self._lock = threading.Lock()
+        content.on_reload(self.reindex)
+
+    def index(self):
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self._index.sync(dict(self.content.items()))
+                    self._ready = True
+        return self._index
+
+    def reindex(self, changed, removed):
+        if not self._ready:
+            return
+        for lesson_id in removed:
+            self._index.remove(lesson_id)
+        for lesson_id in changed:
+            lesson_data = self.content.get(lesson_id)
+            if lesson_data is not None:
+                self._index.update(lesson_id, lesson_data)
@@ -1,200 +1,200 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+from flask import (Blueprint, Flask, Response, current_app, g, render_template, jsonify, request, session,
+                   redirect, url_for, abort, send_from_directory)
+from flask_sock import ConnectionClosed, Sock
+from werkzeug.local import LocalProxy
 import os
+import re
+from contextlib import contextmanager
 from datetime import datetime, date
 import json
-import random
-
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-here'  # Required for session
-
-# Available daily quests
-AVAILABLE_DAILY_QUESTS = [
-    {
-        "quest_id": "sharp_ear",
-        "description": "Get 3 correct answers in 'listen' mode.",
-        "type": "listen_correct_count",
-        "goal_value": 3,
-        "reward_points": 50
-    },
-    {
-        "quest_id": "pitch_tuner",
-        "description": "Get 2 successful matches in 'sing' mode.",
-        "type": "sing_correct_count",
-        "goal_value": 2,
-        "reward_points": 50
-    },
-    {
-        "quest_id": "daily_discovery",
-        "description": "Complete 3 lesson interactions.",
-        "type": "lesson_interaction_count",
-        "goal_value": 3,
-        "reward_points": 30
-    },
-    {
-        "quest_id": "perfect_listener",
-        "description": "Achieve a streak of 4 correct answers in 'listen' mode.",
-        "type": "listen_streak",
-        "goal_value": 4,
-        "reward_points": 75
-    },
-    {
-        "quest_id": "well_rounded_musician",
-        "description": "Get 1 correct 'listen' answer AND 1 successful 'sing' match.",
-        "type": "combined_practice",
-        "goal_value": 2,  # Not directly used, but good for consistency
-        "reward_points": 60
-    }
-]
-
-# Lesson content (this would typically come from a database)
-LESSONS = {
-    1: {
-        "title": "Introduction to Relative Pitch",
-        "content": """
-        <h2>What is Relative Pitch?</h2>
-        <p>This app will help you to learn relative pitch or develop it further if you have some background.</p>
-        <p>Relative pitch refers to the ability to <span class='bold'>identify or reproduce the pitch</span> of a note <span class='bold'>in relation to another note.</span></p>
-        <p>You will be given a <span class='bold'>reference note</span>, and then keeping the pitch of this reference note in mind, will either identify a second note by hearing it or will reproduce it by using your mic.</p>""",
-        "keyboard": False
-    },
-    2: {
-        "title": "Introduction to Notes",
-        "content": """
-        <h2>Diatonic Scale</h2>
-        <p>In music theory, the <span class='bold'>diatonic scale</span> consists of 7 notes (in one octave): <span class='bold'>C, D, E, F, G, A, B.</span> These are the white keys shown on the piano.</p>
-        <p>For simplicity, let's just focus on the <span class='bold'>C major scale</span>, which consists of the notes in the order: C, D, E, F, G, A, B, C. Click on the<span class='bold'> Play Scale button</span> to hear each note.</p>
-        <button id="playScale" class="btn">Play Scale</button>""",
-        "keyboard": True
-    },
-    3: {
-        "title": "What is an Octave?",
-        "content": """
-        <h2>What is an Octave?</h2>
-        <p>An <span class='bold'>octave</span> is the distance from one note to another that has double its frequency. In other words, the two notes sound the same but one is simply higher/lower in pitch than the other.</p>
-        <p>Examples: C to C, E to E, A to A, etc.</p>
-        <p>Click on the <span class='bold'>Play Octave button</span> to hear an example of an octave, C to C.</p>
-        <button id="playOctave" class="btn">Play Octave</button>""",
-        "keyboard": True
-    },
-    4: {
-        "title": "What is a Chromatic Scale?",
-        "content": """
-        <h2>Chromatic Scale</h2>
-        <p>The black keys combine with the white keys to form the <span class='bold'>chromatic scale</span>, which consists of 12 notes:</p>
-        <p>C, C# or D♭, D, D# or E♭, E, F, F# or G♭, G, G# or A♭, A, A# or B♭, B</p>
-        <p>Notice how some of these notes have 2 different names (such as C# and D♭). These notes are called <span class='bold'>enharmonic equivalents</span>.</p>
-        <p><span class='bold'>Enharmonic equivalents</span> are two notes that sound the same but have different spellings.
-        <p>Click on the <span class='bold'>Play Chromatic Scale button</span> to hear each note.</p>
-        <button id="playChromaticScale" class="btn">Play Chromatic Scale</button>""",
-        "keyboard": True
-    },
-    5: {
-        "title": "Understanding Steps in Music",
-        "content": """
-        <h2>Half Steps</h2>
-        <p>A <span class='bold'>half step</span> is the distance between two adjacent keys on a keyboard.</p>
-        <ul>
-            <li>Notes can either be <span class='bold'>sharp (#)</span> meaning the note is raised one half step, or <span class='bold'>flat (♭)</span> meaning the note is lowered one half step.</li>
-            <li>Sharp (#) example: If you started on D and you wanted D#, you would move up one half step.</li>
-            <li>Flat (♭) example: If you started on A and you wanted A♭, you would move down one half step.</li>
-        </ul>
-        <p>Examples of half steps:</p>
-        <div class="halfstep-examples">
-            <div class="halfstep-item">C to C#<button id="playHalfStep1" class="btn">Play Example</button></div>
-            <div class="halfstep-item">E to F<button id="playHalfStep2" class="btn">Play Example</button></div>
-            <div class="halfstep-item">A# to A<button id="playHalfStep3" class="btn">Play Example</button></div>
-        </div>
-        """,
-        "keyboard": True
-    },
-    6: {
-        "title": "Understanding Whole Steps",
-        "content": """
-        <h2>Whole Steps</h2>
-        <p>A <span class='bold'>whole step</span> is made of two half steps.</p>
-        <p>Examples of whole steps:</p>
-        <div class="halfstep-examples">
-            <div class="halfstep-item">C to D<button id="playWholeStep1" class="btn">Play Example</button></div>
-            <div class="halfstep-item">A to G<button id="playWholeStep2" class="btn">Play Example</button></div>
-            <div class="halfstep-item">F# to E<button id="playWholeStep3" class="btn">Play Example</button></div>
-        </div>
-        """,
-        "keyboard": True
-    },
-    7: {
-        "title": "Identifying Higher Notes",
-        "content": """
-        <p>If you are <span class='bold'>hearing</span> the target note, try to determine if it is <span class='bold'>higher or lower</span> in pitch relative to the reference pitch.</p>
-        <p>If it is higher, try to <span class='bold'>identify</span> the notes that are higher than your reference note (before you reach the octave). For now, just focus on the white keys.</p>
-        <p>Example: say the reference note is E and the target note (A) sounded higher. What notes would you focus on? <span class='bold'>F, G, A, B, C, and D</span>.</p>
-        <p>Try <span class='bold'>singing/humming</span> the reference note by playing the audio and tuning yourself, and then sing/hum each of the notes in the subset above until you think the note matches the target note.</p>
-        """,
-        "keyboard": True
-    },
-    8: {
-        "title": "Identifying Lower Notes",
-        "content": """
-        <p>If it is lower, try the same approach: <span class='bold'>identify</span> the notes that are lower than your reference note (before you reach the octave).</p>
-        <p>Example: say the reference note is G and the target note (C) sounds lower. What notes would you focus on? <span class='bold'>F, E, D, C, B, and A</span>.</p>
-        <p>Using the same method, try <span class='bold'>singing/humming</span> the reference note by playing the audio and tuning yourself, and then sing/hum each of the notes in the subset above until you think the note matches the target note.</p>
-        """,
-        "keyboard": True
-    },
-    9: {
-        "title": "Practicing Singing/Humming",
-        "content": """      
-        <p>After hearing the reference note, try to establish the connection between the <span class='bold'>pitch</span> and the <span class='bold'>note name</span> of the reference note. </p>
-        <p>You could try playing the note on the piano and <span class='bold'>singing/humming</span> along to the note to reinforce the pitch. It will be important to keep this in mind for the future.</p>
-        <p>For exercise, try first playing <span class='bold'>any of the white keys</span>, keeping in mind the note name, and sing/hum along with the piano until you match in pitch.</p>
-        <p>After some time, see if you can recreate the same pitch <span class='bold'>without</span> using the piano for reference.</p>
-        <h3>Exercise: Target note G</h3>
-        <div class="target-note mb-4">
-            <button id="startTuner" class="btn btn-primary">Start Recording</button>
-            <div id="tunerDisplay" class="mt-3">
-                <div id="pitch"></div>
-                <div id="note"></div>
-                <canvas id="tunerCanvas"></canvas>
-                <button id="helpButton" class="btn btn-info mt-3" disabled>Show hint</button>
-            </div>
-        </div>
-        """,
-        "keyboard": True
-    },
-    10: {
-        "title": "More Tips on Recreating Notes",
-        "content": """
-        <p>If you are recreating the target note, it is <span class='bold'>up to you</span> whether you want to go higher or lower.</p>
-        <p><span class='bold'>Strategy:</span> starting from the reference note, try singing/humming in the direction of the target note (either going higher or lower) until you think you have <span class='bold'>matched the pitch</span> of the target note. Use the piano for guidance when first starting.</p>
-        <p>Another strategy is to figure out the <span class='bold'>number of whole/half steps</span> between your reference note and target note, and adjust your pitch accordingly starting from the reference note.</p>
-
-        <div class="target-note mb-4">
-            <button id="startTuner" class="btn btn-primary">Start Recording</button>
-            <div id="tunerDisplay" class="mt-3">
-                <div id="pitch"></div>
-                <div id="note"></div>
-                <canvas id="tunerCanvas"></canvas>
-                <button id="helpButton" class="btn btn-info mt-3 hidden" disabled>Show hint</button>
-            </div>
-        </div>
-        <div class="quiz-ask">
-            <h3>Ready to take the quiz?</h3>
-            <a href="/quiz/mode" class="btn quiz-btn">Take Quiz</a>
-            <a href="/lesson/1" class="btn review-btn">Review Lessons</a>
-        </div>
-        """,
-        "keyboard": True
-    }
-}
+import logging
+import uuid
+
+import analytics
+import assets
+import clip_store
+import compute_pool
+import config
+import content_store
+import event_log
+import leaderboard
+import metrics
+import music_theory
+import offline
+import rate_limit
+import session_store
+import shared_state
+import structured_log
+from page_cache import PageCache, page_response
+import quests
+from pitch_detection import AudioDecodeError, MAX_CLIPS, analyze_clips, check_clip, decode_clip, decode_wav, encode_wav
+from pitch_stream import PitchStreamHub, StreamError
+from sample_bank import SampleBank
+from quiz_set import MODES as QUIZ_MODES, QuizSet, initial_schedule, new_seed
+from scheduler import TARGET_NOTES, IntervalSchedule, quality_from_answer
+from search_index import LessonSearch
+
+# Reported with every app's startup steps: what a cold process pays before create_app()
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+# Every route lives on this blueprint; create_app() registers it on the app it builds
+main = Blueprint('main', __name__)
+sock = Sock()
+log = logging.getLogger('relapitch')
+
+
+def create_app(profile=None, **overrides):
+    """Build the app for a config profile (see config.py); keyword arguments override config keys.
+
+    How long each step took is kept in app.extensions['startup'] and
+    exported on /metrics as relapitch_startup_seconds.
+    """
+    started = time.perf_counter()
+    steps = {}
+
+    @contextmanager
+    def step(name):
+        start = time.perf_counter()
+        yield
+        steps[name] = time.perf_counter() - start
+
+    profile = config.get_profile(profile)
+    app = Flask(__name__)
+    app.config.from_object(profile)
+    app.config.update(overrides)
+    if not app.config.get('SECRET_KEY'):
+        raise RuntimeError('Set RELAPITCH_SECRET_KEY (the production profile has no default)')
+    if app.config.get('WORKERS', 1) > 1 and app.config.get('SESSION_STORE') == 'memory':
+        raise RuntimeError('RELAPITCH_SESSION_STORE=memory keeps sessions in one process; '
+                           'use sqlite or file with more than one worker')
+    if app.config.get('WORKERS', 1) > 1 and app.config.get('SHARED_STATE', 'off') == 'off':
+        raise RuntimeError('RELAPITCH_SHARED_STATE=off keeps scores in one process; '
+                           'use sqlite with more than one worker')
+
+    with step('session_store'):
+        session_store.init_app(app)
+    with step('event_log'):
+        events = event_log.init_app(app)
+        analytics.init_app(app)
+        app.extensions['answer_stats'] = analytics.LiveAnswerAnalytics(events.directory)
+    with step('shared_state'):
+        shared_state.init_app(app)
+    with step('leaderboards'):
+        leaderboard.init_app(app)
+    # Note/frequency/interval tables, written to static/data before the assets are bundled
+    with step('music_theory'):
+        music_theory.init_app(app)
+    with step('assets'):
+        assets.init_app(app)
+    with step('compute_pool'):
+        compute_pool.init_app(app)
+    with step('clip_store'):
+        clip_store.init_app(app)
+    with step('metrics'):
+        app_metrics = metrics.init_app(app)
+        structured_log.init_app(app)
+    with step('content'):
+        content = content_store.init_app(app)
+        # Rendered lesson pages, keyed by lesson id and content version
+        app.extensions['lesson_pages'] = PageCache()
+        app.extensions['lesson_search'] = LessonSearch(content)
+    # Token buckets for the scoring endpoints
+    rate_limit.init_app(app)
+    # Shared batch pitch detector for all streaming connections
+    app.extensions['pitch_hub'] = PitchStreamHub()
+    # Note samples rendered once and cached on disk, served as a single pack
+    with step('sample_bank'):
+        bank = SampleBank(os.path.join(app.instance_path, 'audio'))
+        bank.load()
+        app.extensions['sample_bank'] = bank
+    # Offline mode: the service worker precaches lessons, static files and the note samples
+    precache = offline.PrecacheManifest(content, app.extensions['assets'], bank)
+    app.extensions['precache'] = precache
+
+    app.register_blueprint(main)
+    sock.init_app(app)
+    app.jinja_env.globals['note_bank'] = note_bank
+    app.jinja_env.globals['offline_version'] = lambda: precache.version
+
+    if app.config.get('PRECOMPILE_TEMPLATES', True):
+        with step('templates'):
+            precompile_templates(app)
+
+    steps['total'] = time.perf_counter() - started
+    steps['imports'] = IMPORT_SECONDS
+    app.extensions['startup'] = steps
+    for name, seconds in steps.items():
+        app_metrics.set('relapitch_startup_seconds', seconds, step=name)
+    log.info('app created', extra={'profile': profile.__name__,
+                                   'startup_ms': {name: round(seconds * 1000, 1) for name, seconds in steps.items()}})
+    return app
+
+
+def precompile_templates(app):
+    """Compile every template into the Jinja cache now, so no request pays for it"""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+# The current app's components, by the names the views use
+def _extension(name):
+    return LocalProxy(lambda: current_app.extensions[name])
+
 
+events = _extension('event_log')
+leaderboards = _extension('leaderboards')
+content = _extension('content')
+compute = _extension('compute_pool')
+app_metrics = _extension('metrics')
+lesson_pages = _extension('lesson_pages')
+pitch_hub = _extension('pitch_hub')
+sample_bank = _extension('sample_bank')
+precache = _extension('precache')
+recordings = _extension('clip_store')
 
-# Generate random target note for listen mode
-def generate_random_target_note():
-    notes = ["C", "D", "E", "F", "G", "A", "B"]
-    random_note = random.choice(notes)
-    return f"{random_note}4"  # Always use octave 4
+
+def get_search_index():
+    return current_app.extensions['lesson_search'].index()
+
+
+def note_bank():
+    """Sample pack manifest with URLs, for the pages that play notes"""
+    urls = current_app.extensions.get('note_bank_urls')
+    if urls is None:
+        manifest = sample_bank.manifest
+        urls = current_app.extensions['note_bank_urls'] = {
+            'pack': url_for('main.note_audio', filename=manifest['pack']),
+            'offsets': manifest['offsets'],
+            'files': {note: url_for('main.note_audio', filename=name) for note, name in manifest['files'].items()}
+        }
+    return urls
+
+# Each user has a spaced-repetition schedule of target notes per quiz mode and reference note
+def load_schedule(mode, reference_note, seed):
+    """The user's schedule, or a new one ordered by the quiz seed so the same seed gives the same quiz"""
+    blob = session.get('schedules', {}).get(f"{mode}:{reference_note}")
+    return IntervalSchedule.from_bytes(blob) if blob else initial_schedule(mode, reference_note, seed)
+
+def save_schedule(mode, reference_note, schedule):
+    session.setdefault('schedules', {})[f"{mode}:{reference_note}"] = schedule.to_bytes()
+    session.modified = True
+
+# Session keys used by the single daily quest before the quest engine
+LEGACY_QUEST_KEYS = ('current_daily_quest', 'daily_quest_assigned_date', 'daily_quest_progress',
+                     'daily_quest_completed_today', 'listen_streak_count')
 
 # Initialize user data storage
 def init_user_data():
+    # Stable id for this user's records in the event log
+    if 'user_id' not in session:
+        session['user_id'] = uuid.uuid4().hex
+
     if 'user_data' not in session:
         session['user_data'] = {
             'start_time': datetime.now().isoformat(),
@@ -206,384 +206,469 @@ def init_user_data():
     # Initialize score if not exists
     if 'score' not in session:
         session['score'] = 0
-    
+
     # Initialize completed items tracking if not exists
     if 'completed_items' not in session:
         session['completed_items'] = {}
     
-    # Daily Quest initialization and reset
-    current_date = date.today().isoformat()
-    if session.get('daily_quest_assigned_date') != current_date or 'current_daily_quest' not in session:
-        # Reset or initialize daily quest
-        selected_quest = random.choice(AVAILABLE_DAILY_QUESTS)
-        session['daily_quest_assigned_date'] = current_date
-        session['current_daily_quest'] = selected_quest
-        
-        # Initialize progress based on quest type
-        if selected_quest['type'] == 'combined_practice':
-            session['daily_quest_progress'] = {'listen_done': False, 'sing_done': False}
-        else:
-            session['daily_quest_progress'] = {'count': 0}
-        
-        # Reset streak count for streak quests
-        session['listen_streak_count'] = 0
-        
-        # Reset completion status
-        session['daily_quest_completed_today'] = False
+    # Hand out new daily/weekly quests when a period rolls over
+    with app_metrics.timer('relapitch_quest_engine_seconds', operation='refresh'):
+        if quests.refresh(session.setdefault('quests', {}), date.today(), user_id=session['user_id']):
+            session.modified = True
+    for key in LEGACY_QUEST_KEYS:
+        session.pop(key, None)
+
+def user_state():
+    """The session, with init_user_data() run on its first use in this request.
+
+    Views that only show the score (or nothing per-user) never call it, so
+    they skip the leaderboard and quest bookkeeping and don't start a session.
+    """
+    if 'user_state_ready' not in g:
+        with app_metrics.timer('relapitch_user_state_seconds'):
+            init_user_data()
+        g.user_state_ready = True
+    return session
 
 # Helper functions for scoring and completion tracking
 def award_points_to_session(points_to_award):
     """Award points to the user's session score"""
-    # Initialize if not exists
-    if 'score' not in session:
-        session['score'] = 0
-    
+    state = user_state()
+
     # Add points
-    session['score'] += points_to_award
+    state['score'] += points_to_award
     session.modified = True
-    
-    return session['score']
+    if points_to_award:
+        # Users join the boards with their first points, carrying over the session's score
+        total = leaderboards.award(state['user_id'], points_to_award, score=state['score'] - points_to_award)
+        if leaderboards.shared:
+            # The shared total also has points from requests other workers handled
+            state['score'] = total
+    
+    return state['score']
 
 def mark_item_as_completed_in_session(item_id):
     """Mark an item as completed in the user's session"""
-    # Initialize if not exists
-    if 'completed_items' not in session:
-        session['completed_items'] = {}
-    
-    # Mark item as completed
-    session['completed_items'][item_id] = True
+    user_state()['completed_items'][item_id] = True
     session.modified = True
 
 def has_item_been_completed_in_session(item_id):
     """Check if an item has been completed in the user's session"""
-    # Initialize if not exists
-    if 'completed_items' not in session:
-        session['completed_items'] = {}
-    
-    # Check if item is completed
-    return item_id in session['completed_items']
+    return item_id in user_state()['completed_items']
 
-@app.route('/')
+@main.route('/')
 def home():
-    init_user_data()
+    state = user_state()
     return render_template('home.html',
-                         score=session.get('score', 0),
-                         current_daily_quest=session.get('current_daily_quest'),
-                         daily_quest_progress=session.get('daily_quest_progress'),
-                         daily_quest_completed=session.get('daily_quest_completed_today', False),
-                         listen_streak_count=session.get('listen_streak_count', 0))
+                         score=state['score'],
+                         quests=get_quest_data(),
+                         standing=leaderboards.standing(state['user_id']))
 
-@app.route('/lesson/<int:lesson_id>')
+@main.route('/lesson/<int:lesson_id>')
 def lesson(lesson_id):
-    init_user_data()
-    if lesson_id not in LESSONS:
-        return redirect(url_for('home'))
-    
-    lesson_data = LESSONS[lesson_id]
-    return render_template('lesson.html', 
-                         lesson=lesson_data, 
-                         lesson_id=lesson_id,
-                         score=session.get('score', 0),
-                         current_daily_quest=session.get('current_daily_quest'),
-                         daily_quest_progress=session.get('daily_quest_progress'),
-                         daily_quest_completed=session.get('daily_quest_completed_today', False),
-                         listen_streak_count=session.get('listen_streak_count', 0))
-
-@app.route('/search')
+    # Lesson pages are the same for everyone, so they never touch the session:
+    # the page is rendered once per lesson version and the score is filled in
+    # by the browser from /user/status
+    lesson_data = content.get(lesson_id)
+    if lesson_data is None:
+        return redirect(url_for('main.home'))
+
+    if current_app.debug:
+        # Templates and assets reload in debug mode, so don't serve stale renders
+        lesson_pages.clear()
+    # Pages list every lesson in their menu, so any content change invalidates them all
+    key = (lesson_id, content.version, current_app.extensions['assets'].version)
+    page = lesson_pages.get_or_render(key, lambda: render_template('lesson.html',
+                                                                   lesson=lesson_data,
+                                                                   lesson_id=lesson_id,
+                                                                   catalog=content.catalog()))
+    return page_response(page)
+
+@main.route('/user/status')
+def user_status():
+    """Per-user bits of otherwise shared pages: score and daily quest"""
+    response = jsonify({
+        'score': user_state()['score'],
+        'quests': get_quest_data()
+    })
+    response.cache_control.no_store = True
+    return response
+
+@main.route('/leaderboard')
+def leaderboard_data():
+    """Top players on each board and the current user's standing"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be an integer'}), 400
+    user_id = user_state()['user_id']
+    boards = {}
+    for period in leaderboard.PERIODS:
+        boards[period] = [{'player': player[:8], 'score': score, 'you': player == user_id}
+                          for player, score in leaderboards.top(period, limit)]
+    response = jsonify({
+        'success': True,
+        'boards': boards,
+        'standing': leaderboards.standing(user_id)
+    })
+    response.cache_control.no_store = True
+    return response
+
+@main.route('/search')
 def search():
-    init_user_data()
     query = request.args.get('q', '').strip()
-    results = []
-    if query:
-        for lesson_id, lesson_data in LESSONS.items():
-            if query.lower() in lesson_data['title'].lower() or query.lower() in lesson_data['content'].lower():
-                results.append({'id': lesson_id, 'title': lesson_data['title']})
+    results = get_search_index().search(query) if query else []
     return render_template('search_results.html', 
                          query=query, 
                          results=results,
-                         score=session.get('score', 0),
-                         current_daily_quest=session.get('current_daily_quest'),
-                         daily_quest_progress=session.get('daily_quest_progress'),
-                         daily_quest_completed=session.get('daily_quest_completed_today', False),
-                         listen_streak_count=session.get('listen_streak_count', 0))
+                         score=session.get('score', 0))
 
-@app.route('/quiz/<int:question_id>')
+@main.route('/quiz/<int:question_id>')
 def quiz(question_id):
-    init_user_data()
-    
-    # Get the mode and reference note from the session
-    mode = session.get('quiz_mode', 'listen')
-    reference_note = session.get('reference_note', 'C4')
-    
-    # Generate a new random target note for each question
-    target_note = generate_random_target_note()
-    print(f"Generated target note: {target_note}")
-    
-    # Store the target note in the session
-    if 'quiz_questions' not in session:
-        session['quiz_questions'] = {}
-    session['quiz_questions'][str(question_id)] = {
-        'target_note': target_note
-    }
-    session.modified = True
-    
-    if mode == 'listen':
-        question = {
-            "type": "listen",
-            "reference_note": reference_note,  # Use the selected reference note
-            "target_note": target_note,
-            "options": ["C", "D", "E", "F", "G", "A", "B"]
-        }
-    else:  # sing mode
-        question = {
-            "type": "sing",
-            "reference_note": reference_note,  # Use the selected reference note
-            "target_note": target_note,
-            "options": []  # Empty list for sing mode
-        }
-    
+    # Questions come from the quiz set made by start_quiz; rendering one changes nothing
+    quiz_set = get_quiz_set()
+    if quiz_set is None:
+        return redirect(url_for('main.quiz_mode'))
+    question = quiz_set.question(question_id)
+    if question is None:
+        return redirect(url_for('main.quiz_results'))
+
     return render_template('quiz.html', 
                          question=question,
                          question_id=question_id,
-                         total_questions=5,  # Always 3 questions
-                         score=session.get('score', 0),
-                         current_daily_quest=session.get('current_daily_quest'),
-                         daily_quest_progress=session.get('daily_quest_progress'),
-                         daily_quest_completed=session.get('daily_quest_completed_today', False),
-                         listen_streak_count=session.get('listen_streak_count', 0))
-
-@app.route('/quiz/mode')
+                         total_questions=len(quiz_set),
+                         score=session.get('score', 0))
+
+@main.route('/quiz/mode')
 def quiz_mode():
-    init_user_data()
     return render_template('quiz_mode.html',
-                         score=session.get('score', 0),
-                         current_daily_quest=session.get('current_daily_quest'),
-                         daily_quest_progress=session.get('daily_quest_progress'),
-                         daily_quest_completed=session.get('daily_quest_completed_today', False),
-                         listen_streak_count=session.get('listen_streak_count', 0))
+                         score=session.get('score', 0))
 
-@app.route('/quiz/start/<mode>')
+@main.route('/quiz/start/<mode>')
 def start_quiz(mode):
-    init_user_data()
+    if mode not in QUIZ_MODES:
+        return redirect(url_for('main.quiz_mode'))
     # Get the reference note from the query parameters
     reference_note = request.args.get('reference', 'C4')  # Default to C4 if not provided
+    if reference_note not in TARGET_NOTES:
+        reference_note = 'C4'
+
+    # Build the whole quiz now; the question pages only read it
+    seed = new_seed()
+    quiz_set = QuizSet.generate(mode, reference_note, load_schedule(mode, reference_note, seed), seed=seed)
+    session['quiz_set'] = quiz_set.to_bytes()
     # Store the selected mode and reference note in the session
     session['quiz_mode'] = mode
     session['reference_note'] = reference_note
+    user_state()['user_data']['quiz_answers'] = {}
+    session.pop('quiz_questions', None)  # Per-page questions from before quiz sets
     session.modified = True
     # Redirect to the first question
-    return redirect(url_for('quiz', question_id=1))
+    return redirect(url_for('main.quiz', question_id=1))
+
+def get_quiz_set():
+    blob = session.get('quiz_set')
+    return QuizSet.from_bytes(blob) if blob else None
+
+# Points for the first completion of an item, by item type. The server
+# decides what an item is worth; a points value sent by the client is ignored,
+# and only these types can be reported (quiz answers go through /quiz/submit)
+ITEM_POINTS = {
+    'lesson_interaction': 5,
+    'generic': 0,
+}
+# Lesson interaction ids as RelaPitchScoring.js builds them: lesson id and the id of a play button
+LESSON_ITEM_ID = re.compile(r'lesson_(\d+)_(play\w*)')
 
-@app.route('/log_progress', methods=['POST'])
+def item_points(item_id, item_type):
+    """Points for completing item_id, or None for a lesson interaction the lesson doesn't have"""
+    if item_type == 'lesson_interaction':
+        match = LESSON_ITEM_ID.fullmatch(item_id)
+        lesson = match and content.get(int(match.group(1)))
+        if not lesson or f'id="{match.group(2)}"' not in lesson['content']:
+            return None
+    return ITEM_POINTS[item_type]
+QUIZ_ANSWER_POINTS = 10
+MAX_ITEM_ID_LENGTH = 64
+
+def progress_event_error(event):
+    """Why a reported progress event can't be applied, or None if it can"""
+    if not isinstance(event, dict):
+        return 'Every event must be a JSON object'
+    item_id = event.get('itemId')
+    item_type = event.get('itemType', 'generic')
+    if not item_id:
+        return 'Missing itemId'
+    if not isinstance(item_id, str) or len(item_id) > MAX_ITEM_ID_LENGTH:
+        return f'itemId must be a string of at most {MAX_ITEM_ID_LENGTH} characters'
+    if not isinstance(item_type, str):
+        return 'itemType must be a string'
+    if item_type not in ITEM_POINTS:
+        return f'Unknown itemType: {item_type[:MAX_ITEM_ID_LENGTH]}'
+    return None
+
+def rate_limited(kind, cost=1):
+    """A 429 response if this user or address is over its limit for kind, else None"""
+    limiter = current_app.extensions['rate_limiter']
+    if limiter is None:
+        return None
+    # The cookie's user id if there is one; clients without a session are only limited by address
+    wait = limiter.check(kind, cost, user=session.get('user_id'), ip=request.remote_addr)
+    if not wait:
+        return None
+    app_metrics.inc('relapitch_rate_limited_total', kind=kind)
+    response = jsonify({'success': False, 'error': 'Too many requests, please slow down'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, round(wait)))
+    return response
+
+def apply_progress_event(item_id, item_type):
+    """Mark an item completed the first time it's reported, and log the event.
+
+    Returns (status, points earned). The points are paid, and the quests
+    advanced, by advance_quests() once for the whole request.
+    """
+    points = item_points(item_id, item_type)
+    if points is None:
+        # A made-up id: no points, no quest progress and nothing stored
+        return "ignored_unknown_item", 0
+    if not has_item_been_completed_in_session(item_id):
+        # Mark as completed to prevent future awards
+        mark_item_as_completed_in_session(item_id)
+        status, awarded = "success_new_item", points
+    else:
+        # Do NOT award points again for this item
+        status, awarded = "success_item_already_completed", 0
+
+    events.append({
+        'type': 'progress',
+        'user_id': user_state()['user_id'],
+        'item_id': item_id,
+        'item_type': item_type,
+        'points': awarded,
+        'timestamp': datetime.now().isoformat()
+    })
+    return status, awarded
+
+@main.route('/log_progress', methods=['POST'])
 def log_progress():
     try:
-        # Ensure user data is initialized
-        init_user_data()
-        
         # Get data from request
-        data = request.get_json()
-        item_id = data.get('itemId')
-        points_for_this_item = data.get('points', 0)
+        limited = rate_limited('progress')
+        if limited:
+            return limited
+
+        data = request.get_json(silent=True)
+        error = progress_event_error(data)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        item_id = data['itemId']
         item_type = data.get('itemType', 'generic')
-        
-        if not item_id:
-            return jsonify({'success': False, 'error': 'Missing itemId'}), 400
-        
-        # Check if this item has already been completed
-        is_already_completed = has_item_been_completed_in_session(item_id)
-        
-        # Current score before any updates
-        new_score = session.get('score', 0)
-        awarded_item_points = 0
-        
-        # Conditional Point Awarding for the Item Itself
-        if not is_already_completed:
-            # Award points for this specific item interaction
-            new_score = award_points_to_session(points_for_this_item)
-            # Mark as completed to prevent future awards
-            mark_item_as_completed_in_session(item_id)
-            # Set status and awarded points
-            status_message = "success_new_item"
-            awarded_item_points = points_for_this_item
-        else:
-            # Do NOT award points again for this item
-            status_message = "success_item_already_completed"
-        
-        # Daily Quest Progress Update (Happens regardless of item completion status)
-        # This allows interactions to still count toward quest progress even if points
-        # aren't awarded for the specific item again
-        quest_update = update_daily_quest_progress(item_type)
+
+        status_message, awarded_item_points = apply_progress_event(item_id, item_type)
+        # Quest progress counts every interaction, even for items that no longer earn points
+        quest_events = [item_type] if status_message != "ignored_unknown_item" else []
+        completed_quests = advance_quests(quest_events, awarded_item_points)
+        messages = {
+            "success_new_item": "Points awarded!",
+            "success_item_already_completed": "Item already completed, no new points",
+            "ignored_unknown_item": "Unknown item, no points",
+        }
         
         # Return detailed JSON response
         return jsonify({
             'status': status_message,
-            'new_score': new_score,
+            'new_score': session.get('score', 0),
             'awarded_item_points': awarded_item_points,
-            'message': "Points awarded!" if not is_already_completed else "Item already completed, no new points",
-            'daily_quest_update': quest_update
+            'message': messages[status_message],
+            'quests': get_quest_data(),
+            'quests_completed': completed_quests
         })
     except Exception as e:
-        print(f"Error logging progress: {str(e)}")
+        log.exception('progress logging failed')
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# Helper function to update daily quest progress
-def update_daily_quest_progress(item_type, is_correct=True):
-    """Update daily quest progress based on action type"""
-    # Initialize user data if needed
-    init_user_data()
-    
-    # Return early if quest is already completed today
-    if session.get('daily_quest_completed_today', False):
-        return get_daily_quest_data()
-    
-    # Get current quest
-    current_quest = session.get('current_daily_quest')
-    if not current_quest:
-        return get_daily_quest_data()
-    
-    quest_type = current_quest['type']
-    quest_updated = False
-    
-    # Update progress based on quest type and action
-    if quest_type == 'listen_correct_count' and item_type == 'listen_correct' and is_correct:
-        # Increment count for listen correct count quests
-        session['daily_quest_progress']['count'] = session['daily_quest_progress'].get('count', 0) + 1
-        quest_updated = True
-    
-    elif quest_type == 'sing_correct_count' and item_type == 'sing_correct' and is_correct:
-        # Increment count for sing correct count quests
-        session['daily_quest_progress']['count'] = session['daily_quest_progress'].get('count', 0) + 1
-        quest_updated = True
-    
-    elif quest_type == 'lesson_interaction_count' and item_type == 'lesson_interaction':
-        # Increment count for lesson interaction count quests
-        session['daily_quest_progress']['count'] = session['daily_quest_progress'].get('count', 0) + 1
-        quest_updated = True
-    
-    elif quest_type == 'listen_streak':
-        if item_type == 'listen_correct' and is_correct:
-            # Increment streak count for listen streak quests
-            session['listen_streak_count'] = session.get('listen_streak_count', 0) + 1
-            quest_updated = True
-        elif item_type == 'listen_correct' and not is_correct:
-            # Reset streak count if wrong answer
-            session['listen_streak_count'] = 0
-            quest_updated = True
-    
-    elif quest_type == 'combined_practice':
-        if item_type == 'listen_correct' and is_correct:
-            # Mark listen as done for combined practice quests
-            session['daily_quest_progress']['listen_done'] = True
-            quest_updated = True
-        elif item_type == 'sing_correct' and is_correct:
-            # Mark sing as done for combined practice quests
-            session['daily_quest_progress']['sing_done'] = True
-            quest_updated = True
-    
-    # Check if quest is completed
-    quest_completed = False
-    if quest_updated:
-        if quest_type == 'listen_correct_count' or quest_type == 'sing_correct_count' or quest_type == 'lesson_interaction_count':
-            # Check count against goal
-            if session['daily_quest_progress'].get('count', 0) >= current_quest['goal_value']:
-                quest_completed = True
-        
-        elif quest_type == 'listen_streak':
-            # Check streak count against goal
-            if session.get('listen_streak_count', 0) >= current_quest['goal_value']:
-                quest_completed = True
-        
-        elif quest_type == 'combined_practice':
-            # Check if both listen and sing are done
-            if session['daily_quest_progress'].get('listen_done', False) and session['daily_quest_progress'].get('sing_done', False):
-                quest_completed = True
-    
-    # If quest is completed, award points and mark as completed
-    if quest_completed and not session.get('daily_quest_completed_today', False):
-        session['daily_quest_completed_today'] = True
-        award_points_to_session(current_quest['reward_points'])
-        mark_item_as_completed_in_session(f"daily_quest_done_{current_quest['quest_id']}_{session['daily_quest_assigned_date']}")
-    
+MAX_PROGRESS_BATCH = 100
+
+@main.route('/log_progress/batch', methods=['POST'])
+def log_progress_batch():
+    """Apply an ordered list of progress events in one request.
+
+    Body: {"events": [{"itemId", "itemType"}, ...]}. The response
+    carries the combined result: total points awarded, the new score and
+    the quest state after the last event.
+    """
+    # force=True: browsers send the final flush with sendBeacon, which can't set a JSON content type
+    data = request.get_json(force=True, silent=True)
+    events = data.get('events') if isinstance(data, dict) else None
+    if not isinstance(events, list):
+        return jsonify({'success': False, 'error': "Expected a JSON body with an 'events' list"}), 400
+    if len(events) > MAX_PROGRESS_BATCH:
+        return jsonify({'success': False, 'error': f"At most {MAX_PROGRESS_BATCH} events per batch"}), 400
+
+    limited = rate_limited('progress', cost=max(1, len(events)))
+    if limited:
+        return limited
+
+    # Check every event before applying any, so a bad one doesn't leave the batch half applied
+    for event in events:
+        error = progress_event_error(event)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+
+    score_before = user_state()['score']
+
+    results = []
+    awarded_points = 0
+    quest_events = []
+    for event in events:
+        item_type = event.get('itemType', 'generic')
+        status, awarded = apply_progress_event(event['itemId'], item_type)
+        awarded_points += awarded
+        if status != "ignored_unknown_item":
+            quest_events.append(item_type)
+        results.append({'itemId': event['itemId'], 'status': status, 'awarded_item_points': awarded})
+    # The quests and scores are updated once for the whole batch
+    completed_quests = advance_quests(quest_events, awarded_points)
+
+    new_score = session.get('score', 0)
+    return jsonify({
+        'status': 'success',
+        'results': results,
+        'awarded_item_points': awarded_points,
+        'score_delta': new_score - score_before,  # Includes any quest reward
+        'new_score': new_score,
+        'quests': get_quest_data(),
+        'quests_completed': completed_quests
+    })
+
+def advance_quests(item_types, points=0):
+    """Feed events (item types, in order) to the user's quests, then pay out `points`
+    plus the rewards of the quests they complete, as one update.
+
+    With shared state that is one transaction however many events there
+    are. Returns the ids of the completed quests.
+    """
+    if not item_types and not points:
+        return []
+    state = user_state()
+    user_id = state['user_id']
+    shared = current_app.extensions['shared_state']
+
+    def apply(board):
+        completed = []
+        for item_type in item_types:
+            completed.extend(quests.apply_event(board, item_type))
+        return completed
+
+    def total_points(completed):
+        return points + sum(quest['reward_points'] for _, quest in completed)
+
+    with app_metrics.timer('relapitch_quest_engine_seconds', operation='apply_event'):
+        if shared is not None:
+            # Apply the events to the stored board and add the points under the store's lock,
+            # so concurrent requests in other workers can't overwrite each other's progress
+            def update(board):
+                quests.refresh(board, date.today(), user_id=user_id)
+                return apply(board)
+
+            session['quests'], completed, totals = shared.record_progress(
+                user_id, update, total_points, leaderboards.score_rows(state['score']),
+                initial=session['quests'])
+        else:
+            completed = apply(session['quests'])
+    for period, quest in completed:
+        mark_item_as_completed_in_session(f"quest_done_{quest['quest_id']}_{period}")
+    if shared is None:
+        award_points_to_session(total_points(completed))
+    elif totals:
+        # The shared total also has points from requests other workers handled
+        state['score'] = leaderboards.apply_totals(user_id, totals)
     session.modified = True
-    return get_daily_quest_data()
-
-# Helper function to get daily quest data
-def get_daily_quest_data():
-    """Get current daily quest data in format suitable for JSON response"""
-    # Get current quest
-    current_quest = session.get('current_daily_quest', {})
-    if not current_quest:
-        return {
-            'quest_description': "No quest available",
-            'quest_progress': 0,
-            'quest_goal': 0,
-            'quest_completed': False
-        }
-    
-    # Format progress based on quest type
-    quest_type = current_quest['type']
-    progress = 0
-    goal = current_quest.get('goal_value', 1)
-    
-    if quest_type == 'listen_correct_count' or quest_type == 'sing_correct_count' or quest_type == 'lesson_interaction_count':
-        progress = session.get('daily_quest_progress', {}).get('count', 0)
-    
-    elif quest_type == 'listen_streak':
-        progress = session.get('listen_streak_count', 0)
-    
-    elif quest_type == 'combined_practice':
-        # For combined practice, show completion of both parts
-        listen_done = session.get('daily_quest_progress', {}).get('listen_done', False)
-        sing_done = session.get('daily_quest_progress', {}).get('sing_done', False)
-        progress = (1 if listen_done else 0) + (1 if sing_done else 0)
-        goal = 2  # Both listen and sing need to be done
-    
-    return {
-        'quest_description': current_quest.get('description', ""),
-        'quest_progress': progress,
-        'quest_goal': goal,
-        'quest_completed': session.get('daily_quest_completed_today', False)
-    }
-
-@app.route('/quiz/submit', methods=['POST'])
+    return [quest['quest_id'] for _, quest in completed]
+
+def get_quest_data():
+    """Current quests in a format suitable for JSON responses and the quest widget"""
+    return quests.quest_status(user_state()['quests'])
+
+@main.route('/quiz/submit', methods=['POST'])
 def submit_quiz_answer():
+    limited = rate_limited('answer')
+    if limited:
+        return limited
     try:
-        data = request.get_json()
+        # Sing mode answers can come as multipart with the recording attached
+        data = request.form if request.files else request.get_json()
         question_id = data.get('question_id')
         answer = data.get('answer')
-        print('ANSWER',answer)
-        
-        if not question_id or not answer:
-            return jsonify({'success': False, 'error': 'Missing question_id or answer'}), 400
-        
-        # Initialize user data if not exists
-        init_user_data()
+        try:
+            response_ms = int(float(data['response_ms'])) if data.get('response_ms') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'response_ms must be a number'}), 400
         
         # Get the mode from the session
         mode = session.get('quiz_mode', 'listen')
         
-        # Get the stored target note for this question
-        target_note = session['quiz_questions'][str(question_id)]['target_note']
+        # In sing mode, a recording of the attempt is graded by the server's
+        # own pitch detector instead of trusting the note the browser found
+        pitch_analysis = None
+        clip_hash = None
+        if mode == 'sing':
+            try:
+                recording, clip_hash = get_submitted_recording(data)
+            except (AudioDecodeError, clip_store.ClipError) as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            if recording is not None:
+                pitch_analysis = compute.run(analyze_clips, [recording])[0]
+                pitch_analysis.pop('frames')
+                answer = music_theory.note_letter(pitch_analysis['note'])
+        
+        if not question_id or not (answer or pitch_analysis):
+            return jsonify({'success': False, 'error': 'Missing question_id or answer'}), 400
         
-        # Check if the answer is correct
-        is_correct = False
-        if mode == 'listen':
-            # For listen mode, check if the answer matches the target note
-            is_correct = answer == target_note[0]  # Compare just the note letter
-        else:  # sing mode
-            # For sing mode, check if the answer matches the target note
-            # Remove any octave number from the answer (e.g., "C4" -> "C")
-            answer_note = answer
-            is_correct = answer_note == target_note[0]
+        # Get the target note for this question from the current quiz set
+        quiz_set = get_quiz_set()
+        try:
+            question = quiz_set.question(int(question_id)) if quiz_set else None
+        except (TypeError, ValueError):
+            question = None
+        if question is None:
+            return jsonify({'success': False, 'error': 'No such question in the current quiz'}), 400
+        target_note = question['target_note']
+        
+        # Notes are graded by pitch class (exactly if the answer has an octave), intervals
+        # by size, and sung notes in cents from the target in the singer's octave
+        is_correct, cents_off = quiz_set.grade(question, answer,
+                                               f0=pitch_analysis['f0'] if pitch_analysis else None)
         
         # Store the answer with correctness
-        session['user_data']['quiz_answers'][str(question_id)] = {
+        reference_note = session.get('reference_note', 'C4')
+        answer_record = {
             'answer': answer,
             'timestamp': datetime.now().isoformat(),
             'is_correct': is_correct,
-            'target_note': target_note  # Store the target note for reference
+            'target_note': target_note,  # Store the target note for reference
+            'reference_note': reference_note,
+            'response_ms': response_ms,
+            'detected_f0': pitch_analysis['f0'] if pitch_analysis else None,
+            'cents_off': cents_off
         }
+        user_state()['user_data']['quiz_answers'][str(question_id)] = answer_record
         session.modified = True
+
+        # Reschedule this target note: sooner if missed, later the better it went
+        schedule = load_schedule(mode, reference_note, quiz_set.seed)
+        schedule.review(quiz_set.card(int(question_id)), quality_from_answer(is_correct, response_ms))
+        save_schedule(mode, reference_note, schedule)
+
+        # The session only keeps the current quiz; the log keeps every answer
+        events.append(dict(answer_record, type='answer', user_id=session['user_id'], mode=mode,
+                           question_id=str(question_id), clip=clip_hash))
+        if clip_hash:
+            # Indexed with its grade, for review and `flask clips regrade`
+            recordings.add_attempt(clip_hash, session['user_id'], question_id, mode, target_note, reference_note,
+                                   f0=pitch_analysis['f0'], note=pitch_analysis['note'], cents=cents_off,
+                                   is_correct=is_correct)
         
         # Generate static item ID for this question answer (no timestamp)
         # This ensures points are only awarded once for correctly answering each question
@@ -592,32 +677,208 @@ def submit_quiz_answer():
         # Award points if correct (only first time)
         points_awarded = 0
         if is_correct and not has_item_been_completed_in_session(item_id):
-            points_to_award = 10  # Points for correct answer
-            award_points_to_session(points_to_award)
             mark_item_as_completed_in_session(item_id)
-            points_awarded = points_to_award
+            points_awarded = QUIZ_ANSWER_POINTS
         
-        # Update daily quest progress
+        # Update quest progress (a wrong answer breaks listen streaks) and pay the points with it
         item_type = f"{mode}_correct" if is_correct else f"{mode}_incorrect"
-        quest_update = update_daily_quest_progress(item_type, is_correct)
+        completed_quests = advance_quests([item_type], points_awarded)
         
-        print(f"Stored answer for question {question_id}: {answer} (Correct: {is_correct}, Target: {target_note})")
+        log.info('answer stored', extra={'question_id': question_id, 'mode': mode, 'answer': answer,
+                                         'is_correct': is_correct, 'target_note': target_note})
         return jsonify({
             'success': True,
             'is_correct': is_correct,
-            'correct_answer': target_note[0],  # Return just the note letter
+            'correct_answer': question['answer'],  # Note name without octave, or the interval
             'points_awarded': points_awarded,
             'total_score': session.get('score', 0),
-            'daily_quest_update': quest_update
+            'quests': get_quest_data(),
+            'quests_completed': completed_quests,
+            'pitch_analysis': pitch_analysis,
+            'cents_off': cents_off
         })
     except Exception as e:
-        print(f"Error submitting answer: {str(e)}")
+        log.exception('answer submission failed')
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/quiz/results')
+# Helper function to read a sing-mode recording from an answer submission
+def get_submitted_recording(data):
+    """((samples, sample_rate), clip hash) for an attached or uploaded recording, or (None, None).
+
+    The recording is kept in the clip store: a finished chunked upload
+    (upload_id) is moved there, attached ones are written there.
+    """
+    if data.get('upload_id'):
+        clip_hash = recordings.finish_upload(data['upload_id'], user_state()['user_id'])
+        return check_clip(*decode_wav(recordings.read(clip_hash))), clip_hash
+    upload = request.files.get('audio')
+    if upload is not None:
+        wav = upload.read()
+        recording = check_clip(*decode_wav(wav))
+        return recording, recordings.put(wav)
+    if isinstance(data, dict) and data.get('audio'):
+        recording = decode_clip(data['audio'])
+        return recording, recordings.put(encode_wav(*recording))
+    return None, None
+
+@main.route('/audio/analyze', methods=['POST'])
+def analyze_audio():
+    """Batch pitch analysis: per-frame f0, confidence and note for each clip"""
+    try:
+        if request.files:
+            clips = [check_clip(*decode_wav(upload.read())) for upload in request.files.getlist('clips')]
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict) or not isinstance(data.get('clips', []), list):
+                return jsonify({'success': False, 'error': "Expected a JSON body with a 'clips' list"}), 400
+            clips = [decode_clip(clip) for clip in data.get('clips', [])]
+    except AudioDecodeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if not clips:
+        return jsonify({'success': False, 'error': 'No clips provided'}), 400
+    if len(clips) > MAX_CLIPS:
+        return jsonify({'success': False, 'error': f'At most {MAX_CLIPS} clips per request'}), 400
+
+    return jsonify({'success': True, 'results': compute.run(analyze_clips, clips)})
+
+@main.route('/clips/uploads', methods=['POST'])
+def start_clip_upload():
+    """Start a resumable upload of a sing-mode recording (see clip_store.py)"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    try:
+        length = int(data['length']) if data.get('length') is not None else None
+        upload_id = recordings.start_upload(user_state()['user_id'], length)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'length must be a number of bytes'}), 400
+    except clip_store.ClipError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'upload_id': upload_id, 'offset': 0})
+
+@main.route('/clips/uploads/<upload_id>', methods=['GET', 'PATCH'])
+def clip_upload(upload_id):
+    """GET: how many bytes have arrived. PATCH: the next chunk, at the Upload-Offset header"""
+    user_id = user_state()['user_id']
+    try:
+        if request.method == 'GET':
+            upload = recordings.upload_status(upload_id, user_id)
+            return jsonify({'success': True, 'offset': upload['received'], 'length': upload['length']})
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return jsonify({'success': False, 'error': 'Upload-Offset header required'}), 400
+        offset = recordings.write_chunk(upload_id, user_id, offset, request.stream, request.content_length)
+    except clip_store.UploadNotFound as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except clip_store.OffsetMismatch as e:
+        # The client resumes from the offset the server has
+        return jsonify({'success': False, 'error': str(e), 'offset': e.offset}), 409
+    except clip_store.ClipError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'offset': offset})
+
+@main.route('/clips')
+def clip_attempts():
+    """This user's stored sing attempts, newest first (?question_id= and ?quest_date= filter them)"""
+    attempts = recordings.attempts(user_id=user_state()['user_id'], question_id=request.args.get('question_id'),
+                                   quest_date=request.args.get('quest_date'), limit=100)
+    for attempt in attempts:
+        attempt['url'] = url_for('main.clip_audio', clip_hash=attempt['clip_hash'])
+        del attempt['user_id']
+    return jsonify({'success': True, 'attempts': attempts})
+
+@main.route('/clips/<clip_hash>.wav')
+def clip_audio(clip_hash):
+    """One of this user's recordings; names are content hashes, so cache forever"""
+    if not recordings.has_clip(user_state()['user_id'], clip_hash):
+        abort(404)
+    response = send_from_directory(os.path.dirname(recordings.object_path(clip_hash)), clip_hash + '.wav',
+                                   mimetype='audio/wav', max_age=31536000)
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@sock.route('/ws/pitch', bp=main)
+def pitch_socket(ws):
+    """Stream PCM frames in (binary messages), get pitch updates back as JSON"""
+    sample_rate = request.args.get('sample_rate', 44100, type=int)
+    encoding = request.args.get('encoding', 'float32')
+    try:
+        stream = pitch_hub.open(sample_rate, encoding)
+    except StreamError as e:
+        ws.close(reason=1013, message=str(e))
+        return
+
+    try:
+        while True:
+            message = ws.receive(timeout=0.02)
+            if isinstance(message, (bytes, bytearray)):
+                stream.push(message)
+            update = stream.take_update()
+            if update is not None:
+                ws.send(json.dumps(update))
+    except (ConnectionClosed, StreamError):
+        pass
+    finally:
+        pitch_hub.close(stream)
+
+@main.route('/audio/notes/<filename>')
+def note_audio(filename):
+    """Serve rendered note audio; names are content hashes, so cache forever"""
+    if not sample_bank.is_bank_file(filename):
+        abort(404)
+    # conditional=True gives us ETags and HTTP Range support
+    response = send_from_directory(sample_bank.directory, filename, mimetype='audio/wav',
+                                   max_age=31536000, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@main.route('/service-worker.js')
+def service_worker():
+    """Served from the root so its scope covers every page; pages add ?v=<precache version>"""
+    response = send_from_directory(os.path.join(current_app.static_folder, 'js'), 'service-worker.js',
+                                   mimetype='text/javascript', max_age=0)
+    response.cache_control.no_cache = True
+    return response
+
+@main.route('/offline/manifest.json')
+def offline_manifest():
+    """What the service worker precaches, and the version that names its cache"""
+    response = jsonify(precache.build(current_app.jinja_env.globals['vendor_url'], note_bank, MAX_PROGRESS_BATCH))
+    response.cache_control.no_cache = True
+    return response
+
+@main.route('/manifest.webmanifest')
+def web_app_manifest():
+    return Response(json.dumps(offline.web_app_manifest()), mimetype='application/manifest+json')
+
+@main.route('/analytics')
+def answer_analytics():
+    """Accuracy, confusion, response time and trend statistics, overall and for this user"""
+    summaries = current_app.extensions['answer_stats'].summaries(user_state()['user_id'])
+    if summaries is None:
+        response = jsonify({'success': False, 'error': 'Answer statistics are still loading'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    overall, user = summaries
+    return jsonify({
+        'global': overall,
+        'user': user
+    })
+
+@main.route('/metrics')
+def prometheus_metrics():
+    """Latency, session, template and quest engine metrics in the Prometheus text format"""
+    app_metrics.set('relapitch_log_records_dropped_total', current_app.extensions['log_handler'].dropped)
+    return Response(app_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/quiz/results')
 def quiz_results():
-    init_user_data()
-    answers = session['user_data']['quiz_answers']
+    answers = user_state()['user_data']['quiz_answers']
     correct_answers = 0
     
     for question_id, answer_data in answers.items():
@@ -634,11 +895,19 @@ def quiz_results():
                          quiz_score=int(score),
                          total_questions=total_questions,
                          correct_answers=correct_answers,
-                         score=session.get('score', 0),
-                         current_daily_quest=session.get('current_daily_quest'),
-                         daily_quest_progress=session.get('daily_quest_progress'),
-                         daily_quest_completed=session.get('daily_quest_completed_today', False),
-                         listen_streak_count=session.get('listen_streak_count', 0))
+                         score=session.get('score', 0))
+
+_default_app = None
+
+def __getattr__(name):
+    # `server.app` (flask --app server, asgi.py, the benchmarks) is built on first use, so
+    # importing this module for create_app() doesn't build an app with the default profile
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5001, debug=True) 
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5001) 
\ No newline at end of file
@@ -0,0 +1,378 @@
+"""Server-side session storage for RelaPitch.
+
+Flask's default session keeps everything in a signed cookie, which means the
+whole blob (quiz answers, completed items, quest state...) is re-signed and
+re-sent on every response. This module keeps the data on the server instead
+and only hands the browser a small opaque session id.
+
+Two things keep the per-request cost down:
+
+* Reads are lazy: the store is only hit the first time a view actually
+  touches ``session``.
+* Writes only happen when the session is marked modified. Assigning or
+  removing a key marks it; code that changes a nested value sets
+  ``session.modified = True`` (as with Flask's own sessions). A request
+  that only reads the session, or runs ``init_user_data()`` on one that is
+  already set up, doesn't serialize it at all.
+
+Every backend has the same sliding expiry: reading a session extends its
+lifetime to the full TTL (the SQLite and file backends only rewrite the
+expiry once it is TOUCH_INTERVAL old, to keep reads read-only).
+
+Backends are pluggable; pick one with the ``SESSION_STORE`` config key
+(``memory``, ``sqlite`` or ``file``). Sessions are written as compact binary
+progress records (progress_codec.py) unless ``SESSION_SERIALIZER`` is
+``json``; either way, sessions written in the other format still load.
+"""
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from progress_codec import ProgressSerializer, decode_state, record_version
+
+# Session ids are 32 random bytes, urlsafe-base64 encoded (43 characters)
+SID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+DEFAULT_TTL = 31 * 24 * 3600  # Same as Flask's permanent_session_lifetime
+TOUCH_INTERVAL = 300  # Seconds before a read pushes a stored session's expiry forward again
+
+
+def generate_sid():
+    return secrets.token_urlsafe(32)
+
+
+class SessionStore:
+    """Base class for session backends. Values are raw serialized bytes.
+
+    get() keeps a session alive: it expires `ttl` seconds after it was last
+    read or written.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+
+    def get(self, sid):
+        raise NotImplementedError
+
+    def set(self, sid, data):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def cleanup(self):
+        """Remove expired sessions. Backends call this periodically on their own."""
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store with LRU eviction and a sliding TTL."""
+
+    def __init__(self, max_entries=10000, ttl=DEFAULT_TTL):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # sid -> (expires_at, data)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < now:
+                del self._data[sid]
+                return None
+            # Reading a session keeps it alive and marks it recently used
+            self._data[sid] = (now + self.ttl, data)
+            self._data.move_to_end(sid)
+            return data
+
+    def set(self, sid, data):
+        with self._lock:
+            self._data[sid] = (time.time() + self.ttl, data)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (expires_at, _) in self._data.items() if expires_at < now]
+            for sid in expired:
+                del self._data[sid]
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a single SQLite file, shared by every worker on the host."""
+
+    CLEANUP_EVERY = 1000  # writes between expired-row sweeps
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                ' sid TEXT PRIMARY KEY,'
+                ' data BLOB NOT NULL,'
+                ' expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)')
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self._connection().execute(
+            'SELECT data, expires_at FROM sessions WHERE sid = ?', (sid,)
+        ).fetchone()
+        now = time.time()
+        if row is None or row[1] < now:
+            return None
+        if row[1] < now + self.ttl - TOUCH_INTERVAL:
+            with self._connection() as conn:
+                conn.execute('UPDATE sessions SET expires_at = ? WHERE sid = ?', (now + self.ttl, sid))
+        return bytes(row[0])
+
+    def set(self, sid, data):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                (sid, data, time.time() + self.ttl)
+            )
+        self._writes += 1
+        if self._writes % self.CLEANUP_EVERY == 0:
+            self.cleanup()
+
+    def delete(self, sid):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def cleanup(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+
+
+class FileSessionStore(SessionStore):
+    """One file per session in a directory. Expiry is based on the file mtime."""
+
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, directory, ttl=DEFAULT_TTL):
+        super().__init__(ttl)
+        self.directory = directory
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        # sids are validated against SID_PATTERN before they get here,
+        # so they can't contain path separators
+        return os.path.join(self.directory, sid)
+
+    def get(self, sid):
+        path = self._path(sid)
+        now = time.time()
+        try:
+            modified = os.path.getmtime(path)
+            if modified + self.ttl < now:
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            if modified < now - TOUCH_INTERVAL:
+                os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def set(self, sid, data):
+        path = self._path(sid)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # Atomic, so readers never see half a session
+        self._writes += 1
+        if self._writes % self.CLEANUP_EVERY == 0:
+            self.cleanup()
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that loads itself from the store on first access."""
+
+    def __init__(self, store, serializer, sid=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(None, on_update)
+        self.store = store
+        self.serializer = serializer
+        self.sid = sid
+        self.new = sid is None
+        self.loaded = self.new  # A brand new session has nothing to load
+        self.modified = False
+        self.accessed = False
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        self.accessed = True
+        raw = self.store.get(self.sid)
+        if raw is None:
+            # Unknown or expired id: start over with a fresh one
+            self.sid = None
+            self.new = True
+            return
+        dict.update(self, self.serializer.loads(raw))
+
+
+def _loads_first(name):
+    method = getattr(CallbackDict, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.accessed = True
+        self.load()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+# Every way of reading or writing the dict goes through load() first
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__',
+              '__len__', '__repr__', 'get', 'setdefault', 'pop', 'popitem', 'update',
+              'clear', 'keys', 'values', 'items', 'copy'):
+    setattr(ServerSideSession, _name, _loads_first(_name))
+
+
+class JSONSessionSerializer(TaggedJSONSerializer):
+    """Tagged JSON that also reads binary progress records, for switching formats back"""
+
+    def loads(self, value):
+        if isinstance(value, bytes) and record_version(value):
+            return decode_state(value)
+        return super().loads(value)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a SessionStore; the cookie only holds the session id."""
+
+    serializer = ProgressSerializer()
+
+    def __init__(self, store, serializer=None):
+        self.store = store
+        if serializer is not None:
+            self.serializer = serializer
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or not SID_PATTERN.match(sid):
+            sid = None
+        return ServerSideSession(self.store, self.serializer, sid)
+
+    def save_session(self, app, session, response):
+        if not session.accessed:
+            # The view never looked at the session: nothing to read or write
+            return
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        response.vary.add('Cookie')
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            # Only read (the store's get already extended its lifetime)
+            return
+
+        raw = self.serializer.dumps(dict(session))
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        if session.sid is None:
+            session.sid = generate_sid()
+        self.store.set(session.sid, raw)
+
+        if session.new:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def create_session_store(app):
+    """Build the session backend selected by the app config"""
+    kind = app.config.get('SESSION_STORE', 'memory')
+    ttl = app.config.get('SESSION_STORE_TTL', DEFAULT_TTL)
+    if kind == 'memory':
+        return MemorySessionStore(app.config.get('SESSION_STORE_MAX_ENTRIES', 10000), ttl)
+    if kind == 'sqlite':
+        path = app.config.get('SESSION_STORE_PATH') or os.path.join(app.instance_path, 'sessions.db')
+        return SQLiteSessionStore(path, ttl)
+    if kind == 'file':
+        path = app.config.get('SESSION_STORE_PATH') or os.path.join(app.instance_path, 'sessions')
+        return FileSessionStore(path, ttl)
+    raise ValueError(f"Unknown SESSION_STORE: {kind}")
+
+
+def create_session_serializer(app):
+    kind = app.config.get('SESSION_SERIALIZER', 'binary')
+    if kind == 'binary':
+        return ProgressSerializer()
+    if kind == 'json':
+        return JSONSessionSerializer()
+    raise ValueError(f"Unknown SESSION_SERIALIZER: {kind}")
+
+
+def init_app(app):
+    app.session_interface = ServerSideSessionInterface(create_session_store(app), create_session_serializer(app))
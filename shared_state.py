@@ -0,0 +1,175 @@
+"""Scores and quest progress shared by every worker process on a host.
+
+With several worker processes a user's requests can land on any of them,
+and each process used to keep its own leaderboards and trust whatever
+score and quest state the session had when the request started. Two
+overlapping requests could then overwrite each other's points.
+
+SharedState keeps that data in one SQLite file in WAL mode (readers never
+block the writer), and every change is a single atomic statement or an
+IMMEDIATE transaction:
+
+* add_points() increments a user's score on each leaderboard with an
+  upsert, and returns the new totals.
+* update_quests() runs a quest-engine update on the user's stored quest
+  board under the write lock, so concurrent events are applied one after
+  the other instead of racing.
+* record_progress() does both for a whole request's events (a progress
+  batch, or an answer and its quests) in a single transaction.
+
+Each score change also gets a number from a global sequence, so a process
+can cheaply pull only the rows changed since it last looked (see
+leaderboard.Leaderboards).
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import progress_codec
+
+
+class SharedState:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS scores ('
+                ' board TEXT NOT NULL,'
+                ' period TEXT NOT NULL,'
+                ' user_id TEXT NOT NULL,'
+                ' score INTEGER NOT NULL,'
+                ' seq INTEGER NOT NULL,'
+                ' PRIMARY KEY (board, period, user_id))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS scores_seq ON scores (seq)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS quest_boards ('
+                ' user_id TEXT PRIMARY KEY,'
+                ' board TEXT NOT NULL)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('seq', 0)")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database lock up front, so read-modify-write is atomic"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _next_seq(self, conn):
+        return conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'seq' RETURNING value").fetchone()[0]
+
+    # Scores
+
+    def add_points(self, user_id, points, boards):
+        """Add points to the user on each (board, period, starting score); returns {board: new score}
+
+        A user the board doesn't have yet is added with the starting score plus points.
+        """
+        with self._transaction() as conn:
+            return self._add_points(conn, user_id, points, boards)
+
+    def _add_points(self, conn, user_id, points, boards):
+        seq = self._next_seq(conn)
+        totals = {}
+        for board, period, start in boards:
+            totals[board] = conn.execute(
+                'INSERT INTO scores (board, period, user_id, score, seq) VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT (board, period, user_id)'
+                ' DO UPDATE SET score = score + ?, seq = excluded.seq'
+                ' RETURNING score',
+                (board, period, user_id, start + points, seq, points)
+            ).fetchone()[0]
+        return totals
+
+    def changes_since(self, seq):
+        """(rows of (board, period, user_id, score), latest seq) for scores changed after seq"""
+        rows = self._connection().execute(
+            'SELECT board, period, user_id, score, seq FROM scores WHERE seq > ? ORDER BY seq', (seq,)
+        ).fetchall()
+        if rows:
+            seq = rows[-1][4]
+        return [row[:4] for row in rows], seq
+
+    def prune_scores(self, board, keep_period):
+        """Drop a board's rows from periods other than keep_period"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM scores WHERE board = ? AND period != ?', (board, keep_period))
+
+    # Quests
+
+    def update_quests(self, user_id, update, initial=None):
+        """Apply update(board) to the user's stored quest board atomically.
+
+        The board starts from `initial` (e.g. the copy in the session) the
+        first time. Returns (board, whatever update returned).
+        """
+        with self._transaction() as conn:
+            board, result = self._update_quests(conn, user_id, update, initial)
+        return board, result
+
+    def record_progress(self, user_id, update, points, boards, initial=None):
+        """update_quests() and add_points() in one transaction, for a whole batch of events.
+
+        points(result) is how many points to add given what update
+        returned (e.g. the items' points plus the rewards of the quests
+        completed). Returns (board, result, {board: new score}, or None if
+        there were no points to add).
+        """
+        with self._transaction() as conn:
+            board, result = self._update_quests(conn, user_id, update, initial)
+            total = points(result)
+            totals = self._add_points(conn, user_id, total, boards) if total else None
+        return board, result, totals
+
+    def _update_quests(self, conn, user_id, update, initial):
+        row = conn.execute('SELECT board FROM quest_boards WHERE user_id = ?', (user_id,)).fetchone()
+        board = _load_board(row[0]) if row else json.loads(json.dumps(initial or {}))
+        result = update(board)
+        conn.execute('INSERT OR REPLACE INTO quest_boards (user_id, board) VALUES (?, ?)',
+                     (user_id, progress_codec.encode_state({'quests': board})))
+        return board, result
+
+
+def _load_board(stored):
+    # Boards are binary progress records; rows written before that are JSON text
+    if isinstance(stored, str):
+        return json.loads(stored)
+    return progress_codec.decode_state(stored)['quests']
+
+
+def init_app(app):
+    """The shared store, or None when SHARED_STATE is off (a single process needs none)"""
+    kind = app.config.get('SHARED_STATE') or 'off'
+    if kind == 'off':
+        state = None
+    elif kind == 'sqlite':
+        path = app.config.get('SHARED_STATE_PATH') or os.path.join(app.instance_path, 'shared_state.db')
+        state = SharedState(path)
+    else:
+        raise ValueError(f"Unknown SHARED_STATE: {kind}")
+    app.extensions['shared_state'] = state
+    return state
+
@@ -1,48 +1,117 @@
 /**
  * RelaPitchScoring.js
- * Handles scoring system and daily quest UI for RelaPitch application
+ * Handles scoring system and quest UI for RelaPitch application
  */
 
+// Progress events are buffered and sent together to /log_progress/batch
+const PROGRESS_BATCH_URL = '/log_progress/batch';
+const PROGRESS_FLUSH_DELAY = 1000;  // ms to wait for more events before sending
+const PROGRESS_MAX_BATCH = 20;       // Send right away once this many are queued
+
+const progressQueue = [];
+let progressFlushTimer = null;
+
 // Main function to log user progress and update UI
 function logUserProgress(itemId, points, itemType) {
-    // Create request data
-    const requestData = {
+    progressQueue.push({
         itemId: itemId,
         points: points,
         itemType: itemType
-    };
+    });
 
-    // Send request to server
-    fetch('/log_progress', {
+    if (progressQueue.length >= PROGRESS_MAX_BATCH) {
+        flushUserProgress();
+    } else if (progressFlushTimer === null) {
+        progressFlushTimer = setTimeout(flushUserProgress, PROGRESS_FLUSH_DELAY);
+    }
+}
+
+// Send every queued event in one request
+function flushUserProgress() {
+    clearTimeout(progressFlushTimer);
+    progressFlushTimer = null;
+    if (progressQueue.length === 0) return;
+
+    const events = progressQueue.splice(0, progressQueue.length);
+    fetch(PROGRESS_BATCH_URL, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
-        body: JSON.stringify(requestData)
+        body: JSON.stringify({ events: events })
+    })
+    .then(response => {
+        // A rejected batch won't get better by resending it
+        if (response.status === 400) {
+            console.error('Progress batch rejected:', events);
+            return null;
+        }
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        return response.json();
     })
-    .then(response => response.json())
     .then(data => {
+        if (!data) return;
+
+        // Offline: the service worker keeps the events and sends them when the connection is back
+        if (data.queued) {
+            showTemporaryFeedbackOnPage('#points-feedback', 'Saved offline');
+            return;
+        }
+
         // Always update the score display with the current score
         updateScoreDisplayOnPage(data.new_score);
-        
-        // Different feedback based on whether this was a new completion or not
-        if (data.status === "success_new_item") {
-            // Show points feedback for new item completions
+
+        // One message for the whole batch; items completed before earn nothing
+        if (data.awarded_item_points > 0) {
             showTemporaryFeedbackOnPage('#points-feedback', `+${data.awarded_item_points} points!`);
-        } else if (data.status === "success_item_already_completed") {
-            // Show a more subtle confirmation for already completed items
-            // Optional: You can enable this for subtle feedback or comment it out for no feedback
-            // showTemporaryFeedbackOnPage('#points-feedback', 'Already completed', 1000);
         }
-        
-        // Update daily quest display regardless of item completion status
-        updateDailyQuestDisplay(data.daily_quest_update);
+
+        // Update quest display regardless of item completion status
+        updateQuestDisplay(data.quests);
     })
     .catch(error => {
         console.error('Error logging progress:', error);
+        // Put the events back so the next flush retries them, oldest first
+        progressQueue.unshift(...events);
+    });
+}
+
+// The page may never come back once hidden, so hand pending events to the browser
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState !== 'hidden' || progressQueue.length === 0) return;
+    const body = JSON.stringify({ events: progressQueue.splice(0, progressQueue.length) });
+    clearTimeout(progressFlushTimer);
+    progressFlushTimer = null;
+    if (!navigator.sendBeacon || !navigator.sendBeacon(PROGRESS_BATCH_URL, body)) {
+        fetch(PROGRESS_BATCH_URL, { method: 'POST', body: body, keepalive: true });
+    }
+});
+
+// Offline mode: the service worker precaches lessons and queues progress while offline
+function registerServiceWorker() {
+    const script = document.querySelector('meta[name="relapitch-service-worker"]');
+    if (!script || !('serviceWorker' in navigator)) return;
+
+    navigator.serviceWorker.register(script.content, { scope: '/' })
+    .catch(error => {
+        console.error('Service worker registration failed:', error);
+    });
+
+    // Once queued requests have been replayed, show the score and quests they earned
+    navigator.serviceWorker.addEventListener('message', event => {
+        if (event.data && event.data.type === 'replayed') loadUserStatus();
     });
 }
 
+// Ask the service worker to send what it queued while offline
+function replayOfflineQueue() {
+    if (navigator.serviceWorker && navigator.serviceWorker.controller) {
+        navigator.serviceWorker.controller.postMessage({ type: 'replay' });
+    }
+}
+
+window.addEventListener('online', replayOfflineQueue);
+
 // Update score display on the page
 function updateScoreDisplayOnPage(newScore) {
     // Update all elements with the score-display class
@@ -67,43 +136,59 @@ function showTemporaryFeedbackOnPage(elementSelector, message) {
     }
 }
 
-// Update daily quest display
-function updateDailyQuestDisplay(questData) {
-    const questWidget = document.querySelector('#daily-quest-widget');
-    if (!questWidget) return;
-    
-    // Get quest elements
-    const questTitle = questWidget.querySelector('.quest-title');
-    const questProgress = questWidget.querySelector('.quest-progress');
-    const questStatus = questWidget.querySelector('.quest-status');
-    
-    // Update quest title
-    if (questTitle) {
-        questTitle.textContent = questData.quest_description;
-    }
-    
-    // Update quest progress
-    if (questProgress) {
-        questProgress.textContent = `Progress: ${questData.quest_progress} / ${questData.quest_goal}`;
-        
-        // Calculate progress percentage for progress bar if it exists
-        const progressBar = questWidget.querySelector('.progress-bar');
-        if (progressBar) {
-            const progressPercent = (questData.quest_progress / questData.quest_goal) * 100;
-            progressBar.style.width = `${Math.min(progressPercent, 100)}%`;
+// Update the quest widget cards (one per active quest)
+function updateQuestDisplay(quests) {
+    if (!Array.isArray(quests)) return;
+
+    quests.forEach(questData => {
+        const questWidget = document.querySelector(`.quest-widget[data-quest-id="${questData.quest_id}"]`);
+        if (!questWidget) return;
+
+        // Get quest elements
+        const questTitle = questWidget.querySelector('.quest-title');
+        const questProgress = questWidget.querySelector('.quest-progress');
+        const questStatus = questWidget.querySelector('.quest-status');
+
+        // Update quest title
+        if (questTitle) {
+            questTitle.textContent = questData.quest_description;
         }
-    }
-    
-    // Update quest status
-    if (questStatus) {
-        if (questData.quest_completed) {
-            questStatus.textContent = `Completed! +${questData.quest_reward_points || ''} points!`;
-            questStatus.classList.add('completed');
-        } else {
-            questStatus.textContent = 'In Progress';
-            questStatus.classList.remove('completed');
+
+        // Update quest progress
+        if (questProgress) {
+            questProgress.textContent = `Progress: ${questData.quest_progress} / ${questData.quest_goal}`;
+
+            const progressBar = questWidget.querySelector('.quest-progress-bar');
+            if (progressBar && questData.quest_goal > 0) {
+                const progressPercent = (questData.quest_progress / questData.quest_goal) * 100;
+                progressBar.style.width = `${Math.min(progressPercent, 100)}%`;
+            }
         }
-    }
+
+        // Update quest status
+        if (questStatus) {
+            if (questData.quest_completed) {
+                questStatus.textContent = `Completed! +${questData.quest_reward_points} points!`;
+                questStatus.classList.add('completed');
+            } else {
+                questStatus.textContent = 'In Progress';
+                questStatus.classList.remove('completed');
+            }
+        }
+    });
+}
+
+// Fetch the per-user parts of a shared page (score, quests)
+function loadUserStatus() {
+    fetch('/user/status', { credentials: 'same-origin' })
+    .then(response => response.json())
+    .then(data => {
+        updateScoreDisplayOnPage(data.score);
+        updateQuestDisplay(data.quests);
+    })
+    .catch(error => {
+        console.error('Error loading user status:', error);
+    });
 }
 
 // Handle quiz answer submissions and update score/quest UI
@@ -139,8 +224,8 @@ function handleQuizSubmit(questionId, answer, mode) {
             showTemporaryFeedbackOnPage('#answer-feedback', `Incorrect. The correct answer was ${data.correct_answer}.`);
         }
         
-        // Update daily quest display
-        updateDailyQuestDisplay(data.daily_quest_update);
+        // Update quest display
+        updateQuestDisplay(data.quests);
         
         // Additional logic for continuing to next question or showing results
         // would go here depending on your application flow
@@ -177,14 +262,11 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
-    // Initialize daily quest display if quest data is available
-    const questDataElement = document.querySelector('#quest-data');
-    if (questDataElement) {
-        try {
-            const questData = JSON.parse(questDataElement.dataset.questInfo);
-            updateDailyQuestDisplay(questData);
-        } catch (e) {
-            console.error('Error initializing quest display:', e);
-        }
+    registerServiceWorker();
+    if (navigator.onLine) replayOfflineQueue();
+
+    // Cached pages are rendered without the user's score; fetch it separately
+    if (document.querySelector('[data-user-status]')) {
+        loadUserStatus();
     }
 });
@@ -37,33 +37,18 @@ document.addEventListener('DOMContentLoaded', () => {
     const noteTimers = {}; // Track when each note was played
     let isAudioInitialized = false;
 
-    // Initialize Tone.js and the sampler
+    // Notes come from the server-rendered sample pack (one request for all of them)
+    const noteBank = NoteBank.fromPage();
+
     const initTone = async () => {
-        if (isAudioInitialized) return;
-        
         try {
-            // Create and start the audio context immediately
-            const context = new AudioContext();
-            await context.resume();
-            
-            // Initialize Tone.js with the existing context
-            Tone.setContext(context);
-            await Tone.start();
-            console.log("Tone.js started successfully");
-            
-            sampler = new Tone.Sampler({
-                urls: {
-                    "C4": "C4.mp3",
-                    "D#4": "Ds4.mp3",
-                    "F#4": "Fs4.mp3",
-                    "A4": "A4.mp3",
-                },
-                baseUrl: "https://tonejs.github.io/audio/salamander/",
-                onload: () => {
-                    console.log("Sampler loaded");
-                    isAudioInitialized = true;
-                }
-            }).toDestination();
+            await noteBank.load();
+            await noteBank.resume();
+            if (!isAudioInitialized) {
+                sampler = noteBank;
+                console.log("Sampler loaded");
+                isAudioInitialized = true;
+            }
         } catch (error) {
             console.error("Error initializing audio:", error);
         }
@@ -605,17 +590,14 @@ document.addEventListener('DOMContentLoaded', () => {
                         return;
                     }
 
-                    const currentNote = extractNoteLetter(tuner.currentNote);
-                    const targetNote = 'G'
-                    
-                    const noteOrder = ['C', 'D', 'E', 'F', 'G', 'A', 'B'];
-                    const currentIndex = noteOrder.indexOf(currentNote);
-                    const targetIndex = noteOrder.indexOf(targetNote);
+                    // Same check as the server's grading: cents from the target, in whichever octave is sung
+                    const cents = MusicTheory.centsFrom(tuner.currentFrequency, 'G4', true);
+                    if (cents === null) return;
                     
-                    if (currentIndex < targetIndex) {
+                    if (cents < -SING_TOLERANCE_CENTS) {
                         feedbackElement.textContent = "Sing higher";
                         feedbackElement.style.color = '#dc3545'; // Red
-                    } else if (currentIndex > targetIndex) {
+                    } else if (cents > SING_TOLERANCE_CENTS) {
                         feedbackElement.textContent = "Sing lower";
                         feedbackElement.style.color = '#dc3545'; // Red
                     } else {
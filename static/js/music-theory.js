@@ -0,0 +1,74 @@
+/**
+ * music-theory.js
+ * Note, frequency and interval lookups from the server's tables
+ * (static/data/music-theory.json, written by music_theory.py), so every
+ * page uses the same note math as the grading on the server.
+ */
+
+// Sung notes within this many cents of the target count as right (as in quiz_set.py)
+const SING_TOLERANCE_CENTS = 50;
+
+const MusicTheory = {
+    tables: null,
+    loading: null,
+    firstMidi: 0,
+    midiByName: {},
+
+    // Fetch the tables once, from the page's <link id="musicTheoryTables"> unless a URL is given
+    load(url) {
+        if (!this.loading) {
+            const link = document.getElementById('musicTheoryTables');
+            this.loading = fetch(url || link.href)
+                .then(response => response.json())
+                .then(tables => {
+                    this.tables = tables;
+                    this.firstMidi = tables.notes[0].midi;
+                    tables.notes.forEach(note => {
+                        this.midiByName[note.name] = note.midi;
+                    });
+                    return this;
+                });
+        }
+        return this.loading;
+    },
+
+    get isReady() {
+        return this.tables !== null;
+    },
+
+    // Nearest note to a frequency and how far off it is: { name, midi, cents }, or null
+    nearestNote(frequency) {
+        if (!this.tables || !(frequency > 0)) return null;
+        const exact = 69 + 12 * Math.log2(frequency / this.tables.a4);
+        const midi = Math.round(exact);
+        const note = this.tables.notes[midi - this.firstMidi];
+        if (!note) return null;
+        return { name: note.name, midi: midi, cents: (exact - midi) * 100 };
+    },
+
+    noteFrequency(name) {
+        const midi = this.midiByName[name];
+        return midi === undefined ? null : this.tables.notes[midi - this.firstMidi].frequency;
+    },
+
+    // "C#4" or "C#" -> 1; -1 for anything that isn't a note
+    pitchClass(note) {
+        if (!this.tables || !note) return -1;
+        const pitchClass = this.tables.pitchClasses[note.replace(/-?\d+$/, '')];
+        return pitchClass === undefined ? -1 : pitchClass;
+    },
+
+    // Signed cents from a note; with octaveEquivalent, from its nearest octave (as the server grades singing)
+    centsFrom(frequency, name, octaveEquivalent = false) {
+        const reference = this.noteFrequency(name);
+        if (!reference || !(frequency > 0)) return null;
+        const cents = 1200 * Math.log2(frequency / reference);
+        return octaveEquivalent ? ((cents + 600) % 1200 + 1200) % 1200 - 600 : cents;
+    },
+
+    interval(semitones) {
+        return this.tables ? this.tables.intervals.find(interval => interval.semitones === semitones) || null : null;
+    }
+};
+
+window.MusicTheory = MusicTheory;
@@ -0,0 +1,130 @@
+/**
+ * note-bank.js
+ * Plays notes from the server-rendered sample pack. The whole pack is one
+ * audio file, so every note a page needs arrives in a single request.
+ * Exposes the same triggerAttack / triggerRelease / triggerAttackRelease
+ * calls the pages used with Tone.Sampler.
+ */
+class NoteBank {
+    constructor(manifest) {
+        this.manifest = manifest;
+        this.context = null;
+        this.buffer = null;
+        this.loading = null;
+        this.voices = {};
+    }
+
+    // Build a bank from the manifest the server embeds in the page
+    static fromPage(elementId = 'noteBankManifest') {
+        const element = document.getElementById(elementId);
+        return new NoteBank(JSON.parse(element.textContent));
+    }
+
+    get isReady() {
+        return this.buffer !== null;
+    }
+
+    // Fetch and decode the pack (only once, however often it's called)
+    load() {
+        if (!this.loading) {
+            this.context = new (window.AudioContext || window.webkitAudioContext)();
+            this.loading = fetch(this.manifest.pack)
+                .then(response => response.arrayBuffer())
+                .then(data => this.context.decodeAudioData(data))
+                .then(buffer => {
+                    this.buffer = buffer;
+                    return this;
+                });
+        }
+        return this.loading;
+    }
+
+    // Browsers keep audio suspended until the user interacts with the page
+    async resume() {
+        if (this.context && this.context.state === 'suspended') {
+            await this.context.resume();
+        }
+    }
+
+    static noteToMidi(note) {
+        const names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'];
+        const match = /^([A-G]#?)(-?\d)$/.exec(note);
+        if (!match) return null;
+        return (parseInt(match[2], 10) + 1) * 12 + names.indexOf(match[1]);
+    }
+
+    // Find the slot for a note; notes outside the pack are pitch-shifted from the nearest one
+    findSlot(note) {
+        const offsets = this.manifest.offsets;
+        if (offsets[note]) {
+            return { offset: offsets[note][0], duration: offsets[note][1], rate: 1 };
+        }
+        const midi = NoteBank.noteToMidi(note);
+        if (midi === null) return null;
+
+        let nearest = null;
+        let nearestDistance = Infinity;
+        Object.keys(offsets).forEach(candidate => {
+            const distance = Math.abs(NoteBank.noteToMidi(candidate) - midi);
+            if (distance < nearestDistance) {
+                nearest = candidate;
+                nearestDistance = distance;
+            }
+        });
+        if (nearest === null) return null;
+        return {
+            offset: offsets[nearest][0],
+            duration: offsets[nearest][1],
+            rate: Math.pow(2, (midi - NoteBank.noteToMidi(nearest)) / 12)
+        };
+    }
+
+    triggerAttack(note) {
+        if (!this.isReady) return;
+        const slot = this.findSlot(note);
+        if (!slot) {
+            console.error("Note not available:", note);
+            return;
+        }
+        this.triggerRelease(note);
+
+        const source = this.context.createBufferSource();
+        source.buffer = this.buffer;
+        source.playbackRate.value = slot.rate;
+        const gain = this.context.createGain();
+        source.connect(gain).connect(this.context.destination);
+        source.start(0, slot.offset, slot.duration);
+        this.voices[note] = { source, gain };
+        source.onended = () => {
+            if (this.voices[note] && this.voices[note].source === source) {
+                delete this.voices[note];
+            }
+        };
+    }
+
+    triggerRelease(note) {
+        const voice = this.voices[note];
+        if (!voice) return;
+        delete this.voices[note];
+        // Short fade so the release doesn't click
+        const now = this.context.currentTime;
+        voice.gain.gain.setValueAtTime(voice.gain.gain.value, now);
+        voice.gain.gain.linearRampToValueAtTime(0, now + 0.1);
+        voice.source.stop(now + 0.1);
+    }
+
+    // duration is in seconds, either a number or a Tone-style string like "2s"
+    triggerAttackRelease(note, duration) {
+        this.triggerAttack(note);
+        const voice = this.voices[note];
+        const seconds = parseFloat(duration);
+        setTimeout(() => {
+            // Leave the note alone if it has been played again since
+            if (this.voices[note] === voice) {
+                this.triggerRelease(note);
+            }
+        }, seconds * 1000);
+    }
+}
+
+window.NoteBank = NoteBank;
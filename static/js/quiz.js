@@ -10,31 +10,27 @@ document.addEventListener('DOMContentLoaded', async () => {
         options: []
     };
     let hasAnswered = false;
+    // Response times are measured from the page load or the last time the prompt was played
+    let promptPlayedAt = performance.now();
+
+    // Notes come from the server-rendered sample pack (one request for all of them)
+    const noteBank = NoteBank.fromPage();
 
-    // Initialize Tone.js sampler
     async function initSampler() {
         try {
-            await Tone.start();
-            sampler = new Tone.Sampler({
-                urls: {
-                    "C4": "C4.mp3",
-                    "D#4": "Ds4.mp3",
-                    "F#4": "Fs4.mp3",
-                    "A4": "A4.mp3",
-                },
-                baseUrl: "https://tonejs.github.io/audio/salamander/",
-                onload: () => {
-                    console.log("Sampler loaded successfully");
-                    isSamplerReady = true;
-                    // Enable all play buttons
-                    document.querySelectorAll('.btn-primary').forEach(btn => {
-                        if (btn.id.includes('play')) {
-                            btn.disabled = false;
-                        }
-                    });
-                }
-            }).toDestination();
-            console.log("Sampler initialized successfully");
+            await noteBank.load();
+            await noteBank.resume();
+            if (!isSamplerReady) {
+                sampler = noteBank;
+                console.log("Sampler loaded successfully");
+                isSamplerReady = true;
+                // Enable all play buttons
+                document.querySelectorAll('.btn-primary').forEach(btn => {
+                    if (btn.id.includes('play')) {
+                        btn.disabled = false;
+                    }
+                });
+            }
         } catch (error) {
             console.error("Error initializing sampler:", error);
         }
@@ -108,20 +104,84 @@ document.addEventListener('DOMContentLoaded', async () => {
         }
     }
 
+    // Upload a recording in chunks; a chunk that fails is resent from wherever the server got to
+    const UPLOAD_CHUNK_BYTES = 64 * 1024;
+    const UPLOAD_RETRIES = 3;
+
+    async function uploadRecording(recording) {
+        const start = await fetch('/clips/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ length: recording.size })
+        });
+        if (!start.ok) throw new Error('Could not start the upload');
+        const { upload_id: uploadId } = await start.json();
+
+        let offset = 0;
+        let retries = 0;
+        while (offset < recording.size) {
+            try {
+                const response = await fetch(`/clips/uploads/${uploadId}`, {
+                    method: 'PATCH',
+                    headers: { 'Upload-Offset': String(offset) },
+                    body: recording.slice(offset, offset + UPLOAD_CHUNK_BYTES)
+                });
+                const result = await response.json();
+                if (!response.ok && response.status !== 409) throw new Error(result.error);
+                offset = result.offset;
+            } catch (error) {
+                if (++retries > UPLOAD_RETRIES) throw error;
+                const status = await fetch(`/clips/uploads/${uploadId}`).then(response => response.json());
+                offset = status.offset;
+            }
+        }
+        return uploadId;
+    }
+
     // Submit answer to server
-    async function submitAnswer(answer) {
+    async function submitAnswer(answer, recording = null) {
         try {
             console.log("Submitting answer:", answer, "for question:", currentQuestion.id);
-            const response = await fetch('/quiz/submit', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    question_id: currentQuestion.id,
-                    answer: answer
-                })
-            });
+            const responseMs = Math.round(performance.now() - promptPlayedAt);
+            let request;
+            const uploadId = recording ? await uploadRecording(recording).catch(error => {
+                console.warn('Chunked upload failed, attaching the recording instead:', error);
+                return null;
+            }) : null;
+            if (uploadId) {
+                // The server grades (and keeps) the recording it already has
+                request = {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        question_id: currentQuestion.id,
+                        answer: answer,
+                        response_ms: responseMs,
+                        upload_id: uploadId
+                    })
+                };
+            } else if (recording) {
+                // Send the recording along so the server can grade the sung note itself
+                const formData = new FormData();
+                formData.append('question_id', currentQuestion.id);
+                formData.append('answer', answer);
+                formData.append('response_ms', responseMs);
+                formData.append('audio', recording, 'attempt.wav');
+                request = { method: 'POST', body: formData };
+            } else {
+                request = {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        question_id: currentQuestion.id,
+                        answer: answer,
+                        response_ms: responseMs
+                    })
+                };
+            }
+            const response = await fetch('/quiz/submit', request);
             
             if (!response.ok) {
                 throw new Error('Failed to submit answer');
@@ -129,6 +189,18 @@ document.addEventListener('DOMContentLoaded', async () => {
             
             const result = await response.json();
             console.log("Answer submitted successfully:", result);
+            if (result.queued) {
+                // Offline: the service worker sends the answer later, so grade it here for now
+                const correctAnswer = currentQuestion.answer;
+                const isCorrect = currentQuestion.type === 'interval'
+                    ? answer === correctAnswer
+                    : MusicTheory.pitchClass(answer) === MusicTheory.pitchClass(correctAnswer);
+                Object.assign(result, {
+                    is_correct: isCorrect,
+                    correct_answer: correctAnswer,
+                    points_awarded: 0
+                });
+            }
             
             // Show feedback
             if (result.is_correct) {
@@ -156,12 +228,11 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     // Helper function to validate note
     function isValidNote(note) {
-        const validNotes = ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C#', 'D#', 'F#', 'G#', 'A#'];
-        return validNotes.includes(note);
+        return MusicTheory.pitchClass(note) >= 0;
     }
 
     // Initialize the quiz
-    await initSampler();
+    await Promise.all([initSampler(), MusicTheory.load()]);
     
     // Get question data from the page
     const questionDataElement = document.getElementById('questionData');
@@ -189,6 +260,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         playTargetBtn.addEventListener('click', () => {
             console.log("Playing target note:", currentQuestion.target_note);
             playNote(currentQuestion.target_note);
+            promptPlayedAt = performance.now();
         });
     }
     
@@ -233,6 +305,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         playReferenceSingBtn.addEventListener('click', () => {
             console.log("Playing reference note for singing:", currentQuestion.reference_note);
             playNote(currentQuestion.reference_note);
+            promptPlayedAt = performance.now();
         });
     }
     
@@ -334,18 +407,14 @@ document.addEventListener('DOMContentLoaded', async () => {
                         return;
                     }
 
-                    const referenceNote = currentQuestion.reference_note[0];
-                    const currentNote = extractNoteLetter(tuner.currentNote);
-                    const targetNote = currentQuestion.target_note[0];
-                    
-                    const noteOrder = ['C', 'D', 'E', 'F', 'G', 'A', 'B'];
-                    const currentIndex = noteOrder.indexOf(currentNote);
-                    const targetIndex = noteOrder.indexOf(targetNote);
+                    // Same check as the server's grading: cents from the target, in whichever octave is sung
+                    const cents = MusicTheory.centsFrom(tuner.currentFrequency, currentQuestion.target_note, true);
+                    if (cents === null) return;
                     
-                    if (currentIndex < targetIndex) {
+                    if (cents < -SING_TOLERANCE_CENTS) {
                         feedbackElement.textContent = "Sing higher";
                         feedbackElement.style.color = '#dc3545'; // Red
-                    } else if (currentIndex > targetIndex) {
+                    } else if (cents > SING_TOLERANCE_CENTS) {
                         feedbackElement.textContent = "Sing lower";
                         feedbackElement.style.color = '#dc3545'; // Red
                     } else {
@@ -372,33 +441,13 @@ document.addEventListener('DOMContentLoaded', async () => {
         });
     }
 
-    // Helper function to get frequency of a note
-    function getNoteFrequency(note) {
-        // This is a simplified version - in a real app, you'd want a more accurate conversion
-        const notes = {
-            'C4': 261.63,
-            'C#4': 277.18,
-            'D4': 293.66,
-            'D#4': 311.13,
-            'E4': 329.63,
-            'F4': 349.23,
-            'F#4': 369.99,
-            'G4': 392.00,
-            'G#4': 415.30,
-            'A4': 440.00,
-            'A#4': 466.16,
-            'B4': 493.88
-        };
-        return notes[note] || 440; // Default to A4 if note not found
-    }
-
     if (submitRecordingBtn) {
         submitRecordingBtn.addEventListener('click', async () => {
             if (hasAnswered) return; // Prevent multiple submissions
             
             // Get the current note from the tuner and extract just the note letter
             const fullNote = tuner.currentNote;
-            const noteLetter = extractNoteLetter(fullNote);
+            let noteLetter = extractNoteLetter(fullNote);
             
             // Validate the note
             if (!isValidNote(noteLetter)) {
@@ -408,8 +457,11 @@ document.addEventListener('DOMContentLoaded', async () => {
             
             console.log("Submitting recorded note:", noteLetter);
             
-            // Submit answer
-            const result = await submitAnswer(noteLetter);
+            // Submit answer together with the recording
+            const result = await submitAnswer(noteLetter, tuner.getRecordingWav());
+            if (result && result.pitch_analysis && result.pitch_analysis.note) {
+                noteLetter = extractNoteLetter(result.pitch_analysis.note);
+            }
             
             // Visual feedback for sing mode
             const noteDisplay = document.createElement('div');
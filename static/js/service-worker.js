@@ -0,0 +1,250 @@
+/**
+ * service-worker.js
+ * Offline mode (see offline.py). Precaches the lesson pages, scripts,
+ * styles and note samples listed in /offline/manifest.json, and queues
+ * progress and quiz submissions in IndexedDB while the network is down,
+ * replaying them in order once it's back.
+ */
+
+// Registered as /service-worker.js?v=<precache version>, so a new version is a new worker
+const VERSION = new URL(self.location).searchParams.get('v') || 'dev';
+const PRECACHE_PREFIX = 'relapitch-precache-';
+const PRECACHE = `${PRECACHE_PREFIX}${VERSION}`;
+const RUNTIME = 'relapitch-runtime';
+const RUNTIME_MAX_ENTRIES = 50;
+const MANIFEST_URL = '/offline/manifest.json';
+const PROGRESS_URL = '/log_progress';
+const PROGRESS_BATCH_URL = '/log_progress/batch';
+const SYNC_TAG = 'relapitch-replay';
+
+const QUEUE_DB = 'relapitch-offline';
+const QUEUE_STORE = 'requests';
+
+// Precache
+
+self.addEventListener('install', event => {
+    event.waitUntil((async () => {
+        const response = await fetch(MANIFEST_URL, { cache: 'no-store' });
+        if (!response.ok) throw new Error(`Precache manifest: HTTP ${response.status}`);
+        const manifest = await response.clone().json();
+        const cache = await caches.open(PRECACHE);
+        await cache.put(MANIFEST_URL, response);
+
+        // Our own files must all be cached; CDN files only if the CDN lets us
+        const local = manifest.urls.filter(url => new URL(url, self.location).origin === self.location.origin);
+        const remote = manifest.urls.filter(url => !local.includes(url));
+        await cache.addAll(local);
+        await Promise.allSettled(remote.map(url => cache.add(url)));
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        const names = await caches.keys();
+        await Promise.all(names
+            .filter(name => name.startsWith(PRECACHE_PREFIX) && name !== PRECACHE)
+            .map(name => caches.delete(name)));
+        await self.clients.claim();
+        await replayQueue();
+    })());
+});
+
+async function getManifest() {
+    const response = await caches.match(MANIFEST_URL, { cacheName: PRECACHE });
+    return response ? response.json() : null;
+}
+
+// Fetch handling
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    const sameOrigin = url.origin === self.location.origin;
+
+    if (request.method === 'POST' && sameOrigin) {
+        event.respondWith(sendOrQueue(request, url));
+    } else if (request.method !== 'GET') {
+        return;
+    } else if (sameOrigin && isPage(request, url)) {
+        event.respondWith(pageResponse(request));
+    } else if (!sameOrigin || url.pathname.startsWith('/static/') || url.pathname.startsWith('/audio/notes/')) {
+        event.respondWith(cachedResponse(request));
+    }
+});
+
+// Question pages are prefetched one ahead, so they are handled like navigations
+function isPage(request, url) {
+    return request.mode === 'navigate' || /^\/quiz\/\d+$/.test(url.pathname);
+}
+
+// Precached pages (lessons) come from the cache; others from the network, falling back to the last copy
+async function pageResponse(request) {
+    const precached = await caches.match(request, { cacheName: PRECACHE });
+    if (precached) return precached;
+    try {
+        const response = await fetch(request);
+        if (response.ok) await putRuntime(request, response.clone());
+        return response;
+    } catch (error) {
+        const cached = await caches.match(request, { cacheName: RUNTIME });
+        if (cached) return cached;
+        return new Response('<h1>You are offline</h1><p>This page has not been saved for offline use yet. ' +
+                            'Lessons are always available.</p>',
+                            { status: 503, headers: { 'Content-Type': 'text/html; charset=utf-8' } });
+    }
+}
+
+// Static files have content hashes in their names, so a cached copy is always current
+async function cachedResponse(request) {
+    const cached = await caches.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok || response.type === 'opaque') await putRuntime(request, response.clone());
+    return response;
+}
+
+async function putRuntime(request, response) {
+    const cache = await caches.open(RUNTIME);
+    await cache.put(request, response);
+    const keys = await cache.keys();
+    // Keys come back oldest first
+    await Promise.all(keys.slice(0, Math.max(0, keys.length - RUNTIME_MAX_ENTRIES)).map(key => cache.delete(key)));
+}
+
+// Offline queue
+
+async function sendOrQueue(request, url) {
+    const manifest = await getManifest();
+    if (!manifest || !manifest.queued_endpoints.includes(url.pathname)) {
+        return fetch(request);
+    }
+
+    const entry = {
+        url: url.pathname,
+        contentType: request.headers.get('Content-Type'),
+        body: await request.clone().blob(),
+        queuedAt: Date.now()
+    };
+    // Anything queued earlier goes first, so the server sees events in order
+    await replayQueue();
+    try {
+        return await fetch(request);
+    } catch (error) {
+        // Only network failures get here; HTTP errors are real answers
+        await queueRequest(entry);
+        if (self.registration.sync) {
+            self.registration.sync.register(SYNC_TAG).catch(() => {});
+        }
+        return new Response(JSON.stringify({ success: true, queued: true }),
+                            { status: 202, headers: { 'Content-Type': 'application/json' } });
+    }
+}
+
+let replaying = null;
+
+// Send queued requests until the queue is empty or the network fails again
+function replayQueue() {
+    if (!replaying) {
+        replaying = drainQueue()
+            .catch(error => console.warn('Offline queue not replayed yet:', error))
+            .finally(() => { replaying = null; });
+    }
+    return replaying;
+}
+
+async function drainQueue() {
+    const manifest = await getManifest();
+    const maxBatch = manifest ? manifest.max_progress_batch : 100;
+    let sent = false;
+    for (;;) {
+        const entries = await queueStore('readonly', store => store.getAll());
+        if (entries.length === 0) break;
+
+        let response;
+        let ids;
+        if (entries[0].url === PROGRESS_URL || entries[0].url === PROGRESS_BATCH_URL) {
+            // Consecutive progress requests go out as one batch
+            const events = [];
+            ids = [];
+            for (const entry of entries) {
+                if (entry.url !== PROGRESS_URL && entry.url !== PROGRESS_BATCH_URL) break;
+                const entryEvents = await progressEvents(entry);
+                if (ids.length > 0 && events.length + entryEvents.length > maxBatch) break;
+                events.push(...entryEvents);
+                ids.push(entry.id);
+            }
+            response = events.length === 0 ? null : await fetch(PROGRESS_BATCH_URL, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ events: events })
+            });
+        } else {
+            const entry = entries[0];
+            ids = [entry.id];
+            response = await fetch(entry.url, {
+                method: 'POST',
+                headers: entry.contentType ? { 'Content-Type': entry.contentType } : {},
+                body: entry.body
+            });
+        }
+
+        // Server errors and rate limits may pass; a rejected request won't get better by resending it
+        if (response && (response.status >= 500 || response.status === 429)) break;
+        await queueStore('readwrite', store => ids.forEach(id => store.delete(id)));
+        sent = true;
+    }
+
+    if (sent) {
+        // Let open pages refresh the score and quests
+        const clients = await self.clients.matchAll();
+        clients.forEach(client => client.postMessage({ type: 'replayed' }));
+    }
+}
+
+async function progressEvents(entry) {
+    try {
+        const data = JSON.parse(await entry.body.text());
+        if (entry.url === PROGRESS_BATCH_URL) return Array.isArray(data.events) ? data.events : [];
+        return [{ itemId: data.itemId, points: data.points, itemType: data.itemType }];
+    } catch (error) {
+        return [];
+    }
+}
+
+function queueRequest(entry) {
+    return queueStore('readwrite', store => store.add(entry));
+}
+
+// Run work(store) in a transaction; resolves with the result of the request it returns, if any
+function queueStore(mode, work) {
+    return new Promise((resolve, reject) => {
+        const open = indexedDB.open(QUEUE_DB, 1);
+        open.onupgradeneeded = () => {
+            open.result.createObjectStore(QUEUE_STORE, { keyPath: 'id', autoIncrement: true });
+        };
+        open.onerror = () => reject(open.error);
+        open.onsuccess = () => {
+            const db = open.result;
+            const transaction = db.transaction(QUEUE_STORE, mode);
+            const request = work(transaction.objectStore(QUEUE_STORE));
+            transaction.oncomplete = () => {
+                db.close();
+                resolve(request ? request.result : undefined);
+            };
+            transaction.onerror = () => {
+                db.close();
+                reject(transaction.error);
+            };
+        };
+    });
+}
+
+self.addEventListener('sync', event => {
+    if (event.tag === SYNC_TAG) event.waitUntil(replayQueue());
+});
+
+// Pages ask for a replay when the browser says the connection is back
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'replay') event.waitUntil(replayQueue());
+});
@@ -1,14 +1,27 @@
 class Tuner {
-    constructor() {
+    // Pass { stream: true } to have the server track the pitch over a WebSocket
+    // instead of running the autocorrelation in the browser
+    constructor(options = {}) {
         this.audioContext = null;
         this.analyser = null;
         this.mediaStream = null;
         this.isRunning = false;
         this.onNoteDetected = null;
+        this.timeDomainBuffer = null;
+
+        this.streamToServer = Boolean(options.stream);
+        this.socket = null;
+
+        // Rolling recording of the last few seconds, sent to the server for grading
+        this.recorder = null;
+        this.recording = null;
+        this.recordingLength = 0;
+        this.recordingOffset = 0;
     }
 
     async start() {
         if (this.isRunning) return;
+        await MusicTheory.load();
 
         try {
             // Request microphone access first
@@ -25,12 +38,19 @@ class Tuner {
             this.analyser = this.audioContext.createAnalyser();
             this.analyser.fftSize = 2048;
 
+            this.timeDomainBuffer = new Float32Array(this.analyser.frequencyBinCount);
+
             this.mediaStream = stream;
             const source = this.audioContext.createMediaStreamSource(stream);
             source.connect(this.analyser);
+            this.startRecording(source);
 
             this.isRunning = true;
-            this.updatePitch();
+            if (this.streamToServer) {
+                this.openStream();
+            } else {
+                this.updatePitch();
+            }
             console.log("Tuner started successfully");
         } catch (error) {
             console.error('Error starting tuner:', error);
@@ -44,6 +64,14 @@ class Tuner {
         if (this.mediaStream) {
             this.mediaStream.getTracks().forEach(track => track.stop());
         }
+        if (this.recorder) {
+            this.recorder.disconnect();
+            this.recorder = null;
+        }
+        if (this.socket) {
+            this.socket.close();
+            this.socket = null;
+        }
         if (this.audioContext) {
             this.audioContext.close();
         }
@@ -51,17 +79,107 @@ class Tuner {
         console.log("Tuner stopped");
     }
 
+    startRecording(source) {
+        // Keep the last RECORDING_SECONDS of audio in a ring buffer
+        const RECORDING_SECONDS = 2;
+        this.recording = new Float32Array(Math.round(this.audioContext.sampleRate * RECORDING_SECONDS));
+        this.recordingLength = 0;
+        this.recordingOffset = 0;
+
+        this.recorder = this.audioContext.createScriptProcessor(4096, 1, 1);
+        this.recorder.onaudioprocess = (event) => {
+            const input = event.inputBuffer.getChannelData(0);
+            this.sendToStream(input);
+            for (let i = 0; i < input.length; i++) {
+                this.recording[this.recordingOffset] = input[i];
+                this.recordingOffset = (this.recordingOffset + 1) % this.recording.length;
+            }
+            this.recordingLength = Math.min(this.recordingLength + input.length, this.recording.length);
+        };
+        source.connect(this.recorder);
+        // Chrome only runs the processor while it's connected to an output
+        this.recorder.connect(this.audioContext.destination);
+    }
+
+    // Return the recorded audio as a 16-bit mono WAV blob, or null if nothing was recorded
+    getRecordingWav() {
+        if (!this.recording || this.recordingLength === 0) return null;
+
+        const length = this.recordingLength;
+        const sampleRate = this.audioContext.sampleRate;
+        const buffer = new ArrayBuffer(44 + length * 2);
+        const view = new DataView(buffer);
+        const writeString = (offset, text) => {
+            for (let i = 0; i < text.length; i++) view.setUint8(offset + i, text.charCodeAt(i));
+        };
+
+        writeString(0, 'RIFF');
+        view.setUint32(4, 36 + length * 2, true);
+        writeString(8, 'WAVE');
+        writeString(12, 'fmt ');
+        view.setUint32(16, 16, true);
+        view.setUint16(20, 1, true);  // PCM
+        view.setUint16(22, 1, true);  // Mono
+        view.setUint32(24, sampleRate, true);
+        view.setUint32(28, sampleRate * 2, true);
+        view.setUint16(32, 2, true);
+        view.setUint16(34, 16, true);
+        writeString(36, 'data');
+        view.setUint32(40, length * 2, true);
+
+        // Oldest sample first
+        let index = (this.recordingOffset - length + this.recording.length) % this.recording.length;
+        for (let i = 0; i < length; i++) {
+            const sample = Math.max(-1, Math.min(1, this.recording[index]));
+            view.setInt16(44 + i * 2, sample < 0 ? sample * 0x8000 : sample * 0x7FFF, true);
+            index = (index + 1) % this.recording.length;
+        }
+        return new Blob([buffer], { type: 'audio/wav' });
+    }
+
+    openStream() {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const url = `${protocol}//${window.location.host}/ws/pitch?sample_rate=${this.audioContext.sampleRate}&encoding=float32`;
+        this.socket = new WebSocket(url);
+        this.socket.binaryType = 'arraybuffer';
+        this.socket.onmessage = (event) => {
+            const update = JSON.parse(event.data);
+            if (update.f0 && this.onNoteDetected) {
+                this.onNoteDetected({
+                    frequency: update.f0,
+                    note: update.note.replace(/[0-9]/g, '')
+                });
+            }
+        };
+        this.socket.onclose = () => {
+            // Fall back to detecting the pitch locally
+            this.socket = null;
+            if (this.isRunning && this.streamToServer) {
+                this.streamToServer = false;
+                this.updatePitch();
+            }
+        };
+    }
+
+    sendToStream(samples) {
+        const MAX_BUFFERED_BYTES = 64 * 1024;
+        if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
+        // If the connection is backed up, drop this chunk rather than queueing it
+        if (this.socket.bufferedAmount > MAX_BUFFERED_BYTES) return;
+        this.socket.send(samples);
+    }
+
     updatePitch() {
         if (!this.isRunning) return;
 
-        const bufferLength = this.analyser.frequencyBinCount;
-        const buffer = new Float32Array(bufferLength);
+        // Reuse the same buffer every frame instead of allocating a new one
+        const buffer = this.timeDomainBuffer;
         this.analyser.getFloatTimeDomainData(buffer);
 
         const ac = this.autoCorrelate(buffer, this.audioContext.sampleRate);
         
-        if (ac !== -1) {
-            const note = this.getNote(ac);
+        const note = ac !== -1 ? this.getNote(ac) : null;
+        if (note) {
             if (this.onNoteDetected) {
                 this.onNoteDetected({
                     frequency: ac,
@@ -118,17 +236,10 @@ class Tuner {
         return -1;
     }
 
+    // Note name without the octave, from the shared tables; null if out of range
     getNote(frequency) {
-        const notes = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"];
-        const a4 = 440;
-        const c0 = a4 * Math.pow(2, -4.75);
-        
-        if (frequency < c0) return "Too low";
-        
-        const h = Math.round(12 * Math.log2(frequency/c0));
-        const octave = Math.floor(h/12);
-        const noteIndex = h % 12;
-        return notes[noteIndex];
+        const note = MusicTheory.nearestNote(frequency);
+        return note ? note.name.replace(/-?\d+$/, '') : null;
     }
 }
 
@@ -0,0 +1,99 @@
+"""Non-blocking structured logging.
+
+Request handlers log through the "relapitch" logger, whose only handler
+puts records on a bounded in-memory queue. A QueueListener thread formats
+them as one JSON object per line and writes them to stderr, so a slow
+terminal or log collector never stalls a request. If the queue is full the
+record is dropped and counted instead of blocking (the count is exported
+on /metrics).
+
+The logger is process-wide, so each init_app replaces the previous app's
+handler and stops its listener after it has written what was queued.
+
+Extra fields are passed the standard way::
+
+    log.info('answer stored', extra={'question_id': 3, 'is_correct': True})
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+MAX_QUEUE = 10000
+
+_listener = None
+
+# Attributes every LogRecord has; anything else came from `extra`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking or raising"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message and traceback now (the arguments may change after the call),
+        # but leave the formatting to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def init_app(app, stream=None):
+    global _listener
+    log_queue = queue.Queue(app.config.get('LOG_QUEUE_SIZE', MAX_QUEUE))
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+
+    logger = logging.getLogger('relapitch')
+    logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = DroppingQueueHandler(log_queue)
+    logger.addHandler(handler)
+
+    if _listener is not None:
+        atexit.unregister(_listener.stop)
+        _listener.stop()
+    _listener = listener
+    atexit.register(listener.stop)
+
+    app.extensions['log_listener'] = listener
+    app.extensions['log_handler'] = handler
+    return logger